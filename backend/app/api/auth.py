@@ -1,28 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from authlib.integrations.starlette_client import OAuth
-from .. import models, schemas, database
-from ..services.auth import AuthService
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, database
+from ..services.auth import (
+    ACCESS_TOKEN_TTL, AuthService, DIRECTORY_FIELDS, USER_FIELDS, create_access_token, require_access_token,
+    require_same_user
+)
+from ..services.google import google_client, GoogleOAuthError, GOOGLE_CLIENT_ID, GOOGLE_REDIRECT_URI
+from datetime import datetime
+from typing import Optional
 import os
-from urllib.parse import quote_plus, urlencode
+from urllib.parse import quote_plus
 import httpx
 import secrets
 import base64
+import logging
 
-router = APIRouter()
-
-# Configurar OAuth manualmente sin server_metadata_url
-oauth = OAuth()
+logger = logging.getLogger(__name__)
 
-oauth.register(
-    name='google',
-    client_id=os.getenv('GOOGLE_CLIENT_ID'),
-    client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-    authorize_url='https://accounts.google.com/o/oauth2/v2/auth',
-    access_token_url='https://oauth2.googleapis.com/token',
-    client_kwargs={'scope': 'openid email profile'}
-)
+router = APIRouter()
 
 @router.get("/login")
 async def login(request: Request):
@@ -33,8 +29,8 @@ async def login(request: Request):
         
         # Parámetros para Google OAuth
         params = {
-            'client_id': os.getenv('GOOGLE_CLIENT_ID'),
-            'redirect_uri': 'http://localhost:8000/auth/callback',
+            'client_id': GOOGLE_CLIENT_ID,
+            'redirect_uri': GOOGLE_REDIRECT_URI,
             'scope': 'openid email profile',
             'response_type': 'code',
             'state': state,
@@ -45,14 +41,14 @@ async def login(request: Request):
         # Guardar state en la sesión
         request.session['oauth_state'] = state
         
-        # Construir URL de autorización
-        auth_url = f"https://accounts.google.com/o/oauth2/v2/auth?{urlencode(params)}"
+        # Construir URL de autorización (endpoint del documento de descubrimiento cacheado)
+        auth_url = await google_client.authorization_url(params)
         
-        print(f"Redirecting to: {auth_url}")
+        logger.debug("Redirecting to: %s", auth_url)
         return RedirectResponse(url=auth_url)
         
     except Exception as e:
-        print(f"Error en login: {e}")
+        logger.exception("Error en login: %s", e)
         return RedirectResponse(url=f"http://localhost:3000/auth/error?error={quote_plus(str(e))}")
 
 @router.get("/callback")
@@ -61,11 +57,11 @@ async def auth_callback(
     code: str = None, 
     state: str = None,
     error: str = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     """Callback de Google OAuth"""
     try:
-        print(f"Callback received - Code: {bool(code)}, State: {state}, Error: {error}")
+        logger.debug("Callback received", extra={"has_code": bool(code), "oauth_error": error})
         
         if error:
             raise HTTPException(status_code=400, detail=f"OAuth error: {error}")
@@ -78,65 +74,44 @@ async def auth_callback(
         # if state != stored_state:
         #     raise HTTPException(status_code=400, detail="Invalid state parameter")
         
-        # Intercambiar código por token
-        async with httpx.AsyncClient() as client:
-            token_data = {
-                'client_id': os.getenv('GOOGLE_CLIENT_ID'),
-                'client_secret': os.getenv('GOOGLE_CLIENT_SECRET'),
-                'code': code,
-                'grant_type': 'authorization_code',
-                'redirect_uri': 'http://localhost:8000/auth/callback'
-            }
-            
-            token_response = await client.post(
-                'https://oauth2.googleapis.com/token',
-                data=token_data,
-                headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            )
-            
-            if token_response.status_code != 200:
-                print(f"Token error: {token_response.text}")
-                raise HTTPException(status_code=400, detail="Failed to get access token")
-            
-            tokens = token_response.json()
-            access_token = tokens.get('access_token')
-            
-            if not access_token:
-                raise HTTPException(status_code=400, detail="No access token received")
-            
-            print(f"Access token received: {bool(access_token)}")
-            
-            # Obtener información del usuario
-            user_response = await client.get(
-                'https://www.googleapis.com/oauth2/v2/userinfo',
-                headers={'Authorization': f'Bearer {access_token}'}
-            )
-            
-            if user_response.status_code != 200:
-                print(f"User info error: {user_response.text}")
-                raise HTTPException(status_code=400, detail="Failed to get user info")
+        # Intercambiar código por token (cliente HTTP compartido, con keep-alive)
+        try:
+            tokens = await google_client.exchange_code(code)
+            logger.debug("Access token received: %s", bool(tokens.get('access_token')))
             
-            user_info = user_response.json()
-            print(f"User info received: {user_info.get('email', 'No email')}")
+            # Datos del usuario desde el id_token verificado (sin llamar a userinfo)
+            user_info = await google_client.user_info(tokens)
+        except (GoogleOAuthError, httpx.HTTPError) as e:
+            logger.warning("Google OAuth error: %s", e)
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        logger.debug("User info received: %s", user_info.get('email', 'No email'))
         
         if not user_info or not user_info.get('email'):
             raise HTTPException(status_code=400, detail="No se pudo obtener información del usuario")
         
         # Crear o actualizar usuario
-        user = AuthService.create_or_update_user(user_info, db)
-        print(f"User created/updated: {user.email}")
+        user = await AuthService.create_or_update_user(user_info, db)
+        database.recent_writes.mark(user_id=user.id)
+        logger.info("Login", extra={"user_id": user.id})
         
-        # Limpiar state de la sesión
+        # Limpiar state de la sesión; la cookie (solo /auth) sirve para renovar el token
         request.session.pop('oauth_state', None)
+        request.session['user_id'] = user.id
         
-        # Redirigir al frontend con información del usuario
-        frontend_url = f"http://localhost:3000/auth/success?user_id={user.id}&name={quote_plus(user.name)}&email={quote_plus(user.email)}"
+        # Redirigir al frontend con información del usuario; el token va en el
+        # fragmento, que el navegador no envía al servidor ni en el Referer
+        access_token = create_access_token(user.id, user.email, user.name)
+        frontend_url = (
+            f"http://localhost:3000/auth/success?user_id={user.id}&name={quote_plus(user.name)}&email={quote_plus(user.email)}"
+            f"#access_token={access_token}&expires_in={ACCESS_TOKEN_TTL}"
+        )
         return RedirectResponse(url=frontend_url)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error en callback: {e}")
+        logger.exception("Error en callback: %s", e)
         return RedirectResponse(url=f"http://localhost:3000/auth/error?error={quote_plus(str(e))}")
 
 @router.get("/logout")
@@ -147,19 +122,87 @@ async def logout(request: Request):
     response = RedirectResponse(url="http://localhost:3000/")
     return response
 
+@router.post("/token")
+async def refresh_access_token(request: Request):
+    """Nuevo token de acceso para la sesión iniciada con Google (cookie de sesión)"""
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="No hay sesión iniciada")
+    profile = await AuthService.get_user_profile(user_id)
+    if profile is None or not profile["is_active"]:
+        request.session.clear()
+        raise HTTPException(status_code=401, detail="Usuario no disponible")
+    return {
+        "access_token": create_access_token(user_id, profile["email"], profile["name"]),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
+
+@router.get("/me")
+async def get_authenticated_user(claims: dict = Depends(require_access_token)):
+    """Usuario del token de acceso (firma verificada sin BD; perfil desde la caché)"""
+    profile = await AuthService.get_user_profile(int(claims["sub"]))
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return ORJSONResponse(profile)
+
 @router.get("/me/{user_id}")
-async def get_current_user(user_id: int, db: Session = Depends(database.get_db)):
-    """Obtener información del usuario actual"""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
+async def get_current_user(user_id: int, claims: dict = Depends(require_access_token)):
+    """Obtener información del usuario actual (solo con un token de ese usuario)"""
+    require_same_user(claims, user_id)
+    profile = await AuthService.get_user_profile(user_id)
+    if profile is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
+    return ORJSONResponse(profile)
 
-@router.get("/users")
-async def get_users(db: Session = Depends(database.get_db)):
-    """Obtener todos los usuarios (para testing)"""
-    users = db.query(models.User).all()
-    return users
+@router.get(
+    "/users",
+    response_model=schemas.UserPage,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(require_access_token)]
+)
+async def get_users(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por comas"),
+    is_active: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    email_prefix: Optional[str] = Query(None, min_length=1),
+    include_total: bool = False,
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Directorio de usuarios paginado (keyset), con filtros y proyección de campos (requiere token)"""
+    requested = DIRECTORY_FIELDS
+    if fields:
+        requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in requested if f not in USER_FIELDS]
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Campos no válidos: {', '.join(unknown)}. Permitidos: {', '.join(USER_FIELDS)}"
+            )
+    filters = {
+        "is_active": is_active,
+        "created_from": created_from,
+        "created_to": created_to,
+        "email_prefix": email_prefix,
+    }
+    
+    try:
+        items, next_cursor = await AuthService.list_users(
+            db, limit=limit, cursor=cursor, fields=requested, **filters
+        )
+        page = {"items": items, "next_cursor": next_cursor}
+        if include_total:
+            page["total"] = await AuthService.count_users(db, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error listing users: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener usuarios")
+    
+    return page
 
 # Ruta de debug para verificar configuración
 @router.get("/debug")
@@ -168,9 +211,8 @@ async def debug_oauth():
     return {
         "client_id": os.getenv('GOOGLE_CLIENT_ID', 'Not set')[:20] + "...",
         "has_client_secret": bool(os.getenv('GOOGLE_CLIENT_SECRET')),
-        "redirect_uri": 'http://localhost:8000/auth/callback',
-        "google_auth_url": "https://accounts.google.com/o/oauth2/v2/auth",
-        "google_token_url": "https://oauth2.googleapis.com/token"
+        "redirect_uri": GOOGLE_REDIRECT_URI,
+        "discovery_url": google_client.discovery_url
     }
 
 @router.get("/test-google")
@@ -178,25 +220,35 @@ async def test_google_endpoints():
     """Probar conectividad con endpoints de Google"""
     results = {}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            # Probar endpoint de userinfo
-            response = await client.get('https://www.googleapis.com/oauth2/v2/userinfo')
-            results['userinfo_endpoint'] = {
-                'status': response.status_code,
-                'accessible': response.status_code == 401  # 401 es esperado sin token
-            }
-        except Exception as e:
-            results['userinfo_endpoint'] = {'error': str(e)}
-        
-        try:
-            # Probar endpoint de token
-            response = await client.post('https://oauth2.googleapis.com/token')
-            results['token_endpoint'] = {
-                'status': response.status_code,
-                'accessible': response.status_code == 400  # 400 es esperado sin parámetros
-            }
-        except Exception as e:
-            results['token_endpoint'] = {'error': str(e)}
+    try:
+        metadata = await google_client.metadata()
+    except Exception as e:
+        return {'discovery': {'error': str(e)}}
+    
+    try:
+        # Probar endpoint de userinfo
+        response = await google_client.client.get(metadata['userinfo_endpoint'])
+        results['userinfo_endpoint'] = {
+            'status': response.status_code,
+            'accessible': response.status_code == 401  # 401 es esperado sin token
+        }
+    except Exception as e:
+        results['userinfo_endpoint'] = {'error': str(e)}
+    
+    try:
+        # Probar endpoint de token
+        response = await google_client.client.post(metadata['token_endpoint'])
+        results['token_endpoint'] = {
+            'status': response.status_code,
+            'accessible': response.status_code == 400  # 400 es esperado sin parámetros
+        }
+    except Exception as e:
+        results['token_endpoint'] = {'error': str(e)}
+    
+    try:
+        keys = (await google_client.jwks()).get('keys', [])
+        results['jwks'] = {'keys': len(keys)}
+    except Exception as e:
+        results['jwks'] = {'error': str(e)}
     
     return results
\ No newline at end of file
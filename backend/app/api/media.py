@@ -0,0 +1,126 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .. import schemas
+from ..services.cache import etag_matches
+from ..services.auth import require_access_token
+from ..services.media import media_store, MEDIA_ALLOWED_TYPES, MEDIA_FILENAME, MEDIA_MAX_BYTES, UnsupportedMediaType, media_type_for
+from typing import Optional, Tuple
+import anyio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+CHUNK_SIZE = 64 * 1024
+# El nombre es el hash del contenido: la URL nunca cambia de contenido
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Se sirve desde el origen de la API: nada de lo servido puede ejecutar scripts
+MEDIA_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Interpretar una cabecera Range de un solo rango; None si no aplica.
+
+    Lanza ValueError si el rango no es satisfacible.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # bytes=-N: los últimos N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("Rango no satisfacible")
+    return start, min(end, size - 1)
+
+async def iter_file(path: str, start: int, end: int):
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+@router.post("/", response_model=schemas.Media)
+async def upload_media(file: UploadFile = File(...), claims: dict = Depends(require_access_token)):
+    """Subir una imagen al almacén direccionado por contenido"""
+    data = await file.read(MEDIA_MAX_BYTES + 1)
+    if not data:
+        raise HTTPException(status_code=400, detail="Fichero vacío")
+    if len(data) > MEDIA_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Fichero demasiado grande")
+
+    try:
+        filename = await run_in_threadpool(media_store.store, data, file.content_type)
+    except UnsupportedMediaType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except OSError as e:
+        logger.exception("Error storing media: %s", e)
+        raise HTTPException(status_code=500, detail="Error al guardar el fichero")
+
+    return {
+        "filename": filename,
+        "url": media_store.url_for(filename),
+        "size": len(data),
+        "content_type": media_type_for(filename),
+    }
+
+@router.get("/{filename}")
+async def get_media(filename: str, request: Request):
+    """Servir un fichero del almacén con caché inmutable y soporte de rangos"""
+    if not MEDIA_FILENAME.match(filename):
+        raise HTTPException(status_code=404, detail="Fichero no encontrado")
+
+    path = media_store.path_for(filename)
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Fichero no encontrado")
+
+    headers = {
+        "ETag": f'"{filename.split(".")[0]}"',
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        **MEDIA_SECURITY_HEADERS,
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type_for(filename)
+    if media_type not in MEDIA_ALLOWED_TYPES:
+        # Ficheros anteriores a la lista de tipos admitidos: solo como descarga
+        headers["Content-Disposition"] = "attachment"
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        iter_file(path, start, end),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
@@ -1,40 +1,246 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from .. import models, schemas, database
-from ..services.portfolio import PortfolioService
-from typing import List
+from ..services.portfolio import PortfolioService, SUMMARY_FIELDS, slugify, prepare_content, serialize_portfolio
+from ..services.cache import public_portfolio_cache, etag_matches
+from ..services.events import EVENTS_HEARTBEAT, HEARTBEAT_FRAME, Subscription, portfolio_events, sse_frame
+from ..services.auth import require_access_token
+from ..services.revisions import RevisionService
+from ..services.snapshots import snapshot_renderer
+from ..services.write_behind import autosave_buffer, flush_pending
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import jsonpatch
+import jsonpointer
+import logging
+import orjson
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Antes de cada ruta se escriben los autoguardados pendientes de los portfolios que toca
+router = APIRouter(default_response_class=ORJSONResponse, dependencies=[Depends(flush_pending)])
+
+IMPORT_BATCH_SIZE = 1000
+# Una línea (un portfolio) no puede superar esto: evita acumular un cuerpo sin saltos de línea
+IMPORT_MAX_LINE_BYTES = 16 * 1024 * 1024
+
+def portfolio_response(portfolio) -> ORJSONResponse:
+    """Respuesta directa con orjson: evita la validación de response_model sobre content"""
+    return ORJSONResponse(serialize_portfolio(portfolio))
+
+async def normalize_content(content):
+    """Preparar content para escribirlo (media fuera de línea, blockTypes) fuera del event loop"""
+    return await run_in_threadpool(prepare_content, content)
+
+async def public_portfolio_response(portfolio_name: str, request: Request, db: AsyncSession) -> Response:
+    """Respuesta pública cacheada con ETag; un If-None-Match en caché no toca la BD"""
+    slug = slugify(portfolio_name)
+    entry = public_portfolio_cache.get(slug)
+    
+    if entry is None:
+        portfolio = await PortfolioService.get_by_slug(slug, db)
+        if not portfolio:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        body = orjson.dumps(serialize_portfolio(portfolio))
+        entry = public_portfolio_cache.set(slug, portfolio.id, body)
+    
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 @router.get("/user/{user_id}", response_model=List[schemas.Portfolio])
-def get_user_portfolios(user_id: int, db: Session = Depends(database.get_db)):
+async def get_user_portfolios(user_id: int, db: AsyncSession = Depends(database.get_read_db)):
     """Obtener todos los portfolios de un usuario"""
     try:
-        portfolios = db.query(models.Portfolio).filter(
-            models.Portfolio.user_id == user_id
-        ).order_by(desc(models.Portfolio.updated_at)).all()
-        
-        return portfolios
+        portfolios = await PortfolioService.get_user_portfolios(user_id, db)
+        return ORJSONResponse([serialize_portfolio(p) for p in portfolios])
+    except Exception as e:
+        logger.exception("Error getting user portfolios: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener portfolios")
+
+@router.get(
+    "/user/{user_id}/summary",
+    response_model=schemas.PortfolioSummaryPage,
+    response_model_exclude_unset=True
+)
+async def get_user_portfolio_summaries(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por comas"),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    """Listado resumido y paginado (keyset) de los portfolios de un usuario, sin content"""
+    requested = SUMMARY_FIELDS
+    if fields:
+        requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in requested if f not in SUMMARY_FIELDS]
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Campos no válidos: {', '.join(unknown)}. Permitidos: {', '.join(SUMMARY_FIELDS)}"
+            )
+    
+    try:
+        items, next_cursor = await PortfolioService.list_user_summaries(
+            user_id, db, limit=limit, cursor=cursor, fields=requested
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error getting portfolio summaries: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener portfolios")
+    
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/with-block/{block_type}", response_model=List[schemas.PortfolioSearchResult])
+async def get_portfolios_with_block(
+    block_type: str,
+    user_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Portfolios que contienen un tipo de bloque (p. ej. projects)"""
+    try:
+        return await PortfolioService.find_by_block_type(block_type, db, user_id=user_id, limit=limit)
     except Exception as e:
-        print(f"Error getting user portfolios: {e}")
+        logger.exception("Error filtering portfolios by block type: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener portfolios")
 
+@router.get("/search", response_model=List[schemas.PortfolioSearchResult])
+async def search_portfolios(
+    q: str = Query(..., min_length=3),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Búsqueda aproximada de portfolios por nombre (índice trigram)"""
+    try:
+        return await PortfolioService.search_by_name(q, db, limit=limit)
+    except Exception as e:
+        logger.exception("Error searching portfolios: %s", e)
+        raise HTTPException(status_code=500, detail="Error al buscar portfolios")
+
+async def ndjson_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """Partir un cuerpo en streaming en líneas (número, línea) sin cargarlo entero"""
+    pending: List[bytes] = []  # trozos de la línea en curso
+    pending_size = 0
+    line_number = 0
+    async for chunk in stream:
+        parts = chunk.split(b"\n")
+        if len(parts) > 1:
+            parts[0] = b"".join(pending) + parts[0]
+            for line in parts[:-1]:
+                line_number += 1
+                if line.strip():
+                    yield line_number, line
+            pending, pending_size = [parts[-1]], len(parts[-1])
+        else:
+            pending.append(chunk)
+            pending_size += len(chunk)
+        if pending_size > IMPORT_MAX_LINE_BYTES:
+            raise ValueError(f"Línea {line_number + 1}: demasiado larga")
+    line = b"".join(pending)
+    if line.strip():
+        yield line_number + 1, line
+
+@router.get("/export")
+async def export_portfolios(claims: dict = Depends(require_access_token)):
+    """Exportar los portfolios del usuario del token como NDJSON en streaming.
+
+    El volcado de todos los usuarios solo desde la CLI: python -m app.migrate export
+    """
+    user_id = int(claims["sub"])
+    filename = f"portfolios-user-{user_id}.ndjson"
+    return StreamingResponse(
+        PortfolioService.stream_export(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/import", response_model=schemas.PortfolioImportResult)
+async def import_portfolios(
+    request: Request,
+    claims: dict = Depends(require_access_token),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Importar un volcado NDJSON por lotes, en una sola transacción.
+
+    Todos los portfolios se asignan al usuario del token, sea cual sea el
+    user_id de cada línea.
+    """
+    user_id = int(claims["sub"])
+    imported = 0
+    batches = 0
+    batch = []
+
+    async def flush():
+        nonlocal imported, batches
+        contents = await run_in_threadpool(lambda: [prepare_content(item["content"]) for item in batch])
+        for item, content in zip(batch, contents):
+            item["content"] = content
+        imported += await PortfolioService.import_batch(batch, db)
+        batches += 1
+        batch.clear()
+
+    try:
+        if await db.get(models.User, user_id) is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+        async for line_number, line in ndjson_lines(request.stream()):
+            try:
+                item = schemas.PortfolioImport.model_validate_json(line).model_dump()
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=f"Línea {line_number}: {e.errors()[0]['msg']}")
+            item["user_id"] = user_id
+            batch.append(item)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+
+        await db.commit()
+        database.recent_writes.mark(user_id=user_id)
+        logger.info("Portfolios importados", extra={"imported": imported, "batches": batches})
+        return {"imported": imported, "batches": batches}
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=422, detail=str(e))
+    except IntegrityError as e:
+        await db.rollback()
+        logger.warning("Import rechazado: %s", e.orig)
+        raise HTTPException(status_code=422, detail="El volcado no se puede importar")
+    except Exception as e:
+        logger.exception("Error importing portfolios: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error al importar portfolios")
+
 @router.post("/", response_model=schemas.Portfolio)
-def create_portfolio(portfolio: schemas.PortfolioCreate, db: Session = Depends(database.get_db)):
+async def create_portfolio(portfolio: schemas.PortfolioCreate, db: AsyncSession = Depends(database.get_db)):
     """Crear un nuevo portfolio"""
     try:
         # Verificar que el usuario existe
         if portfolio.user_id:
-            user = db.query(models.User).filter(models.User.id == portfolio.user_id).first()
+            user = await db.get(models.User, portfolio.user_id)
             if not user:
                 raise HTTPException(status_code=404, detail="Usuario no encontrado")
         
         # Verificar que no existe un portfolio con el mismo nombre para este usuario
-        existing = db.query(models.Portfolio).filter(
-            models.Portfolio.name == portfolio.name,
-            models.Portfolio.user_id == portfolio.user_id
-        ).first()
+        existing = (await db.scalars(
+            select(models.Portfolio.id).where(
+                models.Portfolio.name == portfolio.name,
+                models.Portfolio.user_id == portfolio.user_id
+            )
+        )).first()
         
         if existing:
             raise HTTPException(status_code=400, detail="Ya tienes un portfolio con este nombre")
@@ -42,160 +248,421 @@ def create_portfolio(portfolio: schemas.PortfolioCreate, db: Session = Depends(d
         # Crear el portfolio
         db_portfolio = models.Portfolio(
             name=portfolio.name,
-            content=portfolio.content,
+            slug=await PortfolioService.generate_unique_slug(portfolio.name, db),
+            content=await normalize_content(portfolio.content),
             user_id=portfolio.user_id
         )
         
         db.add(db_portfolio)
-        db.commit()
-        db.refresh(db_portfolio)
+        await db.flush()
+        await db.refresh(db_portfolio)
+        await RevisionService.record(db_portfolio, db)
+        await db.commit()
+        public_portfolio_cache.invalidate(slug=db_portfolio.slug)
+        database.recent_writes.mark(portfolio_id=db_portfolio.id, slug=db_portfolio.slug, user_id=db_portfolio.user_id)
+        snapshot_renderer.schedule(db_portfolio)
         
-        return db_portfolio
+        return portfolio_response(db_portfolio)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error creating portfolio: {e}")
-        db.rollback()
+        logger.exception("Error creating portfolio: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error al crear portfolio")
 
 @router.get("/{portfolio_id}", response_model=schemas.Portfolio)
-def get_portfolio(portfolio_id: int, db: Session = Depends(database.get_db)):
+async def get_portfolio(portfolio_id: int, db: AsyncSession = Depends(database.get_read_db)):
     """Obtener un portfolio por ID"""
     try:
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
+        portfolio = await PortfolioService.get_portfolio(portfolio_id, db)
         
         if not portfolio:
             raise HTTPException(status_code=404, detail="Portfolio no encontrado")
         
-        return portfolio
+        return portfolio_response(portfolio)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting portfolio: {e}")
+        logger.exception("Error getting portfolio: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener portfolio")
 
-@router.get("/name/{portfolio_name}", response_model=schemas.Portfolio)
-def get_portfolio_by_name(portfolio_name: str, db: Session = Depends(database.get_db)):
-    """Obtener un portfolio por nombre - PARA /p/{name}"""
+@router.get("/{portfolio_id}/blocks/{block_id}")
+async def get_block_properties(portfolio_id: int, block_id: str, db: AsyncSession = Depends(database.get_db)):
+    """Obtener las propiedades de un solo bloque sin cargar el documento completo"""
     try:
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.name.ilike(f"%{portfolio_name}%")
-        ).first()
-        
+        exists, properties = await PortfolioService.get_block_properties(portfolio_id, block_id, db)
+    except Exception as e:
+        logger.exception("Error getting block properties: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener el bloque")
+    
+    if not exists:
+        raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+    if properties is None:
+        raise HTTPException(status_code=404, detail="Bloque no encontrado")
+    
+    return {"block_id": block_id, "properties": properties}
+
+async def event_stream(subscription: Subscription, first_frame: bytes) -> AsyncIterator[bytes]:
+    """Marcos SSE de una suscripción; un latido periódico si no hay cambios"""
+    try:
+        yield b"retry: 3000\n\n" + first_frame
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscription.queue.get(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                frame = HEARTBEAT_FRAME
+            yield frame
+    finally:
+        # Desconexión del cliente (Starlette cancela el stream) o cierre del servidor
+        portfolio_events.unsubscribe(subscription)
+
+@router.get("/{portfolio_id}/events")
+async def portfolio_event_stream(portfolio_id: int, request: Request):
+    """Cambios del portfolio en vivo (Server-Sent Events) para la previsualización.
+
+    Primero un evento snapshot con el portfolio completo (se omite si
+    Last-Event-ID ya es la versión actual) y después un patch por guardado
+    con el diff por bloques, content si no hay diff posible, resync si el
+    cliente se retrasó y perdió eventos, y deleted.
+    """
+    # Suscribir antes de leer: un guardado intermedio llega como patch ya incluido en el snapshot
+    subscription = portfolio_events.subscribe(portfolio_id)
+    if subscription is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Demasiadas conexiones de previsualización",
+            headers={"Retry-After": "30"}
+        )
+    try:
+        # Sesión propia y cerrada antes del stream: la conexión no queda retenida
+        async with database.AsyncSessionLocal() as db:
+            portfolio = await PortfolioService.get_portfolio(portfolio_id, db)
         if not portfolio:
             raise HTTPException(status_code=404, detail="Portfolio no encontrado")
-        
-        return portfolio
+    except HTTPException:
+        portfolio_events.unsubscribe(subscription)
+        raise
+    except Exception as e:
+        portfolio_events.unsubscribe(subscription)
+        logger.exception("Error opening event stream: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener portfolio")
+    
+    first_frame = b""
+    if request.headers.get("last-event-id") != str(portfolio.version):
+        first_frame = sse_frame("snapshot", serialize_portfolio(portfolio), portfolio.version)
+    return StreamingResponse(
+        event_stream(subscription, first_frame),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/name/{portfolio_name}", response_model=schemas.Portfolio)
+async def get_portfolio_by_name(portfolio_name: str, request: Request, db: AsyncSession = Depends(database.get_read_db)):
+    """Obtener un portfolio por nombre - PARA /p/{name}"""
+    try:
+        return await public_portfolio_response(portfolio_name, request, db)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting portfolio by name: {e}")
+        logger.exception("Error getting portfolio by name: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener portfolio")
 
 @router.put("/{portfolio_id}", response_model=schemas.Portfolio)
-def update_portfolio(
+async def update_portfolio(
     portfolio_id: int, 
     portfolio_update: schemas.PortfolioUpdate, 
-    db: Session = Depends(database.get_db)
+    request: Request,
+    db: AsyncSession = Depends(database.get_db)
 ):
     """Actualizar un portfolio existente"""
     try:
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
+        # Autoguardado con write-behind: se responde desde el buffer
+        if autosave_buffer.accepts(request):
+            staged = await autosave_buffer.stage(portfolio_id, portfolio_update.dict(exclude_unset=True), db)
+            if staged is not None:
+                return ORJSONResponse(staged)
+        
+        portfolio = await PortfolioService.get_portfolio(portfolio_id, db)
         
         if not portfolio:
             raise HTTPException(status_code=404, detail="Portfolio no encontrado")
         
         # Actualizar campos
+        previous_content = portfolio.content
         update_data = portfolio_update.dict(exclude_unset=True)
+        if 'content' in update_data:
+            update_data['content'] = await normalize_content(update_data['content'])
         for field, value in update_data.items():
             setattr(portfolio, field, value)
         
+        # El slug se fija al crear: renombrar no rompe los enlaces /p/<slug> ya compartidos
+        
         # Actualizar timestamp manualmente
         from sqlalchemy.sql import func
         portfolio.updated_at = func.now()
+        portfolio.version = models.Portfolio.version + 1
+        
+        # La revisión va en la misma transacción y lleva la versión ya incrementada
+        await db.flush()
+        await db.refresh(portfolio)
+        await RevisionService.record(portfolio, db)
+        await db.commit()
+        public_portfolio_cache.invalidate(portfolio_id=portfolio.id, slug=portfolio.slug)
+        database.recent_writes.mark(portfolio_id=portfolio.id, slug=portfolio.slug, user_id=portfolio.user_id)
+        portfolio_events.publish_update(portfolio.id, portfolio.version, portfolio.name, previous_content, portfolio.content)
+        snapshot_renderer.schedule(portfolio)
+        
+        logger.debug("Portfolio actualizado", extra={"portfolio_id": portfolio_id})
+        return portfolio_response(portfolio)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error updating portfolio: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error al actualizar portfolio")
+
+@router.patch("/{portfolio_id}", response_model=schemas.PortfolioVersion)
+async def patch_portfolio(
+    portfolio_id: int,
+    portfolio_patch: schemas.PortfolioPatch,
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Aplicar un JSON Patch (RFC 6902) sobre content con control optimista de versión"""
+    try:
+        # Bloquear la fila para que comprobar versión y escribir sea atómico
+        portfolio = await PortfolioService.get_portfolio(portfolio_id, db, for_update=True)
+        
+        if not portfolio:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        
+        if portfolio.version != portfolio_patch.version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Versión obsoleta: la versión actual es {portfolio.version}"
+            )
+        
+        try:
+            content = jsonpatch.apply_patch(portfolio.content or {}, portfolio_patch.operations)
+        except jsonpatch.JsonPatchTestFailed as e:
+            raise HTTPException(status_code=409, detail=f"Operación test fallida: {e}")
+        except (jsonpatch.JsonPatchException, jsonpointer.JsonPointerException) as e:
+            raise HTTPException(status_code=422, detail=f"Parche inválido: {e}")
+        
+        if not isinstance(content, dict):
+            raise HTTPException(status_code=422, detail="Parche inválido: content debe ser un objeto")
+        try:
+            schemas.validate_content(content)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Parche inválido: {e}")
+        content = await normalize_content(content)
+        
+        from sqlalchemy.sql import func
+        previous_content = portfolio.content
+        portfolio.content = content
+        portfolio.version = portfolio_patch.version + 1
+        portfolio.updated_at = func.now()
         
-        db.commit()
-        db.refresh(portfolio)
+        await db.flush()
+        await db.refresh(portfolio)
+        await RevisionService.record(portfolio, db)
+        await db.commit()
+        public_portfolio_cache.invalidate(portfolio_id=portfolio.id, slug=portfolio.slug)
+        database.recent_writes.mark(portfolio_id=portfolio.id, slug=portfolio.slug, user_id=portfolio.user_id)
+        portfolio_events.publish_update(portfolio.id, portfolio.version, portfolio.name, previous_content, portfolio.content)
+        snapshot_renderer.schedule(portfolio)
         
-        print(f"Portfolio {portfolio_id} actualizado exitosamente")
         return portfolio
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error updating portfolio: {e}")
-        db.rollback()
+        logger.exception("Error patching portfolio: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error al actualizar portfolio")
 
 @router.delete("/{portfolio_id}")
-def delete_portfolio(portfolio_id: int, db: Session = Depends(database.get_db)):
+async def delete_portfolio(portfolio_id: int, db: AsyncSession = Depends(database.get_db)):
     """Eliminar un portfolio"""
     try:
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
+        portfolio = await PortfolioService.get_portfolio(portfolio_id, db)
         
         if not portfolio:
             raise HTTPException(status_code=404, detail="Portfolio no encontrado")
         
-        db.delete(portfolio)
-        db.commit()
+        slug = portfolio.slug
+        user_id = portfolio.user_id
+        await db.delete(portfolio)
+        await db.commit()
+        public_portfolio_cache.invalidate(portfolio_id=portfolio_id, slug=slug)
+        database.recent_writes.mark(portfolio_id=portfolio_id, slug=slug, user_id=user_id)
+        portfolio_events.publish_deleted(portfolio_id)
+        snapshot_renderer.remove(portfolio_id)
         
         return {"message": "Portfolio eliminado exitosamente"}
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deleting portfolio: {e}")
-        db.rollback()
+        logger.exception("Error deleting portfolio: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error al eliminar portfolio")
 
 @router.post("/{portfolio_id}/duplicate", response_model=schemas.Portfolio)
-def duplicate_portfolio(portfolio_id: int, db: Session = Depends(database.get_db)):
-    """Duplicar un portfolio existente"""
+async def duplicate_portfolio(portfolio_id: int, db: AsyncSession = Depends(database.get_db)):
+    """Duplicar un portfolio existente en la misma cuenta"""
     try:
-        original = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
+        owner_id = await db.scalar(
+            select(models.Portfolio.user_id).where(models.Portfolio.id == portfolio_id)
+        )
+        if owner_id is None:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
         
-        if not original:
+        # Nombre " - Copia (n)" y content copiados en la base de datos
+        clones = await PortfolioService.clone_portfolio(portfolio_id, [owner_id], db)
+        if not clones:
             raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        await RevisionService.record_clones(portfolio_id, clones, db)
+        await db.commit()
         
-        # Generar nombre único para la copia
-        base_name = f"{original.name} - Copia"
-        counter = 1
-        new_name = base_name
-        
-        while db.query(models.Portfolio).filter(
-            models.Portfolio.name == new_name,
-            models.Portfolio.user_id == original.user_id
-        ).first():
-            counter += 1
-            new_name = f"{base_name} ({counter})"
-        
-        # Crear la copia
-        duplicate = models.Portfolio(
-            name=new_name,
-            content=original.content,
-            user_id=original.user_id
-        )
+        duplicate = clones[0]
+        public_portfolio_cache.invalidate(slug=duplicate.slug)
+        database.recent_writes.mark(portfolio_id=duplicate.id, slug=duplicate.slug, user_id=duplicate.user_id)
+        snapshot_renderer.schedule(duplicate)
+        
+        return portfolio_response(duplicate)
+        
+    except HTTPException:
+        raise
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Conflicto al generar el nombre, inténtalo de nuevo")
+    except Exception as e:
+        logger.exception("Error duplicating portfolio: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error al duplicar portfolio")
+
+@router.post("/{portfolio_id}/clone", response_model=List[schemas.PortfolioSearchResult])
+async def clone_portfolio(
+    portfolio_id: int,
+    clone: schemas.PortfolioClone,
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Clonar un portfolio (p. ej. una plantilla) para varios usuarios en una transacción"""
+    try:
+        user_ids = set(clone.user_ids)
+        existing = set((await db.scalars(
+            select(models.User.id).where(models.User.id.in_(user_ids))
+        )).all())
+        missing = sorted(user_ids - existing)
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Usuarios no encontrados: {', '.join(map(str, missing))}"
+            )
+        
+        clones = await PortfolioService.clone_portfolio(portfolio_id, clone.user_ids, db)
+        if clones is None:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        await RevisionService.record_clones(portfolio_id, clones, db)
+        await db.commit()
+        
+        for portfolio in clones:
+            public_portfolio_cache.invalidate(slug=portfolio.slug)
+            database.recent_writes.mark(portfolio_id=portfolio.id, slug=portfolio.slug, user_id=portfolio.user_id)
+            snapshot_renderer.schedule(portfolio)
+        
+        return [
+            {"id": p.id, "name": p.name, "slug": p.slug, "user_id": p.user_id}
+            for p in clones
+        ]
+        
+    except HTTPException:
+        raise
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Conflicto al generar los nombres, inténtalo de nuevo")
+    except Exception as e:
+        logger.exception("Error cloning portfolio: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error al clonar portfolio")
+
+@router.get(
+    "/{portfolio_id}/revisions",
+    response_model=schemas.PortfolioRevisionPage
+)
+async def list_portfolio_revisions(
+    portfolio_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Historial de revisiones de un portfolio (paginado, la más reciente primero)"""
+    try:
+        if await db.get(models.Portfolio, portfolio_id) is None:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        items, next_cursor = await RevisionService.list_revisions(portfolio_id, db, limit=limit, cursor=cursor)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Error listing revisions: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener revisiones")
+    
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/{portfolio_id}/revisions/{revision_id}", response_model=schemas.PortfolioRevision)
+async def get_portfolio_revision(portfolio_id: int, revision_id: int, db: AsyncSession = Depends(database.get_db)):
+    """Una revisión con su content reconstruido"""
+    try:
+        revision = await RevisionService.get_revision(portfolio_id, revision_id, db)
+    except Exception as e:
+        logger.exception("Error getting revision: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener la revisión")
+    
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Revisión no encontrada")
+    return ORJSONResponse(revision)
+
+@router.post("/{portfolio_id}/revisions/{revision_id}/restore", response_model=schemas.Portfolio)
+async def restore_portfolio_revision(portfolio_id: int, revision_id: int, db: AsyncSession = Depends(database.get_db)):
+    """Restaurar el content de una revisión como una versión nueva (el historial se conserva)"""
+    try:
+        portfolio = await PortfolioService.get_portfolio(portfolio_id, db, for_update=True)
+        
+        if not portfolio:
+            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
+        
+        revision = await RevisionService.get_revision(portfolio_id, revision_id, db)
+        if revision is None:
+            raise HTTPException(status_code=404, detail="Revisión no encontrada")
+        
+        # Solo content: el nombre (y con él el slug público) no cambia
+        from sqlalchemy.sql import func
+        previous_content = portfolio.content
+        portfolio.content = revision["content"]
+        portfolio.version = portfolio.version + 1
+        portfolio.updated_at = func.now()
         
-        db.add(duplicate)
-        db.commit()
-        db.refresh(duplicate)
+        await db.flush()
+        await db.refresh(portfolio)
+        await RevisionService.record(portfolio, db)
+        await db.commit()
+        public_portfolio_cache.invalidate(portfolio_id=portfolio.id, slug=portfolio.slug)
+        database.recent_writes.mark(portfolio_id=portfolio.id, slug=portfolio.slug, user_id=portfolio.user_id)
+        portfolio_events.publish_update(portfolio.id, portfolio.version, portfolio.name, previous_content, portfolio.content)
+        snapshot_renderer.schedule(portfolio)
         
-        return duplicate
+        logger.info("Revisión restaurada", extra={"portfolio_id": portfolio_id, "revision_id": revision_id})
+        return portfolio_response(portfolio)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error duplicating portfolio: {e}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Error al duplicar portfolio")
\ No newline at end of file
+        logger.exception("Error restoring revision: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error al restaurar la revisión")
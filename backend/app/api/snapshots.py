@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from ..middleware import choose_encoding
+from ..services.portfolio import slugify
+from ..services.snapshots import ENCODINGS, html_path
+import os
+
+router = APIRouter()
+
+@router.get("/{portfolio_name}")
+async def get_snapshot(portfolio_name: str, request: Request):
+    """Servir el snapshot HTML estático de un portfolio (variante precomprimida si se acepta)"""
+    path = html_path(slugify(portfolio_name))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Snapshot no disponible")
+
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    # Negociación entre las variantes precomprimidas que hay en disco
+    suffixes = {encoding: suffix for encoding, suffix in ENCODINGS if os.path.exists(path + suffix)}
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), tuple(suffixes))
+    if encoding is not None:
+        path = path + suffixes[encoding]
+        headers["Content-Encoding"] = encoding
+
+    return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
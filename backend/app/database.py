@@ -1,18 +1,400 @@
-from sqlalchemy import create_engine
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.requests import Request
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import itertools
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/portfolio_db")
+# Misma base de datos a través del driver asyncpg (para las rutas de la API)
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+)
+# Réplicas de solo lectura (opcional), separadas por comas
+DATABASE_REPLICA_URLS = [
+    url.strip().replace("postgresql://", "postgresql+asyncpg://", 1)
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+# Por encima de este retraso (segundos) una réplica deja de recibir lecturas
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+REPLICA_CONNECT_TIMEOUT = float(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+# Tras escribir un recurso, sus lecturas van al primario durante este tiempo;
+# con el retraso máximo por debajo, una réplica sana ya tiene la escritura
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", str(REPLICA_MAX_LAG * 2)))
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+# Configuración del pool de conexiones (por worker)
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    # Descarta conexiones muertas (p. ej. tras reiniciar Postgres) antes de usarlas
+    "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+}
+
+# Peso de cada checkout en la media móvil de la espera (recent_wait)
+POOL_WAIT_EWMA_ALPHA = 0.2
+
+class PoolStats:
+    """Contadores de checkout del pool: esperas y timeouts"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Media móvil exponencial de la espera: refleja la saturación de ahora, no la histórica
+        self.recent_wait = 0.0
+
+    def record(self, wait: float, timed_out: bool) -> None:
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_wait += POOL_WAIT_EWMA_ALPHA * (wait - self.recent_wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.checkout_timeouts
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "wait_total_ms": round(self.total_wait * 1000, 3),
+                "wait_avg_ms": round(self.total_wait * 1000 / attempts, 3) if attempts else 0.0,
+                "wait_max_ms": round(self.max_wait * 1000, 3),
+                "wait_recent_ms": round(self.recent_wait * 1000, 3),
+            }
 
-engine = create_engine(DATABASE_URL)
+def _instrumented_pool(pool_class, stats: PoolStats):
+    """Subclase del pool que mide cuánto espera cada checkout"""
+
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                stats.record(time.perf_counter() - start, timed_out=True)
+                raise
+            stats.record(time.perf_counter() - start, timed_out=False)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+sync_pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+# Motor síncrono: migraciones y scripts de mantenimiento
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=_instrumented_pool(QueuePool, sync_pool_stats),
+    **POOL_SETTINGS
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Motor asíncrono: todas las rutas de la API
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=_instrumented_pool(AsyncAdaptedQueuePool, async_pool_stats),
+    **POOL_SETTINGS
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # evita cargas implícitas (no permitidas en async) tras commit
+)
+
+class QueryStats:
+    """Consultas y tiempo de base de datos acumulados durante una petición"""
+
+    __slots__ = ("count", "duration")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+# La establece QueryTimingMiddleware; fuera de una petición no se cuenta nada
+request_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    stats = request_query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+def _handle_error(exception_context):
+    # Una consulta fallida no pasa por after_cursor_execute
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def instrument_engine(sync_engine) -> None:
+    """Contar las consultas de este motor en las estadísticas de la petición"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close() 
\ No newline at end of file
+
+# Retraso de la réplica en segundos: 0 si ya ha aplicado todo lo recibido
+# (con el primario sin escrituras, pg_last_xact_replay_timestamp envejece sin haber retraso)
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+class Replica:
+    """Réplica de solo lectura: su propio pool y su estado de salud"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.pool_stats = PoolStats()
+        self.engine = create_async_engine(
+            url,
+            poolclass=_instrumented_pool(AsyncAdaptedQueuePool, self.pool_stats),
+            connect_args={"timeout": REPLICA_CONNECT_TIMEOUT},
+            **POOL_SETTINGS
+        )
+        instrument_engine(self.engine.sync_engine)
+        # No recibe lecturas hasta la primera comprobación
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def mark_unhealthy(self, error: BaseException) -> None:
+        if self.healthy:
+            logger.warning("Réplica %s fuera de servicio: %s", self.name, error)
+        self.healthy = False
+        self.error = str(error) or type(error).__name__
+
+    async def check(self) -> None:
+        """Medir el retraso; fuera de servicio si no responde o va demasiado atrasada"""
+        try:
+            async with self.engine.connect() as connection:
+                lag = await asyncio.wait_for(connection.scalar(REPLICA_LAG_SQL), REPLICA_CONNECT_TIMEOUT)
+        except Exception as e:
+            self.lag = None
+            self.mark_unhealthy(e)
+            return
+        self.lag = float(lag)
+        if self.lag > REPLICA_MAX_LAG:
+            self.mark_unhealthy(RuntimeError(f"retraso de {self.lag:.1f} s"))
+            return
+        if not self.healthy:
+            logger.info("Réplica %s en servicio (retraso %.1f s)", self.name, self.lag)
+        self.healthy = True
+        self.error = None
+
+    def status(self) -> dict:
+        return {
+            "host": self.engine.url.host,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "error": self.error,
+        }
+
+class ReadRouter:
+    """Reparte las lecturas entre las réplicas sanas (round robin) y vigila su salud"""
+
+    def __init__(self, urls: Iterable[str]):
+        self.replicas = [Replica(f"replica-{i}", url) for i, url in enumerate(urls)]
+        self._turn = itertools.count()
+        self._monitor: Optional[asyncio.Task] = None
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+            await self.check_all()
+
+    async def start(self) -> None:
+        if not self.replicas or self._monitor is not None:
+            return
+        await self.check_all()
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def close(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+read_router = ReadRouter(DATABASE_REPLICA_URLS)
+
+class RecentWrites:
+    """Recursos escritos hace poco por este proceso (read-your-writes).
+
+    Las lecturas de un portfolio, slug o usuario marcado van al primario
+    hasta que cualquier réplica sana tiene ya la escritura.
+    """
+
+    def __init__(self, window: float, enabled: bool):
+        self.window = window
+        self.enabled = enabled
+        self._expires: Dict[Tuple[str, str], float] = {}
+        self._lock = Lock()
+
+    def mark(self, **keys) -> None:
+        """recent_writes.mark(portfolio_id=..., slug=..., user_id=...)"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for kind, value in keys.items():
+                if value is not None:
+                    self._expires[(kind, str(value))] = now + self.window
+            if len(self._expires) > 10000:
+                self._expires = {key: expires for key, expires in self._expires.items() if expires > now}
+
+    def recent(self, keys: Iterable[Tuple[str, str]]) -> bool:
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            return any(self._expires.get(key, 0.0) > now for key in keys)
+
+recent_writes = RecentWrites(READ_YOUR_WRITES_SECONDS, enabled=bool(DATABASE_REPLICA_URLS))
+
+def _read_keys(path_params: dict) -> List[Tuple[str, str]]:
+    """Recursos que lee una ruta, según sus parámetros de ruta"""
+    keys = [(kind, str(path_params[kind])) for kind in ("portfolio_id", "user_id") if kind in path_params]
+    if "portfolio_name" in path_params:
+        from .services.portfolio import slugify
+        keys.append(("slug", slugify(path_params["portfolio_name"])))
+    return keys
+
+class ReadSession(AsyncSession):
+    """Sesión de solo lectura que elige réplica (o primario) en su primera consulta.
+
+    Hasta entonces no toma conexión de ningún pool: una respuesta servida
+    desde caché (p. ej. un 304) no llega a elegir ni a conectar.
+    """
+
+    def __init__(self, *args, read_keys: Iterable[Tuple[str, str]] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self._read_keys = list(read_keys)
+        self._routed = False
+
+    async def _route(self) -> None:
+        if self._routed:
+            return
+        self._routed = True
+        if not read_router.replicas or recent_writes.recent(self._read_keys):
+            return
+        replica = read_router.pick()
+        if replica is None:
+            return
+        primary = self.bind
+        self.bind, self.sync_session.bind = replica.engine, replica.engine.sync_engine
+        try:
+            await self.connection()
+        except Exception as e:
+            # Caída entre dos comprobaciones: esta consulta y las siguientes van al primario
+            await self.rollback()
+            self.bind, self.sync_session.bind = primary, primary.sync_engine
+            replica.mark_unhealthy(e)
+
+    async def execute(self, *args, **kwargs):
+        await self._route()
+        return await super().execute(*args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        await self._route()
+        return await super().scalars(*args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        await self._route()
+        return await super().scalar(*args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        await self._route()
+        return await super().get(*args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        await self._route()
+        return await super().stream(*args, **kwargs)
+
+ReadSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=ReadSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+async def get_read_db(request: Request):
+    """Sesión para rutas de solo lectura: una réplica si hay alguna sana, si no el primario"""
+    async with ReadSessionLocal(read_keys=_read_keys(request.path_params)) as session:
+        yield session
+
+def pool_status() -> dict:
+    """Estado en vivo de los pools (conexiones en uso, overflow, esperas)"""
+
+    def describe(pool, stats: PoolStats) -> dict:
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            **stats.snapshot(),
+        }
+
+    return {
+        "settings": POOL_SETTINGS,
+        "async": describe(async_engine.pool, async_pool_stats),
+        "sync": describe(engine.pool, sync_pool_stats),
+        "replicas": {
+            replica.name: {**describe(replica.engine.pool, replica.pool_stats), **replica.status()}
+            for replica in read_router.replicas
+        },
+    }
+
+async def ping() -> float:
+    """Ejecutar SELECT 1 y devolver la latencia en milisegundos"""
+    start = time.perf_counter()
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return (time.perf_counter() - start) * 1000
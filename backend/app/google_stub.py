@@ -0,0 +1,116 @@
+"""Stub local de los endpoints de Google OAuth para probar el login sin red.
+
+Uso:
+    uvicorn app.google_stub:app --port 8001
+    GOOGLE_DISCOVERY_URL=http://localhost:8001/.well-known/openid-configuration uvicorn app.main:app
+
+El endpoint de autorización redirige en el acto al redirect_uri con un código;
+con ?login_hint=<email> se elige el usuario (útil para pruebas de carga).
+GET /stats devuelve cuántas veces se ha llamado a cada endpoint.
+"""
+from collections import Counter
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form, Header, HTTPException
+from fastapi.responses import RedirectResponse
+from jose import jwk, jwt
+from urllib.parse import urlencode
+import base64
+import os
+import secrets
+import time
+
+STUB_BASE_URL = os.getenv("GOOGLE_STUB_BASE_URL", "http://localhost:8001").rstrip("/")
+STUB_KEY_ID = "stub-key"
+
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+_PRIVATE_PEM = _private_key.private_bytes(
+    serialization.Encoding.PEM,
+    serialization.PrivateFormat.PKCS8,
+    serialization.NoEncryption()
+)
+_PUBLIC_JWK = {
+    **jwk.construct(_PRIVATE_PEM, "RS256").public_key().to_dict(),
+    "kid": STUB_KEY_ID,
+    "use": "sig",
+}
+
+app = FastAPI(title="Google OAuth stub")
+
+# Llamadas recibidas por endpoint (discovery y JWKS deberían quedarse en caché)
+hits = Counter()
+
+def _encode(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+def _decode(value: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="invalid_grant")
+
+def _claims(email: str) -> dict:
+    local_part = email.split("@")[0]
+    return {
+        "sub": str(int.from_bytes(email.encode()[:8].ljust(8, b"\0"), "big")),
+        "email": email,
+        "email_verified": True,
+        "name": local_part.title(),
+        "given_name": local_part.title(),
+        "locale": "es",
+    }
+
+@app.get("/.well-known/openid-configuration")
+def discovery():
+    hits["discovery"] += 1
+    return {
+        "issuer": STUB_BASE_URL,
+        "authorization_endpoint": f"{STUB_BASE_URL}/o/oauth2/v2/auth",
+        "token_endpoint": f"{STUB_BASE_URL}/token",
+        "userinfo_endpoint": f"{STUB_BASE_URL}/v1/userinfo",
+        "jwks_uri": f"{STUB_BASE_URL}/oauth2/v3/certs",
+        "id_token_signing_alg_values_supported": ["RS256"],
+    }
+
+@app.get("/oauth2/v3/certs")
+def certs():
+    hits["certs"] += 1
+    return {"keys": [_PUBLIC_JWK]}
+
+@app.get("/o/oauth2/v2/auth")
+def authorize(redirect_uri: str, state: str = "", login_hint: str = None):
+    """Autorizar sin pantalla de consentimiento"""
+    email = login_hint or f"user-{secrets.token_hex(4)}@example.com"
+    return RedirectResponse(url=f"{redirect_uri}?{urlencode({'code': _encode(email), 'state': state})}")
+
+@app.post("/token")
+def token(code: str = Form(...), client_id: str = Form(None)):
+    hits["token"] += 1
+    email = _decode(code)
+    access_token = "stub-" + _encode(email)
+    now = int(time.time())
+    id_token = jwt.encode(
+        {**_claims(email), "iss": STUB_BASE_URL, "aud": client_id, "iat": now, "exp": now + 3600},
+        _PRIVATE_PEM,
+        algorithm="RS256",
+        headers={"kid": STUB_KEY_ID},
+        access_token=access_token
+    )
+    return {
+        "access_token": access_token,
+        "expires_in": 3599,
+        "token_type": "Bearer",
+        "scope": "openid email profile",
+        "id_token": id_token,
+    }
+
+@app.get("/v1/userinfo")
+def userinfo(authorization: str = Header(None)):
+    hits["userinfo"] += 1
+    if not authorization or not authorization.startswith("Bearer stub-"):
+        raise HTTPException(status_code=401, detail="invalid_token")
+    return _claims(_decode(authorization[len("Bearer stub-"):]))
+
+@app.get("/stats")
+def stats():
+    return dict(hits)
@@ -0,0 +1,85 @@
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import copy
+import logging
+import orjson
+import os
+import queue
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+
+# Atributos estándar de LogRecord: el resto son campos estructurados (extra=...)
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos pasados en extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        # exc_text: la traza ya formateada por LogQueueHandler en el hilo que registró
+        exc = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exc:
+            entry["exc"] = exc
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return orjson.dumps(entry, default=str).decode()
+
+class LogQueueHandler(QueueHandler):
+    """QueueHandler que conserva la excepción aparte del mensaje.
+
+    El prepare estándar pega la traza al final de msg y borra exc_info, así
+    que JsonFormatter no podía emitirla en "exc". Aquí solo se resuelven los
+    args y la traza se formatea en exc_text, sin encolar el traceback (ni los
+    frames que retiene).
+    """
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+_listener: Optional[QueueListener] = None
+
+def configure_logging() -> None:
+    """Logging no bloqueante: los handlers de la app solo encolan y un hilo escribe en stdout"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("app")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(LogQueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging() -> None:
+    """Vaciar la cola y parar el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
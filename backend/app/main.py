@@ -1,28 +1,93 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from . import models, schemas, database
-from .api import auth, portfolios
-from .migrate import migrate_database
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from . import schemas, database
+from .api import auth, portfolios, media, snapshots
+from .migrate import migrate_database, schema_version, LATEST_VERSION
+from .logging_config import configure_logging, shutdown_logging
+from .metrics import MetricsMiddleware, METRICS_CONTENT_TYPE, render_metrics
+from .middleware import (
+    AdmissionControlMiddleware, CompressionMiddleware, PathPrefixMiddleware, ProfilingMiddleware,
+    QueryTimingMiddleware, RateLimitMiddleware, RequestSizeLimitMiddleware
+)
+from .services.admission import admission_controller, rate_limiter
+from .services.auth import check_secrets
+from .services.cache import public_portfolio_cache, user_profile_cache
+from .services.events import portfolio_events
+from .services.google import google_client
+from .services.revisions import RevisionService, revision_pruner
+from .services.snapshots import snapshot_renderer
+from .services.write_behind import autosave_buffer, flush_pending
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
+import logging
 import os
 
-# Ejecutar migración antes de crear las tablas
-print("Ejecutando migración de base de datos...")
-migrate_database()
+configure_logging()
+logger = logging.getLogger("app.main")
+
+# Las migraciones se aplican una vez por despliegue (python -m app.migrate) y, con
+# el esquema atrasado, la API no arranca. DB_AUTO_MIGRATE=true (solo en desarrollo)
+# hace que el primer worker que arranque las aplique
+AUTO_MIGRATE = database._env_bool("DB_AUTO_MIGRATE", False)
+
+# Clave de la cookie de sesión, distinta de JWT_SECRET; sin ellas no se arranca
+SESSION_SECRET_KEY = os.getenv("SECRET_KEY", "")
+check_secrets(SESSION_SECRET_KEY)
 
-# Crear tablas con el nuevo esquema
-models.Base.metadata.create_all(bind=database.engine)
+async def check_schema():
+    """Comprobar la versión del esquema al arrancar: una consulta si está al día"""
+    async with database.async_engine.connect() as connection:
+        version = await schema_version(connection)
+    if version >= LATEST_VERSION:
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(
+            f"Esquema en la versión {version}, se necesita la {LATEST_VERSION}: ejecuta python -m app.migrate"
+        )
+    logger.warning("Esquema en la versión %s, aplicando migraciones...", version)
+    await run_in_threadpool(migrate_database)
 
-app = FastAPI(title="DevPortfolio Builder API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await check_schema()
+    # Un único cliente HTTP (pool keep-alive) para todas las llamadas a Google
+    await google_client.start()
+    # Comprobación inicial de las réplicas y vigilancia de su retraso
+    await database.read_router.start()
+    autosave_buffer.start()
+    # Retención del historial de revisiones (sin depender de un cron externo)
+    revision_pruner.start()
+    yield
+    await revision_pruner.close()
+    # Escribir los autoguardados pendientes antes de cerrar nada de lo que usan
+    await autosave_buffer.close()
+    await google_client.close()
+    # Terminar los snapshots pendientes y cerrar las conexiones de los pools asíncronos
+    snapshot_renderer.shutdown()
+    await database.async_engine.dispose()
+    await database.read_router.close()
+    shutdown_logging()
 
-# Añadir middleware de sesiones (necesario para OAuth)
+app = FastAPI(title="DevPortfolio Builder API", lifespan=lifespan)
+
+# Añadir middleware de sesiones (necesario para OAuth y para renovar el token de acceso).
+# Solo en /auth: el resto de rutas no decodifica ni vuelve a firmar la cookie
 app.add_middleware(
-    SessionMiddleware, 
-    secret_key=os.getenv('SECRET_KEY', 'fallback-secret-key'),
-    max_age=86400  # 24 horas
+    PathPrefixMiddleware,
+    prefix="/auth",
+    middleware=SessionMiddleware,
+    secret_key=SESSION_SECRET_KEY,
+    max_age=86400,  # 24 horas
+    path="/auth"
 )
 
+# Control de admisión: descarte por concurrencia (503) y límite por cliente (429).
+# Dentro de CORS para que el navegador pueda leer el rechazo y su Retry-After
+app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(RateLimitMiddleware)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -32,9 +97,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión negociada (br/gzip) de respuestas grandes
+app.add_middleware(CompressionMiddleware)
+
+# Consultas y tiempo de BD por petición (cabecera Server-Timing, avisos de presupuesto)
+app.add_middleware(QueryTimingMiddleware)
+
+# Perfilado bajo demanda (cabecera X-Profile con PROFILE_SECRET)
+app.add_middleware(ProfilingMiddleware)
+
+# Cuerpos demasiado grandes: 413 antes de leerlos o parsearlos (dentro de métricas para contarlos)
+app.add_middleware(RequestSizeLimitMiddleware)
+
+# Métricas por ruta (la más externa: mide la respuesta tal como sale, ya comprimida)
+app.add_middleware(MetricsMiddleware)
+
 # Incluir rutas
 app.include_router(auth.router, prefix="/auth", tags=["authentication"])
 app.include_router(portfolios.router, prefix="/api/portfolios", tags=["portfolios"])
+app.include_router(media.router, prefix="/media", tags=["media"])
+app.include_router(snapshots.router, prefix="/snapshots", tags=["snapshots"])
 
 # Rutas básicas
 @app.get("/")
@@ -42,31 +124,75 @@ def read_root():
     return {"message": "DevPortfolio Builder API"}
 
 @app.get("/health")
-def health_check():
+async def health_check(response: Response):
+    # Comprobación real de la base de datos con su latencia
+    try:
+        latency_ms = await database.ping()
+        database_connected = True
+    except Exception as e:
+        logger.warning("Health check: database unreachable: %s", e)
+        latency_ms = None
+        database_connected = False
+        response.status_code = 503
+    
     return {
-        "status": "ok",
+        "status": "ok" if database_connected else "degraded",
         "google_client_id": os.getenv('GOOGLE_CLIENT_ID', 'Not configured'),
         "has_secret": bool(os.getenv('GOOGLE_CLIENT_SECRET')),
-        "database_connected": True
+        "database_connected": database_connected,
+        "database_latency_ms": round(latency_ms, 3) if latency_ms is not None else None
     }
 
+@app.get("/stats/db")
+def db_pool_stats():
+    """Estadísticas en vivo del pool de conexiones (monitorización)"""
+    return database.pool_status()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Métricas en formato Prometheus (peticiones, latencias, pool y caché)"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/stats/cache")
+def cache_stats():
+    """Estadísticas de la caché de portfolios públicos (monitorización)"""
+    return public_portfolio_cache.stats()
+
+@app.get("/stats/user-cache")
+def user_cache_stats():
+    """Estadísticas de la caché de perfiles de usuario"""
+    return user_profile_cache.stats()
+
+@app.get("/stats/admission")
+def admission_stats():
+    """Rechazos por límite de cliente y por saturación, y peticiones en curso"""
+    return {"rate_limit": rate_limiter.stats(), "concurrency": admission_controller.stats()}
+
+@app.get("/stats/events")
+def event_stats():
+    """Conexiones SSE abiertas y eventos repartidos o perdidos por clientes lentos"""
+    return portfolio_events.stats()
+
+@app.get("/stats/write-behind")
+def write_behind_stats():
+    """Buffer de autoguardado: portfolios pendientes y latencia de los vaciados"""
+    return autosave_buffer.stats()
+
+@app.get("/stats/revisions")
+async def revision_stats(db: AsyncSession = Depends(database.get_db)):
+    """Almacenamiento del historial (bytes lógicos frente a deduplicados) y poda periódica"""
+    return {**await RevisionService.get_storage_stats(db), "pruning": revision_pruner.stats()}
+
 # Ruta específica para /p/{name} - portfolios públicos
-@app.get("/portfolio/{portfolio_name}", response_model=schemas.Portfolio)
-def get_public_portfolio(portfolio_name: str, db: Session = Depends(database.get_db)):
+@app.get("/portfolio/{portfolio_name}", response_model=schemas.Portfolio, dependencies=[Depends(flush_pending)])
+async def get_public_portfolio(portfolio_name: str, request: Request, db: AsyncSession = Depends(database.get_read_db)):
     """Obtener portfolio para vista pública /p/{name}"""
     try:
-        # Buscar por nombre exacto o similar
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.name.ilike(f"%{portfolio_name}%")
-        ).first()
-        
-        if not portfolio:
-            raise HTTPException(status_code=404, detail="Portfolio no encontrado")
-        
-        return portfolio
+        # Buscar por slug exacto (índice único), sirviendo desde la caché con ETag
+        return await portfolios.public_portfolio_response(portfolio_name, request, db)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting public portfolio: {e}")
+        logger.exception("Error getting public portfolio: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener portfolio")
\ No newline at end of file
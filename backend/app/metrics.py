@@ -0,0 +1,158 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from . import database
+from .services.admission import admission_controller, rate_limiter
+from .services.cache import public_portfolio_cache, user_profile_cache
+from .services.events import portfolio_events
+from .services.write_behind import autosave_buffer
+import time
+
+# Ruta sin coincidencia: una sola etiqueta para no disparar la cardinalidad con URLs arbitrarias
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUESTS = Counter(
+    "http_requests_total", "Peticiones HTTP por ruta y código de estado",
+    ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso por ruta",
+    ["method", "route"]
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Tamaño de las respuestas HTTP (en el cable) por ruta",
+    ["method", "route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+
+def route_template(scope: Scope) -> str:
+    """Plantilla de la ruta (/api/portfolios/{portfolio_id}) que atenderá la petición"""
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    if router is None:
+        return UNMATCHED_ROUTE
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+class MetricsMiddleware:
+    """Recuento, latencia, peticiones en curso y tamaño de respuesta por ruta"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status_code = 500
+        size = 0
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            in_flight.dec()
+            LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            RESPONSE_SIZE.labels(method, route).observe(size)
+
+class _AppStatsCollector:
+    """Estadísticas del pool de conexiones y de la caché, leídas en cada scrape"""
+
+    def collect(self):
+        pools = database.pool_status()
+        in_use = GaugeMetricFamily("db_pool_checked_out", "Conexiones del pool en uso", labels=["pool"])
+        idle = GaugeMetricFamily("db_pool_checked_in", "Conexiones del pool libres", labels=["pool"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Conexiones por encima de pool_size", labels=["pool"])
+        checkouts = CounterMetricFamily("db_pool_checkouts", "Checkouts del pool", labels=["pool"])
+        timeouts = CounterMetricFamily("db_pool_checkout_timeouts", "Checkouts que agotaron pool_timeout", labels=["pool"])
+        wait = CounterMetricFamily("db_pool_checkout_wait_seconds", "Tiempo total esperando conexión", labels=["pool"])
+        replicas = pools["replicas"]
+        for name, pool in [("async", pools["async"]), ("sync", pools["sync"]), *replicas.items()]:
+            in_use.add_metric([name], pool["checked_out"])
+            idle.add_metric([name], pool["checked_in"])
+            overflow.add_metric([name], pool["overflow"])
+            checkouts.add_metric([name], pool["checkouts"])
+            timeouts.add_metric([name], pool["checkout_timeouts"])
+            wait.add_metric([name], pool["wait_total_ms"] / 1000)
+        yield from (in_use, idle, overflow, checkouts, timeouts, wait)
+
+        if replicas:
+            healthy = GaugeMetricFamily("db_replica_healthy", "1 si la réplica recibe lecturas", labels=["pool"])
+            lag = GaugeMetricFamily("db_replica_lag_seconds", "Retraso de la réplica en la última comprobación", labels=["pool"])
+            for name, replica in replicas.items():
+                healthy.add_metric([name], 1 if replica["healthy"] else 0)
+                if replica["lag_seconds"] is not None:
+                    lag.add_metric([name], replica["lag_seconds"])
+            yield from (healthy, lag)
+
+        cache = public_portfolio_cache.stats()
+        yield GaugeMetricFamily("public_cache_entries", "Portfolios en la caché pública", value=cache["entries"])
+        yield GaugeMetricFamily("public_cache_bytes", "Bytes ocupados por la caché pública", value=cache["bytes"])
+        yield CounterMetricFamily("public_cache_hits", "Aciertos de la caché pública", value=cache["hits"])
+        yield CounterMetricFamily("public_cache_misses", "Fallos de la caché pública", value=cache["misses"])
+
+        users = user_profile_cache.stats()
+        yield GaugeMetricFamily("user_cache_entries", "Perfiles en la caché de usuarios", value=users["entries"])
+        yield CounterMetricFamily("user_cache_hits", "Aciertos de la caché de usuarios", value=users["hits"])
+        yield CounterMetricFamily("user_cache_misses", "Fallos de la caché de usuarios", value=users["misses"])
+
+        limits = rate_limiter.stats()
+        allowed = CounterMetricFamily("rate_limit_allowed", "Peticiones dentro del presupuesto del cliente", labels=["route_class"])
+        limited = CounterMetricFamily("rate_limit_limited", "Peticiones rechazadas con 429", labels=["route_class"])
+        for name in limits["budgets"]:
+            allowed.add_metric([name], limits["allowed"][name])
+            limited.add_metric([name], limits["limited"][name])
+        yield from (allowed, limited)
+        admission = admission_controller.stats()
+        yield GaugeMetricFamily("admission_in_flight", "Peticiones en curso del proceso", value=admission["in_flight"])
+        yield GaugeMetricFamily("admission_limit", "Límite de concurrencia actual", value=admission["limit"])
+        yield CounterMetricFamily("admission_shed", "Peticiones rechazadas con 503 por saturación", value=admission["shed"])
+        yield GaugeMetricFamily("db_pool_checkout_wait_recent_seconds", "Media móvil de la espera de checkout", value=admission["pool_wait_recent_ms"] / 1000)
+
+        events = portfolio_events.stats()
+        yield GaugeMetricFamily("sse_subscribers", "Conexiones SSE de previsualización abiertas", value=events["subscribers"])
+        yield CounterMetricFamily("sse_events_published", "Cambios publicados a algún suscriptor", value=events["published"])
+        yield CounterMetricFamily("sse_events_delivered", "Eventos encolados a suscriptores", value=events["delivered"])
+        yield CounterMetricFamily("sse_events_dropped", "Eventos descartados por colas llenas", value=events["dropped"])
+
+        buffer = autosave_buffer.stats()
+        yield GaugeMetricFamily("write_behind_pending", "Portfolios con autoguardados sin escribir", value=buffer["pending"])
+        yield GaugeMetricFamily("write_behind_oldest_pending_seconds", "Antigüedad del cambio pendiente más antiguo", value=buffer["oldest_pending_ms"] / 1000)
+        yield CounterMetricFamily("write_behind_staged", "Autoguardados recibidos en el buffer", value=buffer["staged"])
+        yield CounterMetricFamily("write_behind_flushed", "Portfolios escritos por los vaciados", value=buffer["flushed"])
+        yield CounterMetricFamily("write_behind_flushes", "Vaciados del buffer", value=buffer["flushes"])
+        yield CounterMetricFamily("write_behind_flush_seconds", "Tiempo total de los vaciados", value=buffer["flush_total_seconds"])
+        yield CounterMetricFamily("write_behind_flush_failures", "Vaciados fallidos", value=buffer["failures"])
+
+REGISTRY.register(_AppStatsCollector())
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,445 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .database import QueryStats, request_query_stats
+from .services.admission import ADMISSION_RETRY_AFTER, AdmissionController, RateLimiter, admission_controller, rate_limiter
+from .services.media import MEDIA_MAX_BYTES
+import brotli
+import cProfile
+import gzip
+import hmac
+import io
+import logging
+import math
+import os
+import pstats
+import re
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Calidad moderada: las respuestas dinámicas se comprimen en cada petición
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Cuerpos más grandes se comprimen en el threadpool para no bloquear el event loop
+THREADPOOL_MIN_SIZE = 64 * 1024
+
+# Presupuesto por petición: por encima se registra un aviso con la ruta
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "10"))
+SQL_TIME_BUDGET_MS = float(os.getenv("SQL_TIME_BUDGET_MS", "200"))
+# Tope del cuerpo de una petición; las imágenes del editor viajan en línea (data: URI)
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(16 * 1024 * 1024)))
+# Topes por ruta (no por Content-Type, que elige el cliente). None: sin tope total,
+# solo para el import NDJSON, que se lee en streaming línea a línea con su propio límite
+ROUTE_BODY_LIMITS = [
+    ("POST", re.compile(r"^/api/portfolios/import/?$"), None),
+    # Subida de media: el fichero más la envoltura multipart
+    ("POST", re.compile(r"^/media/?$"), MEDIA_MAX_BYTES + 64 * 1024),
+]
+# Sin secreto configurado el perfilado está desactivado
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_HEADER = "x-profile"
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+
+def accept_encoding_qualities(accept_encoding: str) -> dict:
+    """Accept-Encoding como {codificación: q} (RFC 9110: q=0 rechaza; q mal formado cuenta como 0)"""
+    qualities = {}
+    for part in accept_encoding.split(","):
+        coding, *params = (piece.strip() for piece in part.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value.strip()), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+def choose_encoding(accept_encoding: str, available=("br", "gzip")):
+    """Elegir entre las codificaciones disponibles la de mayor q aceptada (a igual q, la primera).
+
+    Las no nombradas heredan la q de "*". None si el cliente no acepta ninguna.
+    """
+    qualities = accept_encoding_qualities(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        """Comprimir un trozo y vaciar el buffer para que el cliente lo reciba ya"""
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """Compresión negociada (brotli/gzip) de respuestas de texto por encima de un umbral.
+
+    Las respuestas de una sola pieza se comprimen enteras; las que llegan en
+    varios trozos (streaming) se comprimen trozo a trozo sin acumularlas.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Message = None
+        self.compressible = False
+        self.compressor: _Compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.compressible = (
+                "content-encoding" not in headers
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+                and not content_type.startswith("text/event-stream")
+            )
+            if not self.compressible:
+                await self.send(message)
+            else:
+                # Se retiene hasta ver el primer trozo del cuerpo
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or not self.compressible:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                # Respuesta pequeña: no compensa comprimir
+                await self.send(start)
+                await self.send(message)
+                self.compressible = False
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # La representación comprimida no es idéntica byte a byte
+                headers["ETag"] = f"W/{etag}"
+            if more_body:
+                del headers["Content-Length"]
+                self.compressor = _Compressor(self.encoding)
+                await self.send(start)
+            else:
+                if len(body) >= THREADPOOL_MIN_SIZE:
+                    compressed = await run_in_threadpool(compress_body, body, self.encoding)
+                else:
+                    compressed = compress_body(body, self.encoding)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+
+        if self.compressor is not None:
+            chunk = self.compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += self.compressor.finish()
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+class PathPrefixMiddleware:
+    """Aplica otro middleware solo a las rutas bajo un prefijo; el resto pasa directo"""
+
+    def __init__(self, app: ASGIApp, prefix: str, middleware, **options):
+        self.app = app
+        self.prefix = prefix.rstrip("/")
+        self.wrapped = middleware(app, **options)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] in ("http", "websocket") and (path == self.prefix or path.startswith(self.prefix + "/")):
+            await self.wrapped(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+class RequestSizeLimitMiddleware:
+    """Rechaza con 413 los cuerpos por encima del tope de su ruta sin acumularlos.
+
+    El tope sale de route_limits por método y path (max_body_size si ninguna
+    entrada coincide); nunca de cabeceras que controle el cliente.
+
+    Con Content-Length se responde sin leer nada; sin él (chunked) se cuentan
+    los bytes según llegan y la lectura se corta al pasar el límite, antes de
+    que el cuerpo se termine de recibir o se parsee.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int = MAX_REQUEST_BODY_BYTES,
+                 route_limits=ROUTE_BODY_LIMITS):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.route_limits = route_limits
+
+    def limit_for(self, scope: Scope):
+        for method, pattern, limit in self.route_limits:
+            if scope["method"] == method and pattern.match(scope["path"]):
+                return limit
+        return self.max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received = 0
+        response_started = False
+
+        async def receive_limited() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException: FastAPI la deja pasar al leer el cuerpo y responde 413
+                    raise HTTPException(status_code=413, detail=self._detail(limit))
+            return message
+
+        async def send_tracking(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_tracking)
+        except HTTPException as e:
+            # Cuerpo leído fuera de las rutas (p. ej. por otro middleware)
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(scope, receive, send, limit)
+
+    @staticmethod
+    def _detail(limit: int) -> str:
+        return f"Cuerpo de la petición demasiado grande (máximo {limit} bytes)"
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, limit: int) -> None:
+        logger.warning(
+            "Petición rechazada por tamaño",
+            extra={"method": scope["method"], "path": scope["path"], "max_bytes": limit}
+        )
+        response = JSONResponse({"detail": self._detail(limit)}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+class RateLimitMiddleware:
+    """429 con Retry-After cuando un cliente agota el cubo de tokens de la clase de ruta"""
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limited = await self.limiter.check(scope)
+        if limited is None:
+            await self.app(scope, receive, send)
+            return
+        _, retry_after = limited
+        response = JSONResponse(
+            {"detail": "Demasiadas peticiones, inténtalo más tarde"},
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+class AdmissionControlMiddleware:
+    """503 con Retry-After cuando el proceso ya tiene demasiadas peticiones en curso"""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController = admission_controller,
+                 retry_after: int = ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.controller.exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        if not self.controller.try_acquire():
+            response = JSONResponse(
+                {"detail": "Servidor saturado, inténtalo más tarde"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+class QueryTimingMiddleware:
+    """Cuenta consultas y tiempo de BD de cada petición.
+
+    Los publica en la cabecera Server-Timing y avisa en el log de las
+    peticiones que superan el presupuesto de consultas o de tiempo.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = request_query_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                total_ms = (time.perf_counter() - start) * 1000
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_query_stats.reset(token)
+            db_ms = stats.duration * 1000
+            if stats.count > SQL_QUERY_BUDGET or db_ms > SQL_TIME_BUDGET_MS:
+                logger.warning(
+                    "Petición por encima del presupuesto de BD",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "queries": stats.count,
+                        "db_ms": round(db_ms, 1),
+                        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+                    }
+                )
+
+class ProfilingMiddleware:
+    """Perfilado bajo demanda de una petición con cProfile.
+
+    Con la cabecera X-Profile igual a PROFILE_SECRET, la respuesta se descarta
+    y se devuelve el informe de pstats (ordenado por tiempo acumulado). El
+    perfilador es de todo el hilo: con otras peticiones en curso su trabajo
+    también aparece en el informe.
+    """
+
+    def __init__(self, app: ASGIApp, secret: str = PROFILE_SECRET, limit: int = 60):
+        self.app = app
+        self.secret = secret
+        self.limit = limit
+
+    def _requested(self, scope: Scope) -> bool:
+        if not self.secret or scope["type"] != "http":
+            return False
+        provided = Headers(scope=scope).get(PROFILE_HEADER)
+        return provided is not None and hmac.compare_digest(provided.encode(), self.secret.encode())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def discard(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        report = io.StringIO()
+        report.write(f"{scope['method']} {scope['path']} -> {status_code} en {elapsed_ms:.1f} ms\n\n")
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(self.limit)
+        body = report.getvalue().encode()
+        logger.info("Petición perfilada", extra={"path": scope["path"], "total_ms": round(elapsed_ms, 1)})
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profiled-status", str(status_code).encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
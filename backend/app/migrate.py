@@ -1,74 +1,363 @@
-from sqlalchemy import text
-from .database import engine
+from sqlalchemy import select, text
+from sqlalchemy.exc import ProgrammingError
 from . import models
+from .database import engine
+from .logging_config import configure_logging
+from .services.portfolio import EXPORT_FIELDS, slugify, pick_free_slug
+from .services.media import media_store
+from .services.revisions import prune_revisions, storage_stats, storage_stats_statement
+from .services.snapshots import build_snapshot, snapshot_job
+import json
+import logging
+import orjson
+import sys
+
+logger = logging.getLogger("app.migrate")
+
+# Clave del advisory lock: un solo proceso migra aunque arranquen N workers
+MIGRATION_LOCK_KEY = 727001
+
+def _create_base_tables(connection):
+    """Tablas users y portfolios tal como estaban antes de las migraciones versionadas"""
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            google_id VARCHAR UNIQUE NOT NULL,
+            email VARCHAR UNIQUE NOT NULL,
+            name VARCHAR NOT NULL,
+            given_name VARCHAR,
+            family_name VARCHAR,
+            picture VARCHAR,
+            locale VARCHAR,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE
+        );
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS portfolios (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            content JSON,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE
+        );
+    """))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_portfolios_name ON portfolios (name)"))
+
+def _add_portfolio_slug(connection):
+    """Columna slug (URL pública /p/{slug}) con índice único"""
+    connection.execute(text("ALTER TABLE portfolios ADD COLUMN IF NOT EXISTS slug VARCHAR"))
+    backfill_portfolio_slugs(connection)
+    connection.execute(text("ALTER TABLE portfolios ALTER COLUMN slug SET NOT NULL"))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_portfolios_slug ON portfolios (slug)"))
+
+def _add_portfolio_version(connection):
+    """Columna version para el autosave con control optimista"""
+    connection.execute(text(
+        "ALTER TABLE portfolios ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+    ))
+
+def _content_to_jsonb(connection):
+    """content pasa de JSON a JSONB (indexable, sin re-parsear en cada acceso)"""
+    content_type = connection.execute(text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'portfolios' AND table_schema = 'public' AND column_name = 'content';
+    """)).scalar()
+    if content_type == 'json':
+        connection.execute(text(
+            "ALTER TABLE portfolios ALTER COLUMN content TYPE JSONB USING content::jsonb"
+        ))
+        backfill_block_types(connection)
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_portfolios_content_gin
+        ON portfolios USING gin (content jsonb_path_ops);
+    """))
+
+def _keyset_updated_at(connection):
+    """updated_at siempre informado para poder paginar por (updated_at, id)"""
+    connection.execute(text("""
+        UPDATE portfolios SET updated_at = COALESCE(created_at, NOW())
+        WHERE updated_at IS NULL;
+    """))
+    connection.execute(text("""
+        ALTER TABLE portfolios
+            ALTER COLUMN updated_at SET DEFAULT NOW(),
+            ALTER COLUMN updated_at SET NOT NULL;
+    """))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_portfolios_user_updated_id
+        ON portfolios (user_id, updated_at DESC, id DESC);
+    """))
+
+def _name_trigram_index(connection):
+    """Índice trigram para la búsqueda aproximada por nombre"""
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_portfolios_name_trgm
+        ON portfolios USING gin (name gin_trgm_ops);
+    """))
+
+def _user_directory_indexes(connection):
+    """created_at obligatorio e índices del listado paginado de usuarios"""
+    connection.execute(text("UPDATE users SET created_at = NOW() WHERE created_at IS NULL"))
+    connection.execute(text("""
+        ALTER TABLE users
+            ALTER COLUMN created_at SET DEFAULT NOW(),
+            ALTER COLUMN created_at SET NOT NULL;
+    """))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_users_created_id
+        ON users (created_at DESC, id DESC);
+    """))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_users_active_created_id
+        ON users (is_active, created_at DESC, id DESC);
+    """))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_users_email_lower_pattern
+        ON users (lower(email) text_pattern_ops);
+    """))
+
+def _slug_pattern_index(connection):
+    """Índice text_pattern_ops de slug: el btree único no sirve LIKE 'base-%' con collation no C"""
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_portfolios_slug_pattern
+        ON portfolios (slug text_pattern_ops);
+    """))
+
+def _revision_store(connection):
+    """Historial de revisiones con bloques direccionados por contenido"""
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS block_blobs (
+            hash VARCHAR(64) PRIMARY KEY,
+            data JSONB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS portfolio_revisions (
+            id SERIAL PRIMARY KEY,
+            portfolio_id INTEGER NOT NULL REFERENCES portfolios(id) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            meta_hash VARCHAR(64) REFERENCES block_blobs(hash),
+            content_hash VARCHAR(64),
+            block_count INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+        );
+    """))
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_portfolio_revisions_portfolio_id
+        ON portfolio_revisions (portfolio_id, id DESC);
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS revision_blocks (
+            revision_id INTEGER NOT NULL REFERENCES portfolio_revisions(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            block_id VARCHAR NOT NULL,
+            hash VARCHAR(64) REFERENCES block_blobs(hash),
+            in_layout BOOLEAN NOT NULL DEFAULT TRUE,
+            PRIMARY KEY (revision_id, position)
+        );
+    """))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_revision_blocks_hash ON revision_blocks (hash)"))
+
+# Migraciones en orden. Nunca se edita una ya publicada: los cambios van en una
+# nueva entrada. Todas son idempotentes porque las bases de datos anteriores a
+# schema_version ya pueden tener aplicada parte de ellas.
+MIGRATIONS = [
+    (1, "tablas users y portfolios", _create_base_tables),
+    (2, "portfolios.slug", _add_portfolio_slug),
+    (3, "portfolios.version", _add_portfolio_version),
+    (4, "portfolios.content JSONB + índice GIN", _content_to_jsonb),
+    (5, "portfolios.updated_at NOT NULL + índice keyset", _keyset_updated_at),
+    (6, "índice trigram de portfolios.name", _name_trigram_index),
+    (7, "users.created_at NOT NULL + índices del listado", _user_directory_indexes),
+    (8, "historial de revisiones (block_blobs, portfolio_revisions, revision_blocks)", _revision_store),
+    (9, "índice text_pattern_ops de portfolios.slug", _slug_pattern_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
 
 def migrate_database():
-    """Migrar la base de datos a la nueva estructura"""
-    
+    """Aplicar las migraciones pendientes (una vez por despliegue).
+
+    Se serializa con un advisory lock: si varios procesos arrancan a la vez,
+    el resto espera y encuentra el esquema ya al día.
+    """
     with engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        connection.commit()
         try:
-            # Verificar si la tabla portfolios existe y tiene las columnas correctas
-            result = connection.execute(text("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'portfolios' AND table_schema = 'public';
-            """))
-            
-            existing_columns = [row[0] for row in result.fetchall()]
-            print(f"Columnas existentes en portfolios: {existing_columns}")
-            
-            # Si no existe la tabla portfolios, crearla
-            if not existing_columns:
-                print("Tabla portfolios no existe, creándola...")
-                connection.execute(text("""
-                    CREATE TABLE portfolios (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR NOT NULL,
-                        content JSON,
-                        user_id INTEGER NOT NULL REFERENCES users(id),
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                        updated_at TIMESTAMP WITH TIME ZONE
-                    );
-                """))
-                connection.commit()
-                print("Tabla portfolios creada exitosamente")
-            
-            # Verificar tabla users
-            result = connection.execute(text("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'users' AND table_schema = 'public';
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+                );
             """))
-            
-            user_columns = [row[0] for row in result.fetchall()]
-            print(f"Columnas existentes en users: {user_columns}")
-            
-            # Crear tabla users si no existe
-            if not user_columns:
-                print("Tabla users no existe, creándola...")
-                connection.execute(text("""
-                    CREATE TABLE users (
-                        id SERIAL PRIMARY KEY,
-                        google_id VARCHAR UNIQUE NOT NULL,
-                        email VARCHAR UNIQUE NOT NULL,
-                        name VARCHAR NOT NULL,
-                        given_name VARCHAR,
-                        family_name VARCHAR,
-                        picture VARCHAR,
-                        locale VARCHAR,
-                        is_active BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                        updated_at TIMESTAMP WITH TIME ZONE
-                    );
-                """))
-                connection.commit()
-                print("Tabla users creada exitosamente")
-            
-            print("Migración completada exitosamente")
-            
+            current = connection.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+            connection.commit()
+
+            pending = [migration for migration in MIGRATIONS if migration[0] > current]
+            if not pending:
+                logger.info("Esquema al día (versión %s)", current)
+                return current
+
+            for version, description, step in pending:
+                logger.info("Aplicando migración %s: %s", version, description)
+                # Cada migración y su registro en schema_version, en la misma transacción
+                with connection.begin():
+                    step(connection)
+                    connection.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                        {"version": version, "description": description}
+                    )
+            logger.info("Migración completada: versión %s -> %s", current, LATEST_VERSION)
+            return LATEST_VERSION
         except Exception as e:
-            print(f"Error en migración: {e}")
-            connection.rollback()
+            logger.exception("Error en migración: %s", e)
+            raise
+        finally:
+            if connection.in_transaction():
+                connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            connection.commit()
+
+async def schema_version(connection) -> int:
+    """Versión aplicada del esquema (0 si aún no hay schema_version). Una sola consulta."""
+    try:
+        return await connection.scalar(text("SELECT MAX(version) FROM schema_version")) or 0
+    except ProgrammingError:
+        await connection.rollback()
+        return 0
+
+def backfill_portfolio_slugs(connection):
+    """Asignar un slug único a los portfolios que no lo tienen, en orden de creación"""
+    rows = connection.execute(text("SELECT id, name FROM portfolios WHERE slug IS NULL ORDER BY id")).fetchall()
+    taken = set(connection.execute(text("SELECT slug FROM portfolios WHERE slug IS NOT NULL")).scalars())
+    for portfolio_id, name in rows:
+        slug = pick_free_slug(slugify(name), taken)
+        taken.add(slug)
+        connection.execute(
+            text("UPDATE portfolios SET slug = :slug WHERE id = :id"),
+            {"slug": slug, "id": portfolio_id}
+        )
+    logger.info("Slugs asignados a %s portfolios", len(rows))
+
+def backfill_block_types(connection):
+    """Calcular la clave derivada content.blockTypes en los portfolios existentes"""
+    connection.execute(text("""
+        UPDATE portfolios
+        SET content = jsonb_set(content, '{blockTypes}', (
+            SELECT COALESCE(jsonb_agg(DISTINCT split_part(block, '-', 1)), '[]'::jsonb)
+            FROM jsonb_array_elements_text(content -> 'blocks') AS block
+        ))
+        WHERE jsonb_typeof(content -> 'blocks') = 'array';
+    """))
+
+def migrate_inline_media(batch_size: int = 100):
+    """Mover los data: URI de los portfolios existentes al almacén de media.
+
+    Migración de datos puntual: python -m app.migrate media
+    """
+    migrated = 0
+    extracted_total = 0
+    last_id = 0
+    with engine.connect() as connection:
+        while True:
+            rows = connection.execute(text("""
+                SELECT id, content FROM portfolios
+                WHERE id > :last_id AND content::text LIKE '%"data:%'
+                ORDER BY id
+                LIMIT :limit
+            """), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            for portfolio_id, content in rows:
+                last_id = portfolio_id
+                new_content, extracted = media_store.extract_inline_media(content)
+                if not extracted:
+                    continue
+                connection.execute(
+                    text("UPDATE portfolios SET content = CAST(:content AS JSONB) WHERE id = :id"),
+                    {"content": json.dumps(new_content), "id": portfolio_id}
+                )
+                migrated += 1
+                extracted_total += extracted
+            connection.commit()
+    logger.info("Media extraída: %s ficheros de %s portfolios", extracted_total, migrated)
+
+def build_all_snapshots(batch_size: int = 100):
+    """Generar los snapshots HTML que falten o estén desactualizados.
+
+    python -m app.migrate snapshots
+    """
+    built = 0
+    last_id = 0
+    with engine.connect() as connection:
+        while True:
+            rows = connection.execute(text("""
+                SELECT id, slug, name, content, updated_at FROM portfolios
+                WHERE id > :last_id ORDER BY id LIMIT :limit
+            """), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                last_id = row.id
+                if build_snapshot(snapshot_job(row)):
+                    built += 1
+    logger.info("Snapshots generados: %s", built)
+
+def export_all_portfolios(path: str, batch_size: int = 500):
+    """Volcado NDJSON de todos los portfolios (mismo formato que GET /export).
+
+    La API solo exporta los del usuario del token; el volcado global es
+    de administración: python -m app.migrate export <fichero>
+    """
+    table = models.Portfolio.__table__
+    query = select(*(table.c[field] for field in EXPORT_FIELDS)).order_by(table.c.id)
+    exported = 0
+    with engine.connect() as connection, open(path, "wb") as output:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+        for partition in result.mappings().partitions():
+            output.write(b"".join(orjson.dumps(dict(row), option=orjson.OPT_APPEND_NEWLINE) for row in partition))
+            exported += len(partition)
+    logger.info("Portfolios exportados: %s en %s", exported, path)
+
+def prune_revision_history():
+    """Aplicar la retención del historial y recoger los blobs huérfanos.
+
+    Mantenimiento periódico: python -m app.migrate revisions
+    """
+    with engine.begin() as connection:
+        pruned = prune_revisions(connection)
+        stats = storage_stats(connection.execute(storage_stats_statement()).one())
+    logger.info(
+        "Revisiones eliminadas: %s; blobs liberados: %s (%s bytes)",
+        pruned["revisions_deleted"], pruned["blobs_deleted"], pruned["bytes_freed"]
+    )
+    logger.info(
+        "Historial: %s revisiones en %s blobs; %s bytes lógicos, %s almacenados (%s ahorrados)",
+        stats["revisions"], stats["blobs"], stats["logical_bytes"], stats["stored_bytes"], stats["saved_bytes"]
+    )
 
 if __name__ == "__main__":
-    migrate_database()
\ No newline at end of file
+    configure_logging()
+    if "media" in sys.argv[1:]:
+        migrate_inline_media()
+    elif "snapshots" in sys.argv[1:]:
+        build_all_snapshots()
+    elif "revisions" in sys.argv[1:]:
+        prune_revision_history()
+    elif sys.argv[1:2] == ["export"]:
+        if len(sys.argv) != 3:
+            sys.exit("Uso: python -m app.migrate export <fichero.ndjson>")
+        export_all_portfolios(sys.argv[2])
+    else:
+        try:
+            migrate_database()
+        except Exception:
+            sys.exit(1)
\ No newline at end of file
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -15,21 +16,98 @@ class User(Base):
     picture = Column(String)  # URL de la foto de perfil
     locale = Column(String)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # Relación con portfolios
     portfolios = relationship("Portfolio", back_populates="user")
 
+    __table_args__ = (
+        # Listado paginado por (created_at, id), con o sin filtro is_active.
+        # El filtro por prefijo de email usa además ix_users_email_lower_pattern
+        # (lower(email) text_pattern_ops), creado en migrate.py
+        Index("ix_users_created_id", created_at.desc(), id.desc()),
+        Index("ix_users_active_created_id", is_active, created_at.desc(), id.desc()),
+    )
+
 class Portfolio(Base):
     __tablename__ = "portfolios"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
-    content = Column(JSON)
+    slug = Column(String, unique=True, index=True, nullable=False)  # URL pública /p/{slug}
+    content = Column(JSONB)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Control optimista de concurrencia
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
     # Relación con usuario
-    user = relationship("User", back_populates="portfolios")
\ No newline at end of file
+    user = relationship("User", back_populates="portfolios")
+
+    __table_args__ = (
+        # Índice trigram para la búsqueda aproximada por nombre (requiere pg_trgm)
+        Index(
+            "ix_portfolios_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        # Consultas de contención sobre content (p. ej. content @> '{"blockTypes": ["projects"]}')
+        Index(
+            "ix_portfolios_content_gin",
+            "content",
+            postgresql_using="gin",
+            postgresql_ops={"content": "jsonb_path_ops"},
+        ),
+        # Listado paginado del dashboard: keyset sobre (updated_at, id) por usuario
+        Index("ix_portfolios_user_updated_id", user_id, updated_at.desc(), id.desc()),
+        # slug LIKE 'base-%' al elegir un slug libre (el índice único no sirve LIKE)
+        Index(
+            "ix_portfolios_slug_pattern",
+            "slug",
+            postgresql_ops={"slug": "text_pattern_ops"},
+        ),
+    )
+
+class BlockBlob(Base):
+    """Propiedades de un bloque, guardadas una sola vez por hash de su contenido"""
+    __tablename__ = "block_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 del JSON canónico
+    data = Column(JSONB, nullable=False)
+    size = Column(Integer, nullable=False)  # bytes del JSON canónico
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class PortfolioRevision(Base):
+    __tablename__ = "portfolio_revisions"
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    name = Column(String, nullable=False)
+    # Claves de content que no son bloques (tema, ajustes...), también deduplicadas
+    meta_hash = Column(String(64), ForeignKey("block_blobs.hash"))
+    content_hash = Column(String(64))  # hash del documento completo: detecta guardados sin cambios
+    block_count = Column(Integer)  # NULL: content sin formato de editor, guardado entero en meta_hash
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_portfolio_revisions_portfolio_id", portfolio_id, id.desc()),
+    )
+
+class RevisionBlock(Base):
+    """Una revisión es la lista ordenada de sus bloques y el hash de sus propiedades"""
+    __tablename__ = "revision_blocks"
+
+    revision_id = Column(Integer, ForeignKey("portfolio_revisions.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    block_id = Column(String, nullable=False)
+    hash = Column(String(64), ForeignKey("block_blobs.hash"))  # NULL: bloque sin propiedades
+    # False: propiedades de un id que no está en content.blocks (se conservan igual)
+    in_layout = Column(Boolean, nullable=False, default=True, server_default="true")
+
+    __table_args__ = (
+        # Recolección de blobs huérfanos
+        Index("ix_revision_blocks_hash", hash),
+    )
@@ -1,6 +1,16 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, ValidationError
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
+from typing_extensions import Annotated
+from .services.media import MEDIA_ALLOWED_TYPES, MEDIA_MAX_BYTES, data_uri_type
+import os
+
+# Límites de content en escritura (el tamaño del cuerpo lo acota antes RequestSizeLimitMiddleware)
+CONTENT_MAX_DEPTH = int(os.getenv("CONTENT_MAX_DEPTH", "16"))
+CONTENT_MAX_BLOCKS = int(os.getenv("CONTENT_MAX_BLOCKS", "200"))
+CONTENT_MAX_STRING_LENGTH = int(os.getenv("CONTENT_MAX_STRING_LENGTH", "20000"))
+# Las imágenes del editor llegan como data: URI hasta que prepare_content las saca a media
+CONTENT_MAX_DATA_URI_LENGTH = MEDIA_MAX_BYTES * 4 // 3 + 256
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -30,20 +40,228 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserSummary(BaseModel):
+    # Todos opcionales: el parámetro fields= decide cuáles se devuelven
+    id: Optional[int] = None
+    google_id: Optional[str] = None
+    email: Optional[str] = None
+    name: Optional[str] = None
+    given_name: Optional[str] = None
+    family_name: Optional[str] = None
+    picture: Optional[str] = None
+    locale: Optional[str] = None
+    is_active: Optional[bool] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class UserPage(BaseModel):
+    items: List[UserSummary]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+# Propiedades de los bloques del editor (interfaces *Props de components/blocks en el frontend).
+# Solo se tipan las claves conocidas; las demás se ignoran al validar pero se
+# guardan igual, porque validate_content devuelve el dict original
+class BlockProperties(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    backgroundColor: Optional[str] = None
+    textColor: Optional[str] = None
+    primaryColor: Optional[str] = None
+    secondaryColor: Optional[str] = None
+    fontSize: Optional[str] = None
+    textAlign: Optional[str] = None
+    padding: Optional[str] = None
+    borderRadius: Optional[str] = None
+    buttonText: Optional[str] = None
+    showButton: Optional[bool] = None
+    showSocial: Optional[bool] = None
+
+class HeroProperties(BlockProperties):
+    subtitle: Optional[str] = None
+    backgroundImage: Optional[str] = None
+    profileImage: Optional[str] = None
+    githubLink: Optional[str] = None
+    linkedinLink: Optional[str] = None
+    twitterLink: Optional[str] = None
+    emailLink: Optional[str] = None
+    phoneLink: Optional[str] = None
+
+class TimelineEntry(BaseModel):
+    year: str = ""
+    title: str = ""
+    company: str = ""
+
+class AboutProperties(BlockProperties):
+    showIcon: Optional[bool] = None
+    iconColor: Optional[str] = None
+    profileImage: Optional[str] = None
+    name: Optional[str] = None
+    role: Optional[str] = None
+    location: Optional[str] = None
+    experience: Optional[str] = None
+    skills: Optional[List[str]] = None
+    showStats: Optional[bool] = None
+    emailLink: Optional[str] = None
+    linkedinLink: Optional[str] = None
+    githubLink: Optional[str] = None
+    phoneLink: Optional[str] = None
+    cvLink: Optional[str] = None
+    projectsCount: Optional[str] = None
+    clientsCount: Optional[str] = None
+    coffeeCount: Optional[str] = None
+    timeline: Optional[List[TimelineEntry]] = None
+
+class ProjectItem(BaseModel):
+    title: str = ""
+    description: str = ""
+    image: str = ""
+    technologies: List[str] = []
+    demoLink: Optional[str] = None
+    githubLink: Optional[str] = None
+    date: Optional[str] = None
+    featured: Optional[bool] = None
+
+class ProjectsProperties(BlockProperties):
+    projects: Optional[List[ProjectItem]] = None
+    showTechnologies: Optional[bool] = None
+    showLinks: Optional[bool] = None
+    showDate: Optional[bool] = None
+    layout: Optional[Literal["grid", "masonry", "carousel"]] = None
+    columns: Optional[int] = Field(None, ge=1, le=12)
+
+class ContactProperties(BlockProperties):
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+    website: Optional[str] = None
+    linkedinUrl: Optional[str] = None
+    githubUrl: Optional[str] = None
+    twitterUrl: Optional[str] = None
+    instagramUrl: Optional[str] = None
+    availability: Optional[str] = None
+    timezone: Optional[str] = None
+    responseTime: Optional[str] = None
+    showAvailability: Optional[bool] = None
+
+# Tipo de bloque (prefijo del id, 'hero-0-1712345678') -> esquema de sus propiedades
+BLOCK_PROPERTIES = {
+    "hero": HeroProperties,
+    "about": AboutProperties,
+    "projects": ProjectsProperties,
+    "contact": ContactProperties,
+}
+
+class EditorContent(BaseModel):
+    """content tal como lo guarda el editor; las propiedades se validan aparte, por tipo"""
+    blocks: List[str] = Field(..., max_length=CONTENT_MAX_BLOCKS)
+    blockProperties: Dict[str, Dict[str, Any]] = Field({}, max_length=CONTENT_MAX_BLOCKS)
+    lastUpdated: Optional[str] = None
+
+def check_content_limits(content: Any) -> None:
+    """Recorrer content sin recursión comprobando profundidad, longitud de textos
+    y que los data: URI sean imágenes de MEDIA_ALLOWED_TYPES.
+
+    Recorre todos los nodos en cada escritura: type() en lugar de isinstance
+    (el JSON parseado solo tiene tipos exactos) y la pila con métodos locales.
+    """
+    stack = [(content, 1)]
+    pop, push = stack.pop, stack.append
+    while stack:
+        value, depth = pop()
+        if depth > CONTENT_MAX_DEPTH:
+            raise ValueError(f"content demasiado anidado (máximo {CONTENT_MAX_DEPTH} niveles)")
+        if type(value) is dict:
+            for key in value:
+                if len(key) > CONTENT_MAX_STRING_LENGTH:
+                    raise ValueError(f"Clave demasiado larga en content (máximo {CONTENT_MAX_STRING_LENGTH} caracteres)")
+            value = value.values()
+        for item in value:
+            kind = type(item)
+            if kind is str:
+                if item.startswith("data:"):
+                    media_type = data_uri_type(item)
+                    if media_type is not None and media_type not in MEDIA_ALLOWED_TYPES:
+                        raise ValueError(f"Tipo de imagen no admitido en content: {media_type}")
+                if len(item) > CONTENT_MAX_STRING_LENGTH:
+                    limit = CONTENT_MAX_DATA_URI_LENGTH if item.startswith("data:") else CONTENT_MAX_STRING_LENGTH
+                    if len(item) > limit:
+                        raise ValueError(f"Texto demasiado largo en content ({len(item)} caracteres, máximo {limit})")
+            elif kind is dict or kind is list:
+                push((item, depth + 1))
+
+def validate_content(content: Dict[str, Any]) -> Dict[str, Any]:
+    """Validar content antes de escribirlo; lanza ValueError con el primer problema.
+
+    Se devuelve el mismo dict (no el modelo): lo que se guarda es lo que envió
+    el cliente. El content sin formato de editor solo pasa los límites genéricos.
+    """
+    check_content_limits(content)
+    if "blocks" not in content and "blockProperties" not in content:
+        return content
+    _validate_model(EditorContent, content, "")
+    for block_id, properties in content.get("blockProperties", {}).items():
+        model = BLOCK_PROPERTIES.get(block_id.split("-", 1)[0])
+        if model is not None:
+            _validate_model(model, properties, f"blockProperties.{block_id}.")
+    return content
+
+def _validate_model(model, data: Any, prefix: str) -> None:
+    """Validar con un modelo y resumir el primer error como ValueError"""
+    try:
+        model.model_validate(data)
+    except ValidationError as e:
+        error = e.errors()[0]
+        location = ".".join(str(part) for part in error["loc"])
+        raise ValueError(f"{prefix}{location}: {error['msg']}") from None
+
+# content de entrada (create, update, import): tipado y acotado
+PortfolioContent = Annotated[Dict[str, Any], AfterValidator(validate_content)]
+
 # Esquemas del Portfolio
 class PortfolioBase(BaseModel):
     name: str
     content: Dict[Any, Any]
 
 class PortfolioCreate(PortfolioBase):
+    content: PortfolioContent
     user_id: int  # Ahora es obligatorio
 
+class PortfolioClone(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+class PortfolioImport(BaseModel):
+    """Una línea del volcado NDJSON (los campos que genera el export)"""
+    name: str
+    content: Optional[PortfolioContent] = None
+    user_id: Optional[int] = None
+    slug: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class PortfolioImportResult(BaseModel):
+    imported: int
+    batches: int
+
 class PortfolioUpdate(BaseModel):
     name: Optional[str] = None
-    content: Optional[Dict[Any, Any]] = None
+    content: Optional[PortfolioContent] = None
+
+class PortfolioPatch(BaseModel):
+    version: int  # Versión sobre la que el cliente calculó el parche
+    operations: List[Dict[str, Any]]  # Operaciones JSON Patch (RFC 6902) sobre content
+
+class PortfolioVersion(BaseModel):
+    id: int
+    version: int
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
 
 class Portfolio(PortfolioBase):
     id: int
+    slug: str
+    version: int
     user_id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -51,6 +269,49 @@ class Portfolio(PortfolioBase):
     class Config:
         from_attributes = True
 
+class PortfolioSearchResult(BaseModel):
+    id: int
+    name: str
+    slug: str
+    user_id: int
+
+    class Config:
+        from_attributes = True
+
+class PortfolioSummary(BaseModel):
+    # Todos opcionales: el parámetro fields= decide cuáles se devuelven
+    id: Optional[int] = None
+    name: Optional[str] = None
+    slug: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    block_count: Optional[int] = None
+
+class PortfolioSummaryPage(BaseModel):
+    items: List[PortfolioSummary]
+    next_cursor: Optional[str] = None
+
+class PortfolioRevisionSummary(BaseModel):
+    id: int
+    version: int
+    name: str
+    block_count: Optional[int] = None
+    created_at: datetime
+
+class PortfolioRevisionPage(BaseModel):
+    items: List[PortfolioRevisionSummary]
+    next_cursor: Optional[str] = None
+
+class PortfolioRevision(PortfolioRevisionSummary):
+    portfolio_id: int
+    content: Optional[Dict[Any, Any]] = None
+
+class Media(BaseModel):
+    filename: str
+    url: str
+    size: int
+    content_type: Optional[str] = None
+
 # Schema para User con portfolios
 class UserWithPortfolios(User):
     portfolios: List[Portfolio] = []
@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from starlette.types import Scope
+from .. import database
+from .auth import decode_access_token
+from jose import JWTError
+import importlib
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = database._env_bool("RATE_LIMIT_ENABLED", True)
+# Backend compartido entre workers: "paquete.modulo:objeto" (clase o instancia); vacío: en memoria
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+# Detrás de un proxy de confianza el cliente es el primero de X-Forwarded-For
+RATE_LIMIT_TRUST_FORWARDED = database._env_bool("RATE_LIMIT_TRUST_FORWARDED", False)
+# Cubos en memoria; al pasar el tope se descartan los menos usados
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Peticiones en curso por proceso; por encima, 503
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "100"))
+# Con el pool saturado solo se admiten tantas como conexiones puede dar
+ADMISSION_DEGRADED_CONCURRENCY = int(os.getenv(
+    "ADMISSION_DEGRADED_CONCURRENCY",
+    str(database.POOL_SETTINGS["pool_size"] + database.POOL_SETTINGS["max_overflow"])
+))
+# Espera reciente de checkout (ms) a partir de la cual el pool se considera saturado
+ADMISSION_POOL_WAIT_MS = float(os.getenv("ADMISSION_POOL_WAIT_MS", "100"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+@dataclass(frozen=True)
+class Budget:
+    rate: float  # tokens por segundo
+    burst: float  # capacidad del cubo: peticiones seguidas tras un rato inactivo
+
+def parse_budget(value: str) -> Budget:
+    """'2,30' -> 2 peticiones por segundo con ráfagas de hasta 30"""
+    rate, _, burst = value.partition(",")
+    return Budget(rate=float(rate), burst=float(burst or rate))
+
+# Presupuesto por cliente de cada clase de ruta
+RATE_LIMIT_BUDGETS = {
+    # Guardados y borrados: el autoguardado del editor va muy por debajo
+    "write": parse_budget(os.getenv("RATE_LIMIT_WRITE", "2,30")),
+    # Duplicar, clonar e importar: muchas filas por petición
+    "copy": parse_budget(os.getenv("RATE_LIMIT_COPY", "0.2,5")),
+    # Páginas públicas y snapshots, por IP
+    "public": parse_budget(os.getenv("RATE_LIMIT_PUBLIC", "5,50")),
+}
+
+_ROUTE_CLASSES = [
+    (("POST",), re.compile(r"^/api/portfolios/(import|\d+/duplicate|\d+/clone)/?$"), "copy"),
+    (("POST", "PUT", "PATCH", "DELETE"), re.compile(r"^/api/portfolios(/|$)"), "write"),
+    (("GET", "HEAD"), re.compile(r"^/(portfolio|snapshots)/"), "public"),
+]
+
+# Sin límite de concurrencia: sondas, métricas y streams de larga duración (SSE)
+_ADMISSION_EXEMPT = re.compile(r"^/(health|metrics|stats/)|/events$")
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Clase de la ruta para el limitador (None: sin límite por cliente)"""
+    for methods, pattern, name in _ROUTE_CLASSES:
+        if method in methods and pattern.match(path):
+            return name
+    return None
+
+def client_identity(scope: Scope) -> str:
+    """Clave del cliente para los cubos: el usuario del token de acceso si trae uno
+    válido; si no, su IP (o la del primer salto de X-Forwarded-For)"""
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{decode_access_token(token)['sub']}"
+        except JWTError:
+            pass
+    if RATE_LIMIT_TRUST_FORWARDED and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+class RateLimitBackend:
+    """Almacén de los cubos de tokens.
+
+    El de memoria es por proceso: con varios workers cada uno aplica el
+    presupuesto completo. Para compartirlo basta otra implementación de take()
+    (p. ej. sobre Redis) cargada con RATE_LIMIT_BACKEND.
+    """
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        """Consumir cost tokens: 0 si se admite, si no segundos hasta que los habrá"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Cubos en un OrderedDict (LRU): [tokens, último relleno] por clave"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evictions = 0
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [budget.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(budget.burst, bucket[0] + (now - bucket[1]) * budget.rate)
+            bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / budget.rate
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "evictions": self.evictions}
+
+def load_backend(path: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if not path:
+        return MemoryRateLimitBackend()
+    module_name, _, attribute = path.partition(":")
+    backend = getattr(importlib.import_module(module_name), attribute)
+    return backend() if isinstance(backend, type) else backend
+
+class RateLimiter:
+    """Límite por cliente y clase de ruta con cubos de tokens"""
+
+    def __init__(self, backend: RateLimitBackend, budgets: Dict[str, Budget] = RATE_LIMIT_BUDGETS,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.budgets = budgets
+        self.enabled = enabled
+        self.allowed = {name: 0 for name in budgets}
+        self.limited = {name: 0 for name in budgets}
+
+    async def check(self, scope: Scope) -> Optional[Tuple[str, float]]:
+        """None si la petición pasa; si no (clase de ruta, segundos hasta poder reintentar)"""
+        if not self.enabled:
+            return None
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            return None
+        try:
+            retry_after = await self.backend.take(f"{name}:{client_identity(scope)}", self.budgets[name])
+        except Exception as e:
+            # Un backend caído no debe tumbar la API: se deja pasar
+            logger.warning("Backend de rate limit no disponible: %s", e)
+            return None
+        if retry_after:
+            self.limited[name] += 1
+            return name, retry_after
+        self.allowed[name] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "budgets": {name: {"rate": b.rate, "burst": b.burst} for name, b in self.budgets.items()},
+            "allowed": dict(self.allowed),
+            "limited": dict(self.limited),
+            **self.backend.stats(),
+        }
+
+class AdmissionController:
+    """Límite global de peticiones en curso del proceso.
+
+    El límite baja de max_concurrency a degraded_concurrency mientras la espera
+    reciente de checkout del pool pase de pool_wait_ms: las peticiones que de
+    todas formas esperarían conexión se rechazan al momento con 503 en lugar
+    de encolarse hasta agotar pool_timeout. Las admitidas siguen actualizando
+    la espera, así que el límite vuelve a subir en cuanto el pool se recupera.
+    """
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+                 degraded_concurrency: int = ADMISSION_DEGRADED_CONCURRENCY,
+                 pool_wait_ms: float = ADMISSION_POOL_WAIT_MS,
+                 pool_stats: database.PoolStats = database.async_pool_stats):
+        self.max_concurrency = max_concurrency
+        self.degraded_concurrency = degraded_concurrency
+        self.pool_wait = pool_wait_ms / 1000
+        self.pool_stats = pool_stats
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def exempt(self, path: str) -> bool:
+        return _ADMISSION_EXEMPT.search(path) is not None
+
+    def degraded(self) -> bool:
+        return self.pool_stats.recent_wait > self.pool_wait
+
+    def limit(self) -> int:
+        return self.degraded_concurrency if self.degraded() else self.max_concurrency
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit():
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit(),
+            "degraded": self.degraded(),
+            "pool_wait_recent_ms": round(self.pool_stats.recent_wait * 1000, 3),
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+rate_limiter = RateLimiter(load_backend())
+admission_controller = AdmissionController()
@@ -1,38 +1,124 @@
-from authlib.integrations.starlette_client import OAuth
 from fastapi import HTTPException, Depends
-from sqlalchemy.orm import Session
-from .. import models
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from sqlalchemy import exists, func, or_, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import database, models
+from .cache import user_profile_cache
+from .portfolio import decode_cursor, encode_cursor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
 import os
-from typing import Optional
 
-# Configuración OAuth
-oauth = OAuth()
+logger = logging.getLogger(__name__)
 
-google = oauth.register(
-    name='google',
-    client_id=os.getenv('GOOGLE_CLIENT_ID'),
-    client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-    server_metadata_url='https://accounts.google.com/.well-known/openid_configuration',
-    client_kwargs={
-        'scope': 'openid email profile'
-    }
+# Campos proyectables del listado de usuarios (fields=)
+USER_FIELDS = (
+    'id', 'google_id', 'email', 'name', 'given_name', 'family_name',
+    'picture', 'locale', 'is_active', 'created_at', 'updated_at'
 )
+# Proyección por defecto del directorio (/auth/users): sin email ni google_id,
+# que solo se devuelven si se piden en fields=
+DIRECTORY_FIELDS = tuple(f for f in USER_FIELDS if f not in ('email', 'google_id'))
+
+# Campos de perfil que se sincronizan con Google en cada login
+PROFILE_FIELDS = ('email', 'name', 'given_name', 'family_name', 'picture', 'locale')
+
+# Tokens de acceso: JWT firmado (HS256) y de vida corta; se renuevan con POST /auth/token.
+# Sin valor por defecto: check_secrets impide arrancar sin él
+JWT_SECRET = os.getenv("JWT_SECRET", "")
+JWT_ALGORITHM = "HS256"
+JWT_ISSUER = "devportfolio"
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))
+
+def check_secrets(session_secret: str) -> None:
+    """Negarse a arrancar sin JWT_SECRET y SECRET_KEY, o si comparten valor"""
+    if not JWT_SECRET:
+        raise RuntimeError("Falta JWT_SECRET: configura la clave de firma de los tokens de acceso")
+    if not session_secret:
+        raise RuntimeError("Falta SECRET_KEY: configura la clave de la cookie de sesión")
+    if session_secret == JWT_SECRET:
+        raise RuntimeError("JWT_SECRET y SECRET_KEY deben ser distintos")
+
+def create_access_token(user_id: int, email: str, name: str) -> str:
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": str(user_id),
+        "email": email,
+        "name": name,
+        "iss": JWT_ISSUER,
+        "iat": now,
+        "exp": now + timedelta(seconds=ACCESS_TOKEN_TTL),
+    }
+    return jwt.encode(claims, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_access_token(token: str) -> Dict[str, Any]:
+    """Verificar firma, emisor y caducidad (sin BD). Lanza JWTError si no es válido"""
+    claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], issuer=JWT_ISSUER)
+    if not str(claims.get("sub", "")).isdigit():
+        raise JWTError("sub no válido")
+    return claims
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def require_access_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Dict[str, Any]:
+    """Dependencia: claims de un token de acceso válido (401 si falta o no vale)"""
+    if credentials is None:
+        raise HTTPException(
+            status_code=401, detail="Falta el token de acceso", headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        return decode_access_token(credentials.credentials)
+    except JWTError:
+        raise HTTPException(
+            status_code=401, detail="Token de acceso no válido o caducado",
+            headers={"WWW-Authenticate": 'Bearer error="invalid_token"'}
+        )
+
+def require_same_user(claims: Dict[str, Any], user_id: int) -> None:
+    """403 si el token es de otro usuario"""
+    if int(claims["sub"]) != user_id:
+        raise HTTPException(status_code=403, detail="El token no corresponde a este usuario")
+
+def user_profile(user: models.User) -> Dict[str, Any]:
+    """Perfil del usuario como dict (todas las columnas, como la respuesta de /auth/me)"""
+    return {field: getattr(user, field) for field in USER_FIELDS}
+
+def upsert_user_statement(user_data: dict):
+    """Upsert del usuario en una sola consulta.
+
+    INSERT ... ON CONFLICT (google_id) DO UPDATE solo si algún campo de perfil
+    ha cambiado; si no cambió nada RETURNING no devuelve fila, así que la
+    consulta la completa con un SELECT de la fila existente (UNION ALL).
+    """
+    users = models.User.__table__
+    stmt = insert(users).values(**user_data)
+    changed = or_(*(users.c[field].is_distinct_from(stmt.excluded[field]) for field in PROFILE_FIELDS))
+    upsert = stmt.on_conflict_do_update(
+        index_elements=[users.c.google_id],
+        set_={**{field: stmt.excluded[field] for field in PROFILE_FIELDS}, 'updated_at': func.now()},
+        where=changed
+    ).returning(*users.c).cte('upsert')
+    unchanged = select(users).where(
+        users.c.google_id == user_data['google_id'],
+        ~exists(select(upsert.c.id))
+    )
+    return select(models.User).from_statement(union_all(select(upsert), unchanged))
 
 class AuthService:
     @staticmethod
-    def create_or_update_user(user_info: dict, db: Session) -> models.User:
+    async def create_or_update_user(user_info: dict, db: AsyncSession) -> models.User:
         """Crear o actualizar usuario desde información de Google OAuth"""
         
         # Google puede devolver 'id' o 'sub' como identificador
         google_id = str(user_info.get('id') or user_info.get('sub'))
         
-        print(f"Processing user: {user_info.get('email')} with Google ID: {google_id}")
-        
-        # Buscar usuario existente por Google ID o email
-        existing_user = db.query(models.User).filter(
-            (models.User.google_id == google_id) | 
-            (models.User.email == user_info['email'])
-        ).first()
+        logger.debug("Processing user with Google ID: %s", google_id)
         
         user_data = {
             'google_id': google_id,
@@ -44,33 +130,134 @@ class AuthService:
             'locale': user_info.get('locale', 'es')
         }
         
-        if existing_user:
-            print(f"Updating existing user: {existing_user.email}")
-            # Actualizar usuario existente
-            for key, value in user_data.items():
-                setattr(existing_user, key, value)
-            db.commit()
-            db.refresh(existing_user)
-            return existing_user
-        else:
-            print(f"Creating new user: {user_info['email']}")
-            # Crear nuevo usuario
-            new_user = models.User(**user_data)
-            db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
-            return new_user
+        try:
+            user = (await db.scalars(upsert_user_statement(user_data))).one_or_none()
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            if 'email' not in str(e.orig):
+                raise
+            # El email ya pertenece a otra cuenta con distinto google_id:
+            # se vincula esa cuenta al nuevo google_id (mismo criterio que antes)
+            logger.warning("Linking existing account to Google ID: %s", google_id, extra={"email": user_data['email']})
+            user = (await db.scalars(
+                update(models.User)
+                .where(models.User.email == user_data['email'])
+                .values(**user_data, updated_at=func.now())
+                .returning(models.User)
+            )).one()
+            await db.commit()
+            user_profile_cache.invalidate(user.id)
+            return user
+        
+        if user is None:
+            # Carrera con otro login del mismo usuario que insertó la fila tras
+            # nuestro snapshot: ya existe, basta con leerla
+            user = await AuthService.get_user_by_google_id(google_id, db)
+        user_profile_cache.invalidate(user.id)
+        return user
+    
+    @staticmethod
+    async def get_user_profile(user_id: int) -> Optional[Dict[str, Any]]:
+        """Perfil del usuario desde la caché; en un fallo se lee de una réplica.
+
+        La sesión solo se abre en un fallo: un acierto no toca el pool. Tras
+        un login (recent_writes) la lectura va al primario.
+        """
+        profile = user_profile_cache.get(user_id)
+        if profile is not None:
+            return profile
+        async with database.ReadSessionLocal(read_keys=[("user_id", str(user_id))]) as db:
+            user = await db.get(models.User, user_id)
+        if user is None:
+            return None
+        profile = user_profile(user)
+        user_profile_cache.set(user_id, profile)
+        return profile
     
     @staticmethod
-    def get_user_by_google_id(google_id: str, db: Session) -> Optional[models.User]:
+    async def get_user_by_google_id(google_id: str, db: AsyncSession) -> Optional[models.User]:
         """Obtener usuario por Google ID"""
-        return db.query(models.User).filter(
-            models.User.google_id == google_id
-        ).first()
+        result = await db.scalars(
+            select(models.User).where(models.User.google_id == google_id)
+        )
+        return result.first()
     
     @staticmethod
-    def get_user_by_email(email: str, db: Session) -> Optional[models.User]:
+    async def get_user_by_email(email: str, db: AsyncSession) -> Optional[models.User]:
         """Obtener usuario por email"""
-        return db.query(models.User).filter(
-            models.User.email == email
-        ).first()
\ No newline at end of file
+        result = await db.scalars(
+            select(models.User).where(models.User.email == email)
+        )
+        return result.first()
+    
+    @staticmethod
+    def _user_filters(
+        is_active: Optional[bool],
+        created_from: Optional[datetime],
+        created_to: Optional[datetime],
+        email_prefix: Optional[str]
+    ) -> list:
+        users = models.User.__table__
+        conditions = []
+        if is_active is not None:
+            conditions.append(users.c.is_active == is_active)
+        if created_from is not None:
+            conditions.append(users.c.created_at >= created_from)
+        if created_to is not None:
+            conditions.append(users.c.created_at < created_to)
+        if email_prefix:
+            # lower(email) LIKE 'prefijo%': usa el índice text_pattern_ops
+            conditions.append(func.lower(users.c.email).startswith(email_prefix.lower(), autoescape=True))
+        return conditions
+    
+    @staticmethod
+    async def list_users(
+        db: AsyncSession,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Sequence[str] = USER_FIELDS,
+        is_active: Optional[bool] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        email_prefix: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Página de usuarios (keyset sobre created_at, id), con filtros y proyección"""
+        users = models.User.__table__
+        # id y created_at se leen siempre: forman el cursor
+        selected = ['id', 'created_at'] + [f for f in fields if f not in ('id', 'created_at')]
+        query = select(*(users.c[f] for f in selected)).where(
+            *AuthService._user_filters(is_active, created_from, created_to, email_prefix)
+        )
+        
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            query = query.where(
+                tuple_(users.c.created_at, users.c.id) < tuple_(cursor_created_at, cursor_id)
+            )
+        
+        # Se pide una fila extra para saber si hay página siguiente
+        query = query.order_by(users.c.created_at.desc(), users.c.id.desc()).limit(limit + 1)
+        rows = (await db.execute(query)).mappings().all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        
+        items = [{f: row[f] for f in fields} for row in rows]
+        return items, next_cursor
+    
+    @staticmethod
+    async def count_users(
+        db: AsyncSession,
+        is_active: Optional[bool] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        email_prefix: Optional[str] = None
+    ) -> int:
+        """Total exacto de usuarios con los mismos filtros (consulta aparte de la página)"""
+        query = select(func.count()).select_from(models.User.__table__).where(
+            *AuthService._user_filters(is_active, created_from, created_to, email_prefix)
+        )
+        return await db.scalar(query)
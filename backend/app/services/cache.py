@@ -0,0 +1,174 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Optional
+import hashlib
+import os
+import time
+
+@dataclass(frozen=True)
+class CachedPortfolio:
+    portfolio_id: int
+    body: bytes
+    etag: str
+    expires_at: float
+
+def make_etag(body: bytes) -> str:
+    """ETag fuerte derivado del hash del cuerpo serializado"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comprobar una cabecera If-None-Match contra un ETag (comparación débil, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class PublicPortfolioCache:
+    """Caché LRU con TTL de las respuestas públicas ya serializadas, por slug"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedPortfolio]" = OrderedDict()
+        self._slugs_by_id: Dict[int, str] = {}
+        self._lock = Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, slug: str) -> Optional[CachedPortfolio]:
+        with self._lock:
+            entry = self._entries.get(slug)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(slug)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slug)
+            self.hits += 1
+            return entry
+
+    def set(self, slug: str, portfolio_id: int, body: bytes) -> CachedPortfolio:
+        entry = CachedPortfolio(
+            portfolio_id=portfolio_id,
+            body=body,
+            etag=make_etag(body),
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            self._remove(slug)
+            # Si el portfolio cambió de slug, descartar la entrada antigua
+            old_slug = self._slugs_by_id.get(portfolio_id)
+            if old_slug is not None:
+                self._remove(old_slug)
+            self._entries[slug] = entry
+            self._slugs_by_id[portfolio_id] = slug
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, portfolio_id: Optional[int] = None, slug: Optional[str] = None) -> None:
+        """Descartar la entrada de un portfolio (por id y/o por slug)"""
+        with self._lock:
+            if portfolio_id is not None:
+                cached_slug = self._slugs_by_id.get(portfolio_id)
+                if cached_slug is not None:
+                    self._remove(cached_slug)
+            if slug is not None:
+                self._remove(slug)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._slugs_by_id.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, slug: str) -> None:
+        # Llamar siempre con el lock adquirido
+        entry = self._entries.pop(slug, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry.body)
+        if self._slugs_by_id.get(entry.portfolio_id) == slug:
+            del self._slugs_by_id[entry.portfolio_id]
+
+# Instancia compartida por proceso (cada worker de uvicorn tiene la suya;
+# el TTL acota cuánto puede quedar obsoleta tras una escritura en otro worker)
+public_portfolio_cache = PublicPortfolioCache(
+    max_entries=int(os.getenv("PUBLIC_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("PUBLIC_CACHE_TTL_SECONDS", "60")),
+)
+
+class UserProfileCache:
+    """Caché LRU con TTL de perfiles de usuario (dict listo para serializar), por id.
+
+    AuthService.create_or_update_user invalida la entrada en cada login; el
+    TTL acota lo que puede quedar obsoleta si el cambio llega por otro worker.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (perfil, caduca)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id: int, profile: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[user_id] = (profile, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+user_profile_cache = UserProfileCache(
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "4096")),
+    ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "300")),
+)
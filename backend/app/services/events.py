@@ -0,0 +1,145 @@
+from typing import Any, Dict, Optional, Set
+from .revisions import BLOCK_KEYS, is_editor_content
+import asyncio
+import logging
+import orjson
+import os
+
+logger = logging.getLogger(__name__)
+
+# Marcos en cola por suscriptor: un cliente lento pierde marcos, no frena a nadie
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "16"))
+# Tope de conexiones SSE abiertas por proceso
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "5000"))
+# Comentario periódico: mantiene viva la conexión a través de proxies
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+HEARTBEAT_FRAME = b": ping\n\n"
+
+def sse_frame(event: str, data: Any, event_id: Optional[int] = None) -> bytes:
+    """Un evento SSE ya serializado (orjson no emite saltos de línea)"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: ".encode() + orjson.dumps(data) + b"\n\n"
+
+# Tras perder marcos el cliente no puede aplicar más diffs: debe recargar el portfolio
+RESYNC_FRAME = sse_frame("resync", {})
+
+def content_diff(previous: Any, current: Any) -> Optional[dict]:
+    """Diff por bloques entre dos content del editor (None si alguno no tiene ese formato)"""
+    if not (is_editor_content(previous) and is_editor_content(current)):
+        return None
+    old_properties = previous["blockProperties"]
+    new_properties = current["blockProperties"]
+    diff = {
+        "set": {
+            block_id: properties for block_id, properties in new_properties.items()
+            if block_id not in old_properties or old_properties[block_id] != properties
+        },
+        "removed": [block_id for block_id in old_properties if block_id not in new_properties],
+    }
+    if previous["blocks"] != current["blocks"]:
+        diff["blocks"] = current["blocks"]
+    old_meta = {key: value for key, value in previous.items() if key not in BLOCK_KEYS}
+    new_meta = {key: value for key, value in current.items() if key not in BLOCK_KEYS}
+    if old_meta != new_meta:
+        diff["meta"] = new_meta
+    return diff
+
+class Subscription:
+    """Conexión SSE de una pestaña: cola acotada de marcos ya serializados"""
+
+    __slots__ = ("portfolio_id", "queue", "dropped")
+
+    def __init__(self, portfolio_id: int, size: int):
+        self.portfolio_id = portfolio_id
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+        self.dropped = 0
+
+    def offer(self, frame: bytes) -> bool:
+        """Encolar sin esperar; si la cola está llena se vacía y se pide resync"""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_FRAME)
+            return False
+
+class PortfolioEventHub:
+    """Pub/sub en proceso de los cambios de cada portfolio (previsualización en vivo).
+
+    Cada cambio se serializa una vez y se reparte con put_nowait a las colas
+    de los suscriptores: publicar nunca espera a un cliente. Las pestañas
+    conectadas a otro proceso no reciben los cambios hechos en este.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._count = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def has_subscribers(self, portfolio_id: int) -> bool:
+        return portfolio_id in self._subscribers
+
+    def subscribe(self, portfolio_id: int) -> Optional[Subscription]:
+        """Nueva suscripción, o None si se alcanzó el tope de conexiones"""
+        if self._count >= self.max_subscribers:
+            return None
+        subscription = Subscription(portfolio_id, self.queue_size)
+        self._subscribers.setdefault(portfolio_id, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.portfolio_id)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.portfolio_id]
+        self._count -= 1
+        self.dropped += subscription.dropped
+
+    def publish(self, portfolio_id: int, frame: bytes) -> int:
+        """Repartir un marco; devuelve a cuántos suscriptores llegó sin pérdidas"""
+        subscribers = self._subscribers.get(portfolio_id)
+        if not subscribers:
+            return 0
+        self.published += 1
+        delivered = sum(subscription.offer(frame) for subscription in subscribers)
+        self.delivered += delivered
+        return delivered
+
+    def publish_update(self, portfolio_id: int, version: int, name: str, previous: Any, current: Any) -> None:
+        """Publicar un guardado: diff por bloques si es posible, si no el content entero"""
+        if not self.has_subscribers(portfolio_id):
+            return
+        diff = content_diff(previous, current)
+        if diff is None:
+            frame = sse_frame("content", {"version": version, "name": name, "content": current}, version)
+        else:
+            # base_version: el cliente solo aplica el diff sobre esa versión; si no, recarga
+            frame = sse_frame("patch", {"version": version, "base_version": version - 1, "name": name, **diff}, version)
+        self.publish(portfolio_id, frame)
+
+    def publish_deleted(self, portfolio_id: int) -> None:
+        self.publish(portfolio_id, sse_frame("deleted", {"id": portfolio_id}))
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self._count,
+            "portfolios": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped + sum(
+                subscription.dropped for subscribers in self._subscribers.values() for subscription in subscribers
+            ),
+        }
+
+portfolio_events = PortfolioEventHub()
@@ -0,0 +1,230 @@
+from jose import jwt, JWTError
+from typing import Any, Dict, Optional
+import asyncio
+import httpx
+import logging
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/callback")
+# Apuntando esto al stub local (app.google_stub) se puede probar el login sin red
+GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
+
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "10"))
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT", "3"))
+GOOGLE_HTTP_RETRIES = int(os.getenv("GOOGLE_HTTP_RETRIES", "2"))
+GOOGLE_HTTP_BACKOFF = float(os.getenv("GOOGLE_HTTP_BACKOFF", "0.2"))
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "20"))
+GOOGLE_DISCOVERY_TTL = int(os.getenv("GOOGLE_DISCOVERY_TTL", "86400"))
+# Si Google no envía Cache-Control en el JWKS
+GOOGLE_JWKS_TTL = int(os.getenv("GOOGLE_JWKS_TTL", "3600"))
+# Intervalo mínimo entre recargas forzadas del JWKS por un kid desconocido
+GOOGLE_JWKS_MIN_REFRESH = int(os.getenv("GOOGLE_JWKS_MIN_REFRESH", "60"))
+
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
+_RETRY_STATUS = {500, 502, 503, 504}
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+class GoogleOAuthError(Exception):
+    """Respuesta inesperada de los endpoints de Google"""
+
+class _TTLCache:
+    def __init__(self):
+        self.value: Optional[dict] = None
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def fresh(self) -> bool:
+        return self.value is not None and time.monotonic() < self.expires_at
+
+    def store(self, value: dict, ttl: int) -> None:
+        now = time.monotonic()
+        self.value = value
+        self.fetched_at = now
+        self.expires_at = now + ttl
+
+def _max_age(response: httpx.Response, default: int) -> int:
+    match = _MAX_AGE.search(response.headers.get("cache-control", ""))
+    return int(match.group(1)) if match else default
+
+class GoogleClient:
+    """Cliente HTTP de Google OAuth compartido durante la vida de la aplicación.
+
+    Mantiene un pool de conexiones keep-alive (HTTP/2), cachea el documento de
+    descubrimiento y el JWKS y verifica el id_token localmente.
+    """
+
+    def __init__(self, discovery_url: str = GOOGLE_DISCOVERY_URL):
+        self.discovery_url = discovery_url
+        self._client: Optional[httpx.AsyncClient] = None
+        self._discovery = _TTLCache()
+        self._jwks = _TTLCache()
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(GOOGLE_HTTP_TIMEOUT, connect=GOOGLE_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=60
+            ),
+            # Reintentos de conexión (la petición aún no ha salido)
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=GOOGLE_HTTP_RETRIES)
+        )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("GoogleClient no iniciado (se abre en el lifespan de la app)")
+        return self._client
+
+    async def request(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """Petición con reintentos y backoff exponencial.
+
+        Las peticiones no idempotentes (intercambio del código, que es de un
+        solo uso) solo se reintentan si no llegaron a conectar.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if not idempotent or response.status_code not in _RETRY_STATUS or attempt >= GOOGLE_HTTP_RETRIES:
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= GOOGLE_HTTP_RETRIES:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= GOOGLE_HTTP_RETRIES:
+                    raise
+            delay = GOOGLE_HTTP_BACKOFF * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+    async def _get_json(self, url: str) -> httpx.Response:
+        response = await self.request("GET", url)
+        if response.status_code != 200:
+            raise GoogleOAuthError(f"GET {url} devolvió {response.status_code}")
+        return response
+
+    async def metadata(self) -> dict:
+        """Documento de descubrimiento OpenID (cacheado)"""
+        if self._discovery.fresh():
+            return self._discovery.value
+        async with self._discovery.lock:
+            if not self._discovery.fresh():
+                response = await self._get_json(self.discovery_url)
+                self._discovery.store(response.json(), _max_age(response, GOOGLE_DISCOVERY_TTL))
+        return self._discovery.value
+
+    async def jwks(self, force: bool = False) -> dict:
+        """Claves públicas de Google (cacheadas según su Cache-Control)"""
+        if self._jwks.fresh() and not force:
+            return self._jwks.value
+        async with self._jwks.lock:
+            recently = time.monotonic() - self._jwks.fetched_at < GOOGLE_JWKS_MIN_REFRESH
+            if not self._jwks.fresh() or (force and not recently):
+                jwks_uri = (await self.metadata())["jwks_uri"]
+                response = await self._get_json(jwks_uri)
+                self._jwks.store(response.json(), _max_age(response, GOOGLE_JWKS_TTL))
+        return self._jwks.value
+
+    async def _signing_key(self, kid: Optional[str]) -> Optional[dict]:
+        for force in (False, True):
+            # Un kid desconocido suele indicar rotación de claves: recargar una vez
+            keys = (await self.jwks(force=force)).get("keys", [])
+            for key in keys:
+                if key.get("kid") == kid:
+                    return key
+        return None
+
+    async def authorization_url(self, params: Dict[str, str]) -> str:
+        endpoint = (await self.metadata())["authorization_endpoint"]
+        return f"{endpoint}?{httpx.QueryParams(params)}"
+
+    async def exchange_code(self, code: str) -> dict:
+        """Intercambiar el código de autorización por los tokens"""
+        token_endpoint = (await self.metadata())["token_endpoint"]
+        response = await self.request(
+            "POST",
+            token_endpoint,
+            idempotent=False,
+            data={
+                "client_id": GOOGLE_CLIENT_ID,
+                "client_secret": GOOGLE_CLIENT_SECRET,
+                "code": code,
+                "grant_type": "authorization_code",
+                "redirect_uri": GOOGLE_REDIRECT_URI
+            }
+        )
+        if response.status_code != 200:
+            logger.warning("Token error: %s %s", response.status_code, response.text)
+            raise GoogleOAuthError("Failed to get access token")
+        return response.json()
+
+    async def verify_id_token(self, id_token: str, access_token: Optional[str] = None) -> Dict[str, Any]:
+        """Verificar firma, audiencia, emisor y caducidad del id_token"""
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except JWTError as e:
+            raise GoogleOAuthError(f"id_token mal formado: {e}")
+        key = await self._signing_key(header.get("kid"))
+        if key is None:
+            raise GoogleOAuthError("id_token firmado con una clave desconocida")
+        metadata = await self.metadata()
+        issuers = tuple({metadata.get("issuer", GOOGLE_ISSUERS[0]), *GOOGLE_ISSUERS})
+        try:
+            return jwt.decode(
+                id_token,
+                key,
+                algorithms=[key.get("alg", "RS256")],
+                audience=GOOGLE_CLIENT_ID,
+                issuer=issuers,
+                access_token=access_token  # comprueba at_hash si viene en el token
+            )
+        except JWTError as e:
+            raise GoogleOAuthError(f"id_token no válido: {e}")
+
+    async def fetch_userinfo(self, access_token: str) -> dict:
+        userinfo_endpoint = (await self.metadata())["userinfo_endpoint"]
+        response = await self.request(
+            "GET",
+            userinfo_endpoint,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        if response.status_code != 200:
+            logger.warning("User info error: %s %s", response.status_code, response.text)
+            raise GoogleOAuthError("Failed to get user info")
+        return response.json()
+
+    async def user_info(self, tokens: dict) -> dict:
+        """Datos del usuario a partir de los tokens.
+
+        Con un id_token válido que trae email y nombre no hace falta llamar a
+        userinfo; si falta algo se recurre al endpoint.
+        """
+        access_token = tokens.get("access_token")
+        id_token = tokens.get("id_token")
+        if id_token:
+            claims = await self.verify_id_token(id_token, access_token)
+            if claims.get("email") and claims.get("name"):
+                return claims
+        if not access_token:
+            raise GoogleOAuthError("No access token received")
+        return await self.fetch_userinfo(access_token)
+
+google_client = GoogleClient()
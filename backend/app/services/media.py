@@ -0,0 +1,159 @@
+from typing import Any, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "media"))
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "http://localhost:8000/media").rstrip("/")
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# data:[<mediatype>][;param=valor]*;base64,<datos>
+_DATA_URI = re.compile(r"^data:([\w.+-]+/[\w.+-]+)?((?:;[\w.+-]+=[^;,]*)*);base64,", re.IGNORECASE)
+MEDIA_FILENAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+# Solo imágenes rasterizadas: nada que un navegador ejecute (HTML, SVG, JS...)
+MEDIA_ALLOWED_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+
+class UnsupportedMediaType(ValueError):
+    """Tipo de fichero fuera de MEDIA_ALLOWED_TYPES o contenido que no corresponde"""
+
+def extension_for(content_type: Optional[str]) -> str:
+    """Extensión de fichero para un tipo MIME ('.bin' si es desconocido)"""
+    if content_type in MEDIA_ALLOWED_TYPES:
+        return MEDIA_ALLOWED_TYPES[content_type]
+    return (content_type and mimetypes.guess_extension(content_type)) or ".bin"
+
+def media_type_for(filename: str) -> str:
+    """Tipo MIME con el que se sirve un fichero del almacén, según su extensión"""
+    extension = os.path.splitext(filename)[1]
+    for content_type, allowed_extension in MEDIA_ALLOWED_TYPES.items():
+        if extension == allowed_extension:
+            return content_type
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+def sniff_image_type(data: bytes) -> Optional[str]:
+    """Tipo de imagen según la firma de los primeros bytes (None si no es una admitida)"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return None
+
+def check_media_type(data: bytes, content_type: Optional[str]) -> str:
+    """Tipo normalizado si está admitido y coincide con el contenido; si no, UnsupportedMediaType"""
+    content_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if content_type not in MEDIA_ALLOWED_TYPES:
+        raise UnsupportedMediaType(f"Tipo de fichero no admitido: {content_type or 'desconocido'}")
+    if sniff_image_type(data) != content_type:
+        raise UnsupportedMediaType(f"El contenido no es una imagen {content_type}")
+    return content_type
+
+def data_uri_type(value: str) -> Optional[str]:
+    """Tipo MIME de un data: URI en base64 (None si value no lo es)"""
+    match = _DATA_URI.match(value)
+    if not match:
+        return None
+    return (match.group(1) or "application/octet-stream").lower()
+
+class MediaStore:
+    """Almacén de ficheros en disco direccionado por contenido (SHA-256)"""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url
+
+    def path_for(self, filename: str) -> str:
+        # Dos niveles de directorio para no acumular miles de ficheros en uno solo
+        return os.path.join(self.root, filename[:2], filename[2:4], filename)
+
+    def url_for(self, filename: str) -> str:
+        return f"{self.base_url}/{filename}"
+
+    def store(self, data: bytes, content_type: Optional[str]) -> str:
+        """Guardar un binario y devolver su nombre (<sha256><ext>); deduplica por contenido.
+
+        Lanza UnsupportedMediaType si no es una imagen de MEDIA_ALLOWED_TYPES.
+        """
+        content_type = check_media_type(data, content_type)
+        filename = hashlib.sha256(data).hexdigest() + extension_for(content_type)
+        path = self.path_for(filename)
+        if os.path.exists(path):
+            return filename
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escritura atómica: un lector nunca ve un fichero a medias
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return filename
+
+    def store_data_uri(self, value: str) -> Optional[str]:
+        """Guardar un data: URI en base64 y devolver la URL del fichero.
+
+        None si no es un data: URI o no es una imagen admitida: se queda en línea,
+        donde el editor solo lo usa como src de <img>.
+        """
+        match = _DATA_URI.match(value)
+        if not match:
+            return None
+        try:
+            data = base64.b64decode(value[match.end():], validate=False)
+        except (binascii.Error, ValueError):
+            return None
+        try:
+            return self.url_for(self.store(data, data_uri_type(value)))
+        except UnsupportedMediaType:
+            return None
+
+    def extract_inline_media(self, content: Any) -> Tuple[Any, int]:
+        """Sustituir los data: URI de content por referencias al almacén.
+
+        Devuelve el documento (nuevo solo si ha cambiado algo) y el número de
+        URIs extraídos.
+        """
+        if isinstance(content, str):
+            if content.startswith("data:"):
+                url = self.store_data_uri(content)
+                if url is not None:
+                    return url, 1
+            return content, 0
+        if isinstance(content, dict):
+            extracted = 0
+            result = {}
+            for key, value in content.items():
+                result[key], count = self.extract_inline_media(value)
+                extracted += count
+            return (result, extracted) if extracted else (content, 0)
+        if isinstance(content, list):
+            extracted = 0
+            result = []
+            for value in content:
+                new_value, count = self.extract_inline_media(value)
+                result.append(new_value)
+                extracted += count
+            return (result, extracted) if extracted else (content, 0)
+        return content, 0
+
+media_store = MediaStore(MEDIA_ROOT, MEDIA_BASE_URL)
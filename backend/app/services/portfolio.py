@@ -1,51 +1,355 @@
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from typing import List, Optional
+from sqlalchemy import Integer, String, column, insert, or_, select, tuple_, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from .. import database, models
+from .media import media_store
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+import base64
+import json
+import orjson
+import re
+
+_SLUG_INVALID_CHARS = re.compile(r"[^a-z0-9\s-]")
+_SLUG_WHITESPACE = re.compile(r"\s+")
+_SLUG_HYPHENS = re.compile(r"-+")
+
+def slugify(name: str) -> str:
+    """Normalizar un nombre a slug (misma regla que generatePortfolioSlug en el frontend)"""
+    slug = _SLUG_INVALID_CHARS.sub("", name.lower())
+    slug = _SLUG_WHITESPACE.sub("-", slug)
+    slug = _SLUG_HYPHENS.sub("-", slug).strip("-")
+    return slug or "portfolio"
+
+def pick_free_slug(base: str, taken: Iterable[str]) -> str:
+    """Elegir el primer slug libre: base, base-2, base-3..."""
+    taken = set(taken)
+    if base not in taken:
+        return base
+    counter = 2
+    while f"{base}-{counter}" in taken:
+        counter += 1
+    return f"{base}-{counter}"
+
+def block_type(block_id: str) -> str:
+    """Tipo de un bloque a partir de su id del editor ('projects-0-1712345678' -> 'projects')"""
+    return block_id.split("-", 1)[0]
+
+def with_block_types(content: Any) -> Any:
+    """Añadir a content la clave derivada blockTypes (indexada por el GIN de content)"""
+    if not isinstance(content, dict):
+        return content
+    blocks = content.get("blocks")
+    types = sorted({block_type(b) for b in blocks if isinstance(b, str)}) if isinstance(blocks, list) else []
+    if content.get("blockTypes") == types:
+        return content
+    return {**content, "blockTypes": types}
+
+def prepare_content(content: Any) -> Any:
+    """Normalizar content antes de escribirlo: media fuera de línea y blockTypes"""
+    if content is None:
+        return None
+    content, _ = media_store.extract_inline_media(content)
+    return with_block_types(content)
+
+def serialize_portfolio(portfolio: models.Portfolio) -> dict:
+    """Portfolio como dict listo para orjson, sin revalidar content (ya viene de la BD)"""
+    return {
+        "id": portfolio.id,
+        "name": portfolio.name,
+        "slug": portfolio.slug,
+        "content": portfolio.content,
+        "version": portfolio.version,
+        "user_id": portfolio.user_id,
+        "created_at": portfolio.created_at,
+        "updated_at": portfolio.updated_at,
+    }
+
+# Campos proyectables del listado resumido (ninguno carga content completo)
+SUMMARY_FIELDS = ("id", "name", "slug", "created_at", "updated_at", "block_count")
+
+def pick_free_name(base: str, taken: Iterable[str]) -> str:
+    """Elegir el primer nombre libre: base, base (2), base (3)..."""
+    taken = set(taken)
+    if base not in taken:
+        return base
+    counter = 2
+    while f"{base} ({counter})" in taken:
+        counter += 1
+    return f"{base} ({counter})"
+
+# Columnas del volcado NDJSON (export/import)
+EXPORT_FIELDS = ("id", "user_id", "name", "slug", "content", "version", "created_at", "updated_at")
+
+def encode_cursor(updated_at: datetime, portfolio_id: int) -> str:
+    """Cursor opaco para la paginación keyset sobre (updated_at, id)"""
+    raw = json.dumps([updated_at.isoformat(), portfolio_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decodificar un cursor; lanza ValueError si no es válido"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, portfolio_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(updated_at), int(portfolio_id)
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
 
 class PortfolioService:
     @staticmethod
-    def get_user_portfolios(user_id: int, db: Session) -> List[models.Portfolio]:
+    async def generate_unique_slug(name: str, db: AsyncSession) -> str:
+        """Generar un slug único para un portfolio con una sola consulta.
+
+        El LIKE por prefijo lo sirve ix_portfolios_slug_pattern (text_pattern_ops).
+        """
+        base = slugify(name)
+        result = await db.scalars(
+            select(models.Portfolio.slug).where(
+                (models.Portfolio.slug == base) | models.Portfolio.slug.like(f"{base}-%")
+            )
+        )
+        return pick_free_slug(base, result.all())
+
+    @staticmethod
+    async def get_portfolio(portfolio_id: int, db: AsyncSession, for_update: bool = False) -> Optional[models.Portfolio]:
+        """Obtener un portfolio por ID (opcionalmente bloqueando la fila)"""
+        query = select(models.Portfolio).where(models.Portfolio.id == portfolio_id)
+        if for_update:
+            query = query.with_for_update()
+        result = await db.scalars(query)
+        return result.first()
+
+    @staticmethod
+    async def get_by_slug(slug: str, db: AsyncSession) -> Optional[models.Portfolio]:
+        """Obtener un portfolio por su slug exacto (una búsqueda en el índice único)"""
+        result = await db.scalars(
+            select(models.Portfolio).where(models.Portfolio.slug == slugify(slug))
+        )
+        return result.first()
+
+    @staticmethod
+    async def search_by_name(query: str, db: AsyncSession, limit: int = 20) -> List[models.Portfolio]:
+        """Búsqueda aproximada por nombre, servida por el índice trigram"""
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        result = await db.scalars(
+            select(models.Portfolio).where(
+                models.Portfolio.name.ilike(f"%{pattern}%")
+            ).order_by(
+                func.similarity(models.Portfolio.name, query).desc(),
+                models.Portfolio.id
+            ).limit(limit)
+        )
+        return result.all()
+
+    @staticmethod
+    async def find_by_block_type(
+        block_type: str,
+        db: AsyncSession,
+        user_id: Optional[int] = None,
+        limit: int = 50
+    ) -> List[models.Portfolio]:
+        """Portfolios que contienen un tipo de bloque (content @> ..., servido por el índice GIN)"""
+        query = select(models.Portfolio).where(
+            models.Portfolio.content.contains({"blockTypes": [block_type]})
+        )
+        if user_id is not None:
+            query = query.where(models.Portfolio.user_id == user_id)
+        result = await db.scalars(query.order_by(models.Portfolio.id).limit(limit))
+        return result.all()
+
+    @staticmethod
+    async def get_block_properties(portfolio_id: int, block_id: str, db: AsyncSession) -> Tuple[bool, Any]:
+        """Propiedades de un solo bloque, extraídas en Postgres sin devolver el documento.
+
+        Devuelve (existe_portfolio, propiedades).
+        """
+        row = (await db.execute(
+            select(
+                models.Portfolio.id,
+                models.Portfolio.content["blockProperties"][block_id]
+            ).where(models.Portfolio.id == portfolio_id)
+        )).first()
+        if row is None:
+            return False, None
+        return True, row[1]
+
+    @staticmethod
+    async def get_user_portfolios(user_id: int, db: AsyncSession) -> List[models.Portfolio]:
         """Obtener todos los portfolios de un usuario"""
-        return db.query(models.Portfolio).filter(
+        result = await db.scalars(
+            select(models.Portfolio).where(
+                models.Portfolio.user_id == user_id
+            ).order_by(models.Portfolio.updated_at.desc())
+        )
+        return result.all()
+    
+    @staticmethod
+    async def list_user_summaries(
+        user_id: int,
+        db: AsyncSession,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        fields: Sequence[str] = SUMMARY_FIELDS
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Página de resúmenes de portfolios de un usuario, sin transferir content"""
+        columns = {
+            "id": models.Portfolio.id,
+            "updated_at": models.Portfolio.updated_at,
+            "name": models.Portfolio.name,
+            "slug": models.Portfolio.slug,
+            "created_at": models.Portfolio.created_at,
+            "block_count": func.coalesce(
+                func.jsonb_array_length(models.Portfolio.content["blocks"]), 0
+            ),
+        }
+        # id y updated_at se leen siempre: forman el cursor
+        selected = ["id", "updated_at"] + [f for f in fields if f not in ("id", "updated_at")]
+        query = select(*(columns[f].label(f) for f in selected)).where(
             models.Portfolio.user_id == user_id
-        ).order_by(models.Portfolio.updated_at.desc()).all()
+        )
+        
+        if cursor:
+            cursor_updated_at, cursor_id = decode_cursor(cursor)
+            query = query.where(
+                tuple_(models.Portfolio.updated_at, models.Portfolio.id)
+                < tuple_(cursor_updated_at, cursor_id)
+            )
+        
+        # Se pide una fila extra para saber si hay página siguiente
+        query = query.order_by(
+            models.Portfolio.updated_at.desc(), models.Portfolio.id.desc()
+        ).limit(limit + 1)
+        rows = (await db.execute(query)).mappings().all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+        
+        items = [{f: row[f] for f in fields} for row in rows]
+        return items, next_cursor
     
     @staticmethod
-    def create_portfolio(portfolio_data: schemas.PortfolioCreate, db: Session) -> models.Portfolio:
-        """Crear un nuevo portfolio"""
-        db_portfolio = models.Portfolio(**portfolio_data.dict())
-        db.add(db_portfolio)
-        db.commit()
-        db.refresh(db_portfolio)
-        return db_portfolio
+    async def stream_export(user_id: Optional[int] = None, batch_size: int = 500) -> AsyncIterator[bytes]:
+        """Volcado NDJSON de portfolios, un trozo por lote del cursor de servidor.
+
+        Abre su propia sesión: la respuesta en streaming sobrevive a la
+        dependencia get_db. Con yield_per la memoria no crece con el total.
+        """
+        table = models.Portfolio.__table__
+        query = (
+            select(*(table.c[field] for field in EXPORT_FIELDS))
+            .order_by(table.c.id)
+            .execution_options(yield_per=batch_size)
+        )
+        if user_id is not None:
+            query = query.where(table.c.user_id == user_id)
+        async with database.AsyncSessionLocal() as db:
+            result = await db.stream(query)
+            async for partition in result.mappings().partitions():
+                yield b"".join(
+                    orjson.dumps(dict(row), option=orjson.OPT_APPEND_NEWLINE) for row in partition
+                )
     
     @staticmethod
-    def update_portfolio(portfolio_id: int, update_data: dict, db: Session) -> Optional[models.Portfolio]:
-        """Actualizar un portfolio existente"""
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
-        
-        if not portfolio:
+    async def import_batch(items: List[Dict[str, Any]], db: AsyncSession) -> int:
+        """Insertar un lote de portfolios importados con un único INSERT (executemany).
+
+        Se conserva el slug del volcado si está libre; si no, se le busca uno.
+        Dos consultas por lote, haya las colisiones que haya. No hace commit:
+        el import completo va en una transacción.
+        """
+        bases = [slugify(item.get("slug") or item["name"]) for item in items]
+        taken = set((await db.scalars(
+            select(models.Portfolio.slug).where(models.Portfolio.slug.in_(set(bases)))
+        )).all())
+        # Colisiones con la BD o dentro del lote: sus variantes base-N ya usadas, en una consulta
+        colliding = taken | {base for base, count in Counter(bases).items() if count > 1}
+        if colliding:
+            taken.update((await db.scalars(
+                select(models.Portfolio.slug).where(or_(*(
+                    models.Portfolio.slug.like(f"{base}-%") for base in colliding
+                )))
+            )).all())
+        rows = []
+        for item, base in zip(items, bases):
+            slug = pick_free_slug(base, taken) if base in taken else base
+            taken.add(slug)
+            rows.append({
+                "user_id": item["user_id"],
+                "name": item["name"],
+                "slug": slug,
+                "content": item["content"],
+                "created_at": item.get("created_at") or datetime.now(timezone.utc),
+            })
+        await db.execute(insert(models.Portfolio.__table__), rows)
+        return len(rows)
+    
+    @staticmethod
+    async def clone_portfolio(source_id: int, user_ids: Sequence[int], db: AsyncSession) -> Optional[List[models.Portfolio]]:
+        """Clonar un portfolio para uno o varios usuarios sin pasar content por Python.
+
+        Número de consultas fijo, haya las colisiones que haya: datos del
+        origen, nombres ocupados, slugs ocupados y un INSERT ... SELECT que
+        copia content en la propia base de datos. Devuelve None si el origen
+        no existe. No hace commit.
+        """
+        source = (await db.execute(
+            select(models.Portfolio.name, models.Portfolio.user_id).where(models.Portfolio.id == source_id)
+        )).first()
+        if source is None:
             return None
         
-        for key, value in update_data.items():
-            setattr(portfolio, key, value)
+        # En la misma cuenta es una copia; en otra se conserva el nombre si está libre
+        name_bases = {
+            user_id: f"{source.name} - Copia" if user_id == source.user_id else source.name
+            for user_id in user_ids
+        }
+        # LIKE puede traer de más si el nombre tiene comodines: pick_free_name compara exacto
+        taken_names = {}
+        for user_id, name in (await db.execute(
+            select(models.Portfolio.user_id, models.Portfolio.name).where(
+                models.Portfolio.user_id.in_(set(user_ids)),
+                or_(*(
+                    (models.Portfolio.name == base) | models.Portfolio.name.like(f"{base} (%)")
+                    for base in set(name_bases.values())
+                ))
+            )
+        )).all():
+            taken_names.setdefault(user_id, set()).add(name)
         
-        db.commit()
-        db.refresh(portfolio)
-        return portfolio
-    
-    @staticmethod
-    def delete_portfolio(portfolio_id: int, db: Session) -> bool:
-        """Eliminar un portfolio"""
-        portfolio = db.query(models.Portfolio).filter(
-            models.Portfolio.id == portfolio_id
-        ).first()
+        names = []
+        for user_id in user_ids:
+            name = pick_free_name(name_bases[user_id], taken_names.setdefault(user_id, set()))
+            taken_names[user_id].add(name)
+            names.append(name)
         
-        if not portfolio:
-            return False
+        slug_bases = {slugify(name) for name in names}
+        taken_slugs = set((await db.scalars(
+            select(models.Portfolio.slug).where(or_(*(
+                (models.Portfolio.slug == base) | models.Portfolio.slug.like(f"{base}-%")
+                for base in slug_bases
+            )))
+        )).all())
+        targets = []
+        for user_id, name in zip(user_ids, names):
+            slug = pick_free_slug(slugify(name), taken_slugs)
+            taken_slugs.add(slug)
+            targets.append((user_id, name, slug))
         
-        db.delete(portfolio)
-        db.commit()
-        return True
\ No newline at end of file
+        target_rows = values(
+            column("user_id", Integer), column("name", String), column("slug", String),
+            name="targets"
+        ).data(targets)
+        result = await db.scalars(
+            insert(models.Portfolio)
+            .from_select(
+                ["user_id", "name", "slug", "content"],
+                select(
+                    target_rows.c.user_id, target_rows.c.name, target_rows.c.slug, models.Portfolio.content
+                ).select_from(target_rows).join(models.Portfolio, models.Portfolio.id == source_id)
+            )
+            .returning(models.Portfolio)
+        )
+        return result.all()
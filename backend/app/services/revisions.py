@@ -0,0 +1,434 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Boolean, Integer, String, and_, column, delete, exists, insert, literal, select, true, values
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .. import database, models
+from .portfolio import decode_cursor, encode_cursor, with_block_types
+import asyncio
+import hashlib
+import logging
+import orjson
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Retención: las últimas N revisiones de cada portfolio y, además, la última
+# de cada día durante REVISION_KEEP_DAYS días
+REVISION_KEEP_LAST = int(os.getenv("REVISION_KEEP_LAST", "50"))
+REVISION_KEEP_DAYS = int(os.getenv("REVISION_KEEP_DAYS", "30"))
+# Cada cuántos segundos aplica la retención la propia API (0 la desactiva)
+REVISION_PRUNE_INTERVAL = float(os.getenv("REVISION_PRUNE_INTERVAL", "3600"))
+# Con N workers, solo poda en cada ronda el que consigue este advisory lock
+REVISION_PRUNE_LOCK_KEY = 727003
+
+# Guardar revisiones toma este advisory lock en modo compartido y la recolección
+# de blobs huérfanos en exclusivo: un blob que una revisión en curso da por
+# existente no puede desaparecer antes de que la revisión lo referencie
+REVISION_GC_LOCK_KEY = 727002
+
+# Claves de content que se guardan bloque a bloque (blockTypes se deriva de blocks)
+BLOCK_KEYS = ("blocks", "blockProperties", "blockTypes")
+
+def canonical_json(value: Any) -> bytes:
+    """JSON canónico (claves ordenadas): mismo valor, mismos bytes, mismo hash"""
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+@dataclass(frozen=True)
+class RevisionSnapshot:
+    meta_hash: Optional[str]
+    content_hash: Optional[str]
+    block_count: Optional[int]
+    # (block_id, hash, in_layout) en orden; hash None si el bloque no tiene propiedades
+    blocks: List[Tuple[str, Optional[str], bool]] = field(default_factory=list)
+    # hash -> (valor, tamaño del JSON canónico)
+    blobs: Dict[str, Tuple[Any, int]] = field(default_factory=dict)
+
+def is_editor_content(content: Any) -> bool:
+    return (
+        isinstance(content, dict)
+        and isinstance(content.get("blocks"), list)
+        and all(isinstance(block_id, str) for block_id in content["blocks"])
+        and isinstance(content.get("blockProperties"), dict)
+    )
+
+def split_content(content: Any) -> RevisionSnapshot:
+    """Partir content en blobs direccionados por contenido (CPU: llamar en el threadpool).
+
+    Las propiedades de cada bloque son un blob y el resto de claves otro; la
+    revisión es la lista ordenada de hashes. Un content sin el formato del
+    editor se guarda entero como un único blob.
+    """
+    if content is None:
+        return RevisionSnapshot(meta_hash=None, content_hash=None, block_count=None)
+
+    blobs: Dict[str, Tuple[Any, int]] = {}
+
+    def store(value: Any) -> str:
+        data = canonical_json(value)
+        digest = hashlib.sha256(data).hexdigest()
+        blobs.setdefault(digest, (value, len(data)))
+        return digest
+
+    if not is_editor_content(content):
+        meta_hash = store(content)
+        return RevisionSnapshot(meta_hash=meta_hash, content_hash=meta_hash, block_count=None, blobs=blobs)
+
+    layout = content["blocks"]
+    properties = content["blockProperties"]
+    meta_hash = store({key: value for key, value in content.items() if key not in BLOCK_KEYS})
+    blocks = [
+        (block_id, store(properties[block_id]) if block_id in properties else None, True)
+        for block_id in layout
+    ]
+    # Propiedades de ids que ya no están en blocks: se conservan tal cual
+    in_layout = set(layout)
+    blocks.extend(
+        (block_id, store(value), False)
+        for block_id, value in properties.items() if block_id not in in_layout
+    )
+    content_hash = hashlib.sha256(canonical_json([meta_hash, blocks])).hexdigest()
+    return RevisionSnapshot(
+        meta_hash=meta_hash,
+        content_hash=content_hash,
+        block_count=len(layout),
+        blocks=blocks,
+        blobs=blobs
+    )
+
+def join_content(meta: Any, block_count: Optional[int], blocks: Sequence[Tuple[str, Optional[str], Any, bool]]) -> Any:
+    """Reconstruir content a partir del blob de meta y los bloques (block_id, hash, datos, in_layout)"""
+    if block_count is None:
+        return meta
+    content = dict(meta or {})
+    content["blocks"] = [block_id for block_id, _, _, in_layout in blocks if in_layout]
+    content["blockProperties"] = {
+        block_id: data for block_id, digest, data, _ in blocks if digest is not None
+    }
+    return with_block_types(content)
+
+def storage_stats_statement():
+    """Una fila: revisiones, blobs, bytes lógicos (sin deduplicar) y bytes almacenados"""
+    revisions = models.PortfolioRevision
+    blobs = models.BlockBlob
+    meta_bytes = (
+        select(func.coalesce(func.sum(blobs.size), 0))
+        .select_from(revisions).join(blobs, blobs.hash == revisions.meta_hash)
+        .scalar_subquery()
+    )
+    block_bytes = (
+        select(func.coalesce(func.sum(blobs.size), 0))
+        .select_from(models.RevisionBlock).join(blobs, blobs.hash == models.RevisionBlock.hash)
+        .scalar_subquery()
+    )
+    return select(
+        select(func.count()).select_from(revisions).scalar_subquery().label("revisions"),
+        select(func.count()).select_from(blobs).scalar_subquery().label("blobs"),
+        (meta_bytes + block_bytes).label("logical_bytes"),
+        select(func.coalesce(func.sum(blobs.size), 0)).scalar_subquery().label("stored_bytes"),
+    )
+
+def storage_stats(row) -> dict:
+    logical = int(row.logical_bytes)
+    stored = int(row.stored_bytes)
+    return {
+        "revisions": row.revisions,
+        "blobs": row.blobs,
+        "logical_bytes": logical,
+        "stored_bytes": stored,
+        "saved_bytes": logical - stored,
+        "dedup_ratio": round(logical / stored, 2) if stored else None,
+    }
+
+def prune_revisions(connection, keep_last: int = REVISION_KEEP_LAST, keep_days: int = REVISION_KEEP_DAYS) -> dict:
+    """Aplicar la retención y borrar los blobs que ya no referencia ninguna revisión.
+
+    Conexión síncrona: la del CLI (python -m app.migrate revisions) o la de
+    RevisionPruner vía run_sync; el llamador hace commit. revision_blocks se
+    borra en cascada.
+    """
+    revisions = models.PortfolioRevision
+    blobs = models.BlockBlob
+    newest_first = revisions.id.desc()
+    ranked = select(
+        revisions.id,
+        revisions.created_at,
+        func.row_number().over(partition_by=revisions.portfolio_id, order_by=newest_first).label("rank"),
+        func.row_number().over(
+            partition_by=(revisions.portfolio_id, func.date_trunc("day", revisions.created_at)),
+            order_by=newest_first
+        ).label("day_rank"),
+    ).subquery()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=keep_days)
+    expired = select(ranked.c.id).where(
+        ranked.c.rank > keep_last,
+        ~and_(ranked.c.day_rank == 1, ranked.c.created_at >= cutoff)
+    )
+    deleted = connection.execute(delete(revisions).where(revisions.id.in_(expired))).rowcount
+
+    connection.execute(select(func.pg_advisory_xact_lock(REVISION_GC_LOCK_KEY)))
+    freed = connection.execute(
+        delete(blobs).where(
+            ~exists().where(models.RevisionBlock.hash == blobs.hash),
+            ~exists().where(revisions.meta_hash == blobs.hash)
+        ).returning(blobs.size)
+    ).scalars().all()
+    return {"revisions_deleted": deleted, "blobs_deleted": len(freed), "bytes_freed": sum(freed)}
+
+class RevisionPruner:
+    """Aplica la retención del historial cada REVISION_PRUNE_INTERVAL segundos.
+
+    Corre en el bucle de eventos de cada worker; un advisory lock no bloqueante
+    hace que solo uno pode en cada ronda y el resto se la salte.
+    """
+
+    def __init__(self, interval: float = REVISION_PRUNE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.revisions_deleted = 0
+        self.blobs_deleted = 0
+        self.bytes_freed = 0
+        self.last_run_ms = 0.0
+
+    async def prune(self) -> Optional[dict]:
+        """Una ronda de poda; None si otro worker la está haciendo"""
+        start = time.perf_counter()
+        async with database.async_engine.begin() as connection:
+            if not await connection.scalar(select(func.pg_try_advisory_xact_lock(REVISION_PRUNE_LOCK_KEY))):
+                self.skipped += 1
+                return None
+            pruned = await connection.run_sync(prune_revisions)
+        self.runs += 1
+        self.revisions_deleted += pruned["revisions_deleted"]
+        self.blobs_deleted += pruned["blobs_deleted"]
+        self.bytes_freed += pruned["bytes_freed"]
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+        logger.info("Historial podado", extra={**pruned, "prune_ms": round(self.last_run_ms, 1)})
+        return pruned
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                self.failures += 1
+                logger.exception("Error podando el historial de revisiones: %s", e)
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval_s": self.interval,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "revisions_deleted": self.revisions_deleted,
+            "blobs_deleted": self.blobs_deleted,
+            "bytes_freed": self.bytes_freed,
+            "last_run_ms": round(self.last_run_ms, 1),
+        }
+
+class RevisionService:
+    @staticmethod
+    async def record(portfolio: models.Portfolio, db: AsyncSession) -> Optional[int]:
+        """Guardar el estado del portfolio como revisión, en la transacción del llamador.
+
+        Solo se insertan los blobs que aún no existen. Un guardado idéntico a
+        la última revisión (autosave sin cambios) no crea otra. Devuelve el id
+        de la revisión, o None si no hacía falta. No hace commit.
+
+        Tres consultas: el lock compartido junto con la última revisión, los
+        blobs que ya existen y una sola sentencia (CTEs) con los blobs nuevos,
+        la revisión y sus bloques.
+        """
+        snapshot = await run_in_threadpool(split_content, portfolio.content)
+        revisions = models.PortfolioRevision
+        lock = func.pg_advisory_xact_lock_shared(REVISION_GC_LOCK_KEY)
+        if portfolio.version > 1:
+            # Un portfolio recién creado no tiene revisiones con las que comparar
+            latest = (
+                select(revisions.content_hash, revisions.name)
+                .where(revisions.portfolio_id == portfolio.id)
+                .order_by(revisions.id.desc()).limit(1)
+                .subquery()
+            )
+            # LEFT JOIN: el lock se toma aunque el portfolio no tenga revisiones
+            locked = select(lock.label("locked")).subquery()
+            row = (await db.execute(
+                select(latest.c.content_hash, latest.c.name).select_from(locked).outerjoin(latest, true())
+            )).one()
+            if tuple(row) == (snapshot.content_hash, portfolio.name):
+                return None
+        else:
+            await db.execute(select(lock))
+
+        missing = []
+        if snapshot.blobs:
+            existing = set((await db.scalars(
+                select(models.BlockBlob.hash).where(models.BlockBlob.hash.in_(snapshot.blobs))
+            )).all())
+            missing = [
+                (digest, data, size)
+                for digest, (data, size) in snapshot.blobs.items() if digest not in existing
+            ]
+
+        statement = insert(revisions).values(
+            portfolio_id=portfolio.id,
+            version=portfolio.version,
+            name=portfolio.name,
+            meta_hash=snapshot.meta_hash,
+            content_hash=snapshot.content_hash,
+            block_count=snapshot.block_count
+        ).returning(revisions.id)
+        if snapshot.blocks:
+            revision = statement.cte("revision")
+            block_rows = values(
+                column("position", Integer), column("block_id", String), column("hash", String),
+                column("in_layout", Boolean),
+                name="new_blocks"
+            ).data([
+                (position, block_id, digest, in_layout)
+                for position, (block_id, digest, in_layout) in enumerate(snapshot.blocks)
+            ])
+            statement = insert(models.RevisionBlock.__table__).from_select(
+                ["revision_id", "position", "block_id", "hash", "in_layout"],
+                select(revision.c.id, block_rows.c.position, block_rows.c.block_id, block_rows.c.hash, block_rows.c.in_layout)
+                .select_from(revision).join(block_rows, true())
+            ).returning(models.RevisionBlock.revision_id)
+        if missing:
+            blob_rows = values(
+                column("hash", String), column("data", JSONB), column("size", Integer),
+                name="new_blobs"
+            ).data(missing)
+            # Otra revisión concurrente puede estar insertando el mismo bloque
+            statement = statement.add_cte(
+                pg_insert(models.BlockBlob.__table__)
+                .from_select(["hash", "data", "size"], select(blob_rows))
+                .on_conflict_do_nothing(index_elements=["hash"])
+                .cte("new_blob_rows")
+            )
+        return (await db.execute(statement)).scalars().first()
+
+    @staticmethod
+    async def record_clones(source_id: int, clones: Sequence[models.Portfolio], db: AsyncSession) -> int:
+        """Primera revisión de los clones: copia en la BD la última del origen.
+
+        Los clones comparten todos los blobs del origen; solo se añaden las
+        filas de la revisión. Si la última revisión del origen no corresponde
+        a su versión actual (o no tiene), el historial de los clones empieza
+        en su primer guardado. No hace commit.
+        """
+        if not clones:
+            return 0
+        revisions = models.PortfolioRevision
+        source = (await db.execute(
+            select(revisions.id, revisions.meta_hash, revisions.content_hash, revisions.block_count)
+            .join(models.Portfolio, and_(
+                models.Portfolio.id == revisions.portfolio_id,
+                models.Portfolio.version == revisions.version
+            ))
+            .where(revisions.portfolio_id == source_id)
+            .order_by(revisions.id.desc()).limit(1)
+        )).first()
+        if source is None:
+            return 0
+
+        clone_ids = [clone.id for clone in clones]
+        revision_ids = (await db.scalars(
+            insert(revisions).from_select(
+                ["portfolio_id", "version", "name", "meta_hash", "content_hash", "block_count"],
+                select(
+                    models.Portfolio.id,
+                    models.Portfolio.version,
+                    models.Portfolio.name,
+                    literal(source.meta_hash, revisions.meta_hash.type),
+                    literal(source.content_hash, revisions.content_hash.type),
+                    literal(source.block_count, revisions.block_count.type),
+                ).where(models.Portfolio.id.in_(clone_ids))
+            ).returning(revisions.id)
+        )).all()
+        blocks = models.RevisionBlock
+        await db.execute(
+            insert(blocks).from_select(
+                ["revision_id", "position", "block_id", "hash", "in_layout"],
+                select(revisions.id, blocks.position, blocks.block_id, blocks.hash, blocks.in_layout)
+                .select_from(revisions)
+                .join(blocks, blocks.revision_id == source.id)
+                .where(revisions.id.in_(revision_ids))
+            )
+        )
+        return len(revision_ids)
+
+    @staticmethod
+    async def list_revisions(
+        portfolio_id: int,
+        db: AsyncSession,
+        limit: int = 20,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Página de revisiones de un portfolio, de la más reciente a la más antigua"""
+        revisions = models.PortfolioRevision
+        query = select(
+            revisions.id, revisions.version, revisions.name, revisions.block_count, revisions.created_at
+        ).where(revisions.portfolio_id == portfolio_id)
+        if cursor:
+            _, cursor_id = decode_cursor(cursor)
+            query = query.where(revisions.id < cursor_id)
+        rows = (await db.execute(query.order_by(revisions.id.desc()).limit(limit + 1))).mappings().all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        return [dict(row) for row in rows], next_cursor
+
+    @staticmethod
+    async def get_revision(portfolio_id: int, revision_id: int, db: AsyncSession) -> Optional[dict]:
+        """Revisión con su content reconstruido (None si no es de ese portfolio)"""
+        revisions = models.PortfolioRevision
+        blobs = models.BlockBlob
+        row = (await db.execute(
+            select(
+                revisions.id, revisions.portfolio_id, revisions.version, revisions.name,
+                revisions.block_count, revisions.created_at, blobs.data.label("meta")
+            )
+            .outerjoin(blobs, blobs.hash == revisions.meta_hash)
+            .where(revisions.id == revision_id, revisions.portfolio_id == portfolio_id)
+        )).mappings().first()
+        if row is None:
+            return None
+
+        blocks = []
+        if row["block_count"] is not None:
+            blocks = (await db.execute(
+                select(models.RevisionBlock.block_id, models.RevisionBlock.hash, blobs.data, models.RevisionBlock.in_layout)
+                .outerjoin(blobs, blobs.hash == models.RevisionBlock.hash)
+                .where(models.RevisionBlock.revision_id == revision_id)
+                .order_by(models.RevisionBlock.position)
+            )).all()
+        revision = dict(row)
+        meta = revision.pop("meta")
+        revision["content"] = await run_in_threadpool(join_content, meta, revision["block_count"], blocks)
+        return revision
+
+    @staticmethod
+    async def get_storage_stats(db: AsyncSession) -> dict:
+        """Espacio que ocuparían las revisiones completas frente al realmente almacenado"""
+        return storage_stats((await db.execute(storage_stats_statement())).one())
+
+revision_pruner = RevisionPruner()
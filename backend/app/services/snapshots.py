@@ -0,0 +1,347 @@
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from html import escape
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional
+import brotli
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ROOT = os.getenv("SNAPSHOT_ROOT", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "snapshots"))
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "2"))
+
+# Variantes precomprimidas, en orden de preferencia para la negociación
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_SAFE_CSS_VALUE = re.compile(r"^[#\w\s.,%()-]{1,64}$")
+_SAFE_URL = re.compile(r"^(https?://|mailto:|tel:|/|#)", re.IGNORECASE)
+
+def _css(properties: dict) -> str:
+    """Estilos en línea del bloque (solo valores con caracteres seguros)"""
+    mapping = {
+        "backgroundColor": "background-color",
+        "textColor": "color",
+        "padding": "padding",
+        "textAlign": "text-align",
+        "borderRadius": "border-radius",
+        "fontSize": "font-size",
+    }
+    rules = []
+    for key, css_property in mapping.items():
+        value = properties.get(key)
+        if isinstance(value, str) and _SAFE_CSS_VALUE.match(value):
+            rules.append(f"{css_property}:{value}")
+    return ";".join(rules)
+
+def _text(tag: str, value: Any, css_class: str = "") -> str:
+    if not isinstance(value, str) or not value:
+        return ""
+    class_attr = f' class="{css_class}"' if css_class else ""
+    return f"<{tag}{class_attr}>{escape(value)}</{tag}>"
+
+def _url(value: Any) -> Optional[str]:
+    if isinstance(value, str) and _SAFE_URL.match(value):
+        return escape(value, quote=True)
+    return None
+
+def _image(value: Any, alt: Any = "") -> str:
+    src = _url(value)
+    if not src:
+        return ""
+    alt_text = escape(alt if isinstance(alt, str) else "", quote=True)
+    return f'<img src="{src}" alt="{alt_text}" loading="lazy">'
+
+def _links(properties: dict, keys: Iterable[str]) -> str:
+    items = []
+    for key in keys:
+        href = _url(properties.get(key))
+        if href:
+            label = key.replace("Link", "").replace("Url", "")
+            items.append(f'<li><a href="{href}" rel="noopener">{escape(label)}</a></li>')
+    return f'<ul class="links">{"".join(items)}</ul>' if items else ""
+
+def _render_hero(properties: dict) -> str:
+    return "".join((
+        _image(properties.get("profileImage"), properties.get("title")),
+        _text("h1", properties.get("title")),
+        _text("p", properties.get("subtitle"), "subtitle"),
+        _text("p", properties.get("description")),
+        _links(properties, ("githubLink", "linkedinLink", "twitterLink", "emailLink", "phoneLink")),
+    ))
+
+def _render_about(properties: dict) -> str:
+    skills = properties.get("skills")
+    timeline = properties.get("timeline")
+    parts = [
+        _image(properties.get("profileImage"), properties.get("name")),
+        _text("h2", properties.get("title")),
+        _text("p", properties.get("name"), "name"),
+        _text("p", properties.get("role"), "role"),
+        _text("p", properties.get("description")),
+    ]
+    if isinstance(skills, list) and skills:
+        parts.append('<ul class="skills">' + "".join(_text("li", s) for s in skills) + "</ul>")
+    if isinstance(timeline, list) and timeline:
+        entries = (
+            "<li>" + _text("span", item.get("year"), "year") + _text("strong", item.get("title"))
+            + _text("span", item.get("company"), "company") + "</li>"
+            for item in timeline if isinstance(item, dict)
+        )
+        parts.append('<ol class="timeline">' + "".join(entries) + "</ol>")
+    parts.append(_links(properties, ("emailLink", "linkedinLink", "githubLink", "cvLink")))
+    return "".join(parts)
+
+def _render_projects(properties: dict) -> str:
+    projects = properties.get("projects")
+    parts = [_text("h2", properties.get("title")), _text("p", properties.get("description"))]
+    if isinstance(projects, list):
+        for project in projects:
+            if not isinstance(project, dict):
+                continue
+            technologies = project.get("technologies")
+            parts.append(
+                '<article class="project">'
+                + _image(project.get("image"), project.get("title"))
+                + _text("h3", project.get("title"))
+                + _text("p", project.get("description"))
+                + ('<ul class="technologies">' + "".join(_text("li", t) for t in technologies) + "</ul>"
+                   if isinstance(technologies, list) else "")
+                + _links(project, ("demoLink", "githubLink"))
+                + "</article>"
+            )
+    return "".join(parts)
+
+def _render_contact(properties: dict) -> str:
+    return "".join((
+        _text("h2", properties.get("title")),
+        _text("p", properties.get("description")),
+        _text("p", properties.get("email"), "email"),
+        _text("p", properties.get("phone"), "phone"),
+        _links(properties, ("website", "githubUrl", "linkedinUrl", "twitterUrl", "instagramUrl")),
+    ))
+
+RENDERERS = {
+    "hero": _render_hero,
+    "about": _render_about,
+    "projects": _render_projects,
+    "contact": _render_contact,
+}
+
+def render_portfolio_html(name: str, content: Optional[dict]) -> str:
+    """Convertir blocks/blockProperties en una página HTML estática"""
+    content = content if isinstance(content, dict) else {}
+    blocks = content.get("blocks") if isinstance(content.get("blocks"), list) else []
+    block_properties = content.get("blockProperties") if isinstance(content.get("blockProperties"), dict) else {}
+
+    sections = []
+    for block_id in blocks:
+        if not isinstance(block_id, str):
+            continue
+        block_type = block_id.split("-", 1)[0]
+        renderer = RENDERERS.get(block_type)
+        if renderer is None:
+            continue
+        properties = block_properties.get(block_id)
+        properties = properties if isinstance(properties, dict) else {}
+        sections.append(
+            f'<section id="{escape(block_id, quote=True)}" data-component-type="{block_type}" '
+            f'style="{_css(properties)}">{renderer(properties)}</section>'
+        )
+
+    title = escape(f"{name} - Portfolio")
+    return (
+        "<!DOCTYPE html>"
+        '<html lang="es"><head><meta charset="utf-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">'
+        f"<title>{title}</title>"
+        f'<meta property="og:title" content="{title}">'
+        f'<meta name="description" content="{escape(f"Portfolio de {name}", quote=True)}">'
+        "</head><body><main>"
+        + "".join(sections)
+        + "</main></body></html>"
+    )
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def html_path(slug: str, root: str = SNAPSHOT_ROOT) -> str:
+    return os.path.join(root, "html", f"{slug}.html")
+
+def _meta_path(portfolio_id: int, root: str) -> str:
+    return os.path.join(root, "meta", f"{portfolio_id}.json")
+
+def read_meta(portfolio_id: int, root: str = SNAPSHOT_ROOT) -> Optional[dict]:
+    try:
+        with open(_meta_path(portfolio_id, root)) as meta_file:
+            return json.load(meta_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _remove_html(slug: str, root: str) -> None:
+    base = html_path(slug, root)
+    for path in (base, *(base + suffix for _, suffix in ENCODINGS)):
+        if os.path.exists(path):
+            os.unlink(path)
+
+def _is_older(updated_at: Optional[str], than: Optional[str]) -> bool:
+    if updated_at is None or than is None:
+        return False
+    return datetime.fromisoformat(updated_at) < datetime.fromisoformat(than)
+
+def build_snapshot(job: Dict[str, Any], root: str = SNAPSHOT_ROOT) -> bool:
+    """Renderizar y guardar un snapshot con sus variantes gzip/brotli.
+
+    Se ejecuta en el pool de procesos. Devuelve False si el snapshot ya
+    correspondía a ese updated_at (regeneración incremental) o a uno
+    posterior (un render de otro proceso terminó antes que este).
+    """
+    meta = read_meta(job["id"], root)
+    if meta and meta.get("updated_at") == job["updated_at"] and meta.get("slug") == job["slug"]:
+        return False
+    if meta and _is_older(job["updated_at"], meta.get("updated_at")):
+        return False
+
+    os.makedirs(os.path.join(root, "html"), exist_ok=True)
+    os.makedirs(os.path.join(root, "meta"), exist_ok=True)
+
+    html = render_portfolio_html(job["name"], job["content"]).encode("utf-8")
+    base = html_path(job["slug"], root)
+    # Primero las variantes comprimidas: el .html marca el snapshot como disponible
+    _write_atomic(base + ".br", brotli.compress(html, quality=11))
+    _write_atomic(base + ".gz", gzip.compress(html, compresslevel=9))
+    _write_atomic(base, html)
+
+    if meta and meta.get("slug") and meta["slug"] != job["slug"]:
+        _remove_html(meta["slug"], root)
+    _write_atomic(
+        _meta_path(job["id"], root),
+        json.dumps({"slug": job["slug"], "updated_at": job["updated_at"]}).encode()
+    )
+    return True
+
+def remove_snapshot(portfolio_id: int, root: str = SNAPSHOT_ROOT) -> None:
+    meta = read_meta(portfolio_id, root)
+    if meta and meta.get("slug"):
+        _remove_html(meta["slug"], root)
+    meta_path = _meta_path(portfolio_id, root)
+    if os.path.exists(meta_path):
+        os.unlink(meta_path)
+
+def snapshot_job(portfolio) -> Dict[str, Any]:
+    """Datos (serializables) que necesita un worker para renderizar un portfolio"""
+    return {
+        "id": portfolio.id,
+        "slug": portfolio.slug,
+        "name": portfolio.name,
+        "content": portfolio.content,
+        "updated_at": portfolio.updated_at.isoformat() if portfolio.updated_at else None,
+    }
+
+class SnapshotRenderer:
+    """Renderiza snapshots en un pool de procesos, fuera del camino de la petición.
+
+    Como mucho un render en curso por portfolio: los guardados que llegan
+    mientras tanto esperan detrás (solo el último) y se envían al terminar,
+    así un render antiguo nunca acaba después de uno nuevo.
+    """
+
+    def __init__(self, workers: int, root: str = SNAPSHOT_ROOT):
+        self.workers = workers
+        self.root = root
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Render enviado al pool y siguiente job en espera, por portfolio
+        self._pending: Dict[int, Future] = {}
+        self._queued: Dict[int, Dict[str, Any]] = {}
+        self._lock = Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: no heredar el event loop ni las conexiones del worker de uvicorn
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _submit(self, job: Dict[str, Any]) -> Future:
+        """Enviar un job al pool (con el lock tomado)"""
+        future = self._get_executor().submit(build_snapshot, job, self.root)
+        self._pending[job["id"]] = future
+        return future
+
+    def _watch(self, portfolio_id: int, future: Future) -> None:
+        future.add_done_callback(lambda f: self._done(portfolio_id, f))
+
+    def schedule(self, portfolio) -> None:
+        """Encolar la regeneración de un portfolio (la petición no espera)"""
+        job = snapshot_job(portfolio)
+        with self._lock:
+            if job["id"] in self._pending:
+                # Ya hay un render de este portfolio: este job va detrás y sustituye al que esperaba
+                self._queued[job["id"]] = job
+                return
+            future = self._submit(job)
+        self._watch(job["id"], future)
+
+    def _done(self, portfolio_id: int, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Error rendering snapshot for portfolio %s: %s", portfolio_id, future.exception())
+        following = None
+        with self._lock:
+            if self._pending.get(portfolio_id) is not future:
+                return
+            del self._pending[portfolio_id]
+            job = self._queued.pop(portfolio_id, None)
+            if job is not None:
+                try:
+                    following = self._submit(job)
+                except RuntimeError as e:
+                    # Pool ya cerrado
+                    logger.error("Snapshot render dropped for portfolio %s: %s", portfolio_id, e)
+        if following is not None:
+            self._watch(portfolio_id, following)
+
+    def remove(self, portfolio_id: int) -> None:
+        with self._lock:
+            self._queued.pop(portfolio_id, None)
+            previous = self._pending.pop(portfolio_id, None)
+        if previous is not None:
+            # Si ya se está renderizando, borrar también cuando termine
+            previous.add_done_callback(lambda f: remove_snapshot(portfolio_id, self.root))
+        remove_snapshot(portfolio_id, self.root)
+
+    def shutdown(self) -> None:
+        if self._executor is None:
+            return
+        # Esperar también a los jobs encadenados, que se envían al terminar el anterior
+        while True:
+            with self._lock:
+                running = [future for future in self._pending.values() if not future.done()]
+                idle = not running and not self._queued
+            if idle:
+                break
+            if running:
+                wait(running, timeout=0.1)
+            else:
+                # El render terminó y su callback aún no envió el siguiente
+                time.sleep(0.01)
+        self._executor.shutdown(wait=True, cancel_futures=False)
+        self._executor = None
+
+snapshot_renderer = SnapshotRenderer(SNAPSHOT_WORKERS)
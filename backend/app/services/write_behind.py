@@ -0,0 +1,249 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Integer, column, update, values
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from typing import Any, Dict, Iterable, List, Optional
+from .. import database, models
+from .cache import public_portfolio_cache
+from .events import portfolio_events
+from .portfolio import PortfolioService, prepare_content, serialize_portfolio, slugify
+from .revisions import RevisionService
+from .snapshots import snapshot_renderer
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: sin esto los autoguardados se escriben en el acto, como cualquier PUT
+WRITE_BEHIND_ENABLED = database._env_bool("WRITE_BEHIND_ENABLED", False)
+# Vaciado periódico (segundos) y por tamaño (portfolios con cambios pendientes)
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "2"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "100"))
+# El editor marca así los autoguardados; los guardados explícitos se escriben en el acto
+AUTOSAVE_HEADER = "x-autosave"
+
+@dataclass
+class PendingPortfolio:
+    state: Dict[str, Any]  # el portfolio tal como lo verá la próxima lectura
+    staged_at: float = field(default_factory=time.monotonic)  # primer cambio sin escribir
+
+class WriteBehindBuffer:
+    """Buffer de autoguardados por portfolio: solo se conserva el último content.
+
+    Los autoguardados se responden desde memoria y se escriben en lote, en una
+    transacción, cada WRITE_BEHIND_FLUSH_INTERVAL segundos, al llegar a
+    WRITE_BEHIND_MAX_PENDING portfolios, al apagar y antes de cualquier otra
+    petición que lea o escriba esos portfolios (dependencia flush_pending).
+    Es estado del proceso, como la caché pública.
+    """
+
+    def __init__(self, enabled: bool = WRITE_BEHIND_ENABLED, interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_pending = max_pending
+        # Solo se lee y modifica en tramos sin await: atómico dentro del bucle de eventos
+        self._pending: Dict[int, PendingPortfolio] = {}
+        # Serializa los vaciados entre sí; los autoguardados no lo esperan
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.staged = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.flush_total = 0.0
+        self.flush_max = 0.0
+        self.flush_last = 0.0
+
+    def accepts(self, request: Request) -> bool:
+        """¿Es un autoguardado que debe ir al buffer?"""
+        return (
+            self.enabled
+            and request.method == "PUT"
+            and request.headers.get(AUTOSAVE_HEADER, "").lower() in ("1", "true")
+        )
+
+    async def stage(self, portfolio_id: int, update_data: dict, db: AsyncSession) -> Optional[dict]:
+        """Guardar un autoguardado en el buffer y devolver el portfolio resultante.
+
+        Devuelve None si el cambio no puede ir al buffer (no trae content,
+        renombra el portfolio o este no existe); en ese caso los cambios
+        pendientes del portfolio ya están escritos y el PUT sigue su camino normal.
+        """
+        if update_data.get("content") is None:
+            await self.flush([portfolio_id])
+            return None
+        content = await run_in_threadpool(prepare_content, update_data["content"])
+
+        entry = self._pending.get(portfolio_id)
+        if entry is None:
+            # Carga sin bloquear el buffer: ningún autoguardado espera a la BD de otro
+            portfolio = await PortfolioService.get_portfolio(portfolio_id, db)
+            if portfolio is None:
+                return None
+            # Otro autoguardado pudo cargarlo mientras tanto: se continúa sobre el suyo
+            entry = self._pending.get(portfolio_id) or PendingPortfolio(serialize_portfolio(portfolio))
+        if update_data.get("name") not in (None, entry.state["name"]):
+            # El vaciado solo escribe content: lo pendiente se escribe y el renombrado sigue por el PUT
+            await self.flush([portfolio_id])
+            return None
+
+        previous = entry.state["content"]
+        entry.state["content"] = content
+        entry.state["version"] += 1
+        entry.state["updated_at"] = datetime.now(timezone.utc)
+        self._pending[portfolio_id] = entry
+        self.staged += 1
+        # La previsualización en vivo ve el autoguardado aunque aún no esté escrito
+        portfolio_events.publish_update(
+            portfolio_id, entry.state["version"], entry.state["name"], previous, content
+        )
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        return dict(entry.state)
+
+    def _matching(self, path_params: dict) -> Optional[List[int]]:
+        """Portfolios pendientes que puede leer o escribir una ruta (None: todos)"""
+        if "portfolio_id" in path_params:
+            return [int(path_params["portfolio_id"])]
+        if "user_id" in path_params:
+            user_id = int(path_params["user_id"])
+            return [pid for pid, entry in self._pending.items() if entry.state["user_id"] == user_id]
+        if "portfolio_name" in path_params:
+            slug = slugify(path_params["portfolio_name"])
+            return [pid for pid, entry in self._pending.items() if entry.state["slug"] == slug]
+        return None
+
+    async def flush_pending(self, request: Request) -> None:
+        """Dependencia: escribir los cambios pendientes que la petición va a leer"""
+        if not self._pending or self.accepts(request):
+            return
+        try:
+            portfolio_ids = self._matching(request.path_params)
+        except ValueError:
+            return  # parámetro no numérico: la ruta responderá 422
+        if portfolio_ids == []:
+            return
+        if not await self.flush(portfolio_ids):
+            raise HTTPException(status_code=503, detail="No se pudieron guardar los cambios pendientes")
+
+    async def flush(self, portfolio_ids: Optional[Iterable[int]] = None) -> bool:
+        """Escribir los cambios pendientes (todos o los indicados). False si falló.
+
+        Se escribe una copia del estado: los autoguardados que lleguen durante
+        la escritura siguen en el buffer para el próximo vaciado.
+        """
+        async with self._flush_lock:
+            return await self._flush_locked(portfolio_ids)
+
+    async def _flush_locked(self, portfolio_ids: Optional[Iterable[int]] = None) -> bool:
+        if portfolio_ids is None:
+            entries = dict(self._pending)
+        else:
+            entries = {pid: self._pending[pid] for pid in portfolio_ids if pid in self._pending}
+        if not entries:
+            return True
+        batch = {pid: dict(entry.state) for pid, entry in entries.items()}
+
+        start = time.perf_counter()
+        table = models.Portfolio.__table__
+        rows = values(
+            column("id", Integer), column("content", JSONB), column("version", Integer),
+            column("updated_at", DateTime(timezone=True)),
+            name="pending"
+        ).data([
+            (pid, state["content"], state["version"], state["updated_at"])
+            for pid, state in batch.items()
+        ])
+        # Un solo UPDATE ... FROM (VALUES ...) para todo el lote
+        statement = update(table).where(table.c.id == rows.c.id).values(
+            content=rows.c.content,
+            # Sin comprobar versión, como un PUT; nunca hacia atrás si otro proceso escribió
+            version=func.greatest(table.c.version + 1, rows.c.version),
+            updated_at=rows.c.updated_at
+        ).returning(table.c.id)
+        try:
+            async with database.AsyncSessionLocal() as db:
+                updated = set((await db.scalars(statement)).all())
+                portfolios = [models.Portfolio(**batch[pid]) for pid in batch if pid in updated]
+                for portfolio in portfolios:
+                    await RevisionService.record(portfolio, db)
+                await db.commit()
+        except Exception as e:
+            self.failures += 1
+            logger.exception("Error vaciando el buffer de autoguardado: %s", e)
+            return False
+
+        for pid, entry in entries.items():
+            # Si llegó otro autoguardado durante la escritura, queda pendiente
+            if self._pending.get(pid) is entry and entry.state["version"] == batch[pid]["version"]:
+                del self._pending[pid]
+        if len(updated) < len(batch):
+            # Borrados por otro proceso mientras estaban en el buffer
+            logger.warning("Autoguardados descartados", extra={"portfolio_ids": sorted(set(batch) - updated)})
+        for portfolio in portfolios:
+            public_portfolio_cache.invalidate(portfolio_id=portfolio.id, slug=portfolio.slug)
+            database.recent_writes.mark(portfolio_id=portfolio.id, slug=portfolio.slug, user_id=portfolio.user_id)
+            snapshot_renderer.schedule(portfolio)
+
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.flushed += len(portfolios)
+        self.flush_total += elapsed
+        self.flush_last = elapsed
+        self.flush_max = max(self.flush_max, elapsed)
+        logger.debug("Buffer de autoguardado vaciado", extra={"portfolios": len(batch), "flush_ms": round(elapsed * 1000, 1)})
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Parar el vaciado periódico y escribir lo pendiente (al apagar)"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pending and not await self.flush():
+            logger.error("Autoguardados perdidos al apagar", extra={"portfolios": len(self._pending)})
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min((entry.staged_at for entry in self._pending.values()), default=None)
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "oldest_pending_ms": round((now - oldest) * 1000, 1) if oldest is not None else 0.0,
+            "staged": self.staged,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            # Autoguardados absorbidos por otro posterior del mismo portfolio
+            "coalesced": self.staged - self.flushed - len(self._pending),
+            "failures": self.failures,
+            "flush_last_ms": round(self.flush_last * 1000, 3),
+            "flush_avg_ms": round(self.flush_total * 1000 / self.flushes, 3) if self.flushes else 0.0,
+            "flush_max_ms": round(self.flush_max * 1000, 3),
+            "flush_total_seconds": self.flush_total,
+        }
+
+autosave_buffer = WriteBehindBuffer()
+
+async def flush_pending(request: Request) -> None:
+    await autosave_buffer.flush_pending(request)
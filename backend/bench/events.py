@@ -0,0 +1,89 @@
+"""Reparto de un guardado a miles de suscriptores SSE inactivos, en un worker.
+
+Uso (desde backend/):
+    python -m bench.events --subscribers 3000 --rounds 5
+
+Abre --subscribers suscripciones al mismo portfolio con
+PortfolioEventHub.subscribe y, por cada una, una tarea que consume el mismo
+generador event_stream que sirve GET /api/portfolios/{id}/events (sin HTTP
+ni sockets: mide el hub y el bucle de eventos). Con todas esperando, publica
+un guardado con publish_update y mide cuánto tarda cada suscriptor en
+recibir su marco: p50, p99 y máximo, y lo que tarda la propia publicación.
+La memoria por suscriptor (suscripción, cola y tarea) sale de tracemalloc.
+"""
+from typing import List
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from app.api.portfolios import event_stream
+from app.services.events import portfolio_events
+
+PORTFOLIO_ID = 1
+
+def editor_content(title: str) -> dict:
+    return {
+        "blocks": ["hero-0-1", "about-1-2"],
+        "blockProperties": {"hero-0-1": {"title": title}, "about-1-2": {"description": "d" * 200}},
+    }
+
+async def listen(stream, received: List[float], ready: asyncio.Event, expected: int) -> None:
+    await stream.__anext__()  # retry + snapshot inicial
+    async for _ in stream:
+        received.append(time.perf_counter())
+        if len(received) == expected:
+            ready.set()
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+async def run(args: argparse.Namespace) -> None:
+    # El hub global, el mismo del que se desuscribe event_stream
+    hub = portfolio_events
+    hub.max_subscribers = max(hub.max_subscribers, args.subscribers)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    received: List[float] = []
+    ready = asyncio.Event()
+    tasks = []
+    for _ in range(args.subscribers):
+        subscription = hub.subscribe(PORTFOLIO_ID)
+        stream = event_stream(subscription, b"")
+        tasks.append(asyncio.create_task(listen(stream, received, ready, args.subscribers)))
+    # Que todas las tareas lleguen a esperar en su cola
+    await asyncio.sleep(0.5)
+    used = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    print(f"{hub.stats()['subscribers']} suscriptores inactivos: {used / args.subscribers / 1024:.1f} KiB por suscriptor")
+
+    previous = editor_content("Hola")
+    for version in range(2, args.rounds + 2):
+        current = editor_content(f"Hola v{version}")
+        received.clear()
+        ready.clear()
+        started = time.perf_counter()
+        hub.publish_update(PORTFOLIO_ID, version, "Bench", previous, current)
+        published = time.perf_counter()
+        await asyncio.wait_for(ready.wait(), 60)
+        latencies = sorted((at - started) * 1000 for at in received)
+        print(f"v{version}: publicar {(published - started) * 1000:6.2f} ms  entrega p50 "
+              f"{statistics.median(latencies):6.2f} ms  p99 {percentile(latencies, 0.99):6.2f} ms  "
+              f"máx {latencies[-1]:6.2f} ms")
+        previous = current
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print("Hub:", hub.stats())
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Throughput del import y el export NDJSON contra una API en marcha.
+
+Uso (desde backend/, con el mismo JWT_SECRET que el servidor):
+    JWT_SECRET=... python -m bench.import_export --user-id 1 --portfolios 100000
+
+Genera --portfolios líneas con un content de editor pequeño (unos 300 B),
+las sube en streaming a POST /api/portfolios/import y luego descarga
+GET /api/portfolios/export contando líneas, con un token de acceso de
+--user-id firmado aquí. Imprime portfolios/s y MB/s de cada dirección.
+Los portfolios importados se quedan en la cuenta de ese usuario.
+"""
+import argparse
+import time
+
+import httpx
+import orjson
+
+from app.services.auth import create_access_token
+
+CHUNK_SIZE = 64 * 1024
+
+def dump_lines(count: int) -> bytes:
+    content = {
+        "blocks": ["hero-0-1", "about-0-2"],
+        "blockProperties": {"hero-0-1": {"title": "Hola " * 20}, "about-0-2": {"skills": ["py"] * 10}},
+    }
+    return b"".join(orjson.dumps({"name": f"Bench {i}", "content": content}) + b"\n" for i in range(count))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--portfolios", type=int, default=10000)
+    args = parser.parse_args()
+
+    token = create_access_token(args.user_id, "bench@example.com", "Bench")
+    body = dump_lines(args.portfolios)
+
+    def chunks():
+        for start in range(0, len(body), CHUNK_SIZE):
+            yield body[start:start + CHUNK_SIZE]
+
+    with httpx.Client(base_url=args.base_url, headers={"Authorization": f"Bearer {token}"}, timeout=None) as client:
+        started = time.perf_counter()
+        response = client.post(
+            "/api/portfolios/import", content=chunks(), headers={"Content-Type": "application/x-ndjson"}
+        )
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        print(f"import  {response.json()}  {args.portfolios / elapsed:8.0f} portfolios/s  "
+              f"{len(body) / elapsed / 1e6:5.1f} MB/s")
+
+        exported = 0
+        size = 0
+        started = time.perf_counter()
+        with client.stream("GET", "/api/portfolios/export") as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                exported += 1
+                size += len(line) + 1
+        elapsed = time.perf_counter() - started
+        print(f"export  {exported} portfolios  {exported / elapsed:8.0f} portfolios/s  {size / elapsed / 1e6:5.1f} MB/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Comparar content JSON frente a JSONB + GIN en PostgreSQL.
+
+Uso (desde backend/, con DATABASE_URL apuntando a un Postgres de pruebas):
+    python -m bench.jsonb --rows 20000 --repeat 50
+
+Crea dos tablas temporales con el mismo content sintético (bloques del
+editor y su lista derivada blockTypes): una JSON y otra JSONB con el índice
+jsonb_path_ops que crea migrate.py. Mide, con la mediana de --repeat
+ejecuciones, el filtro por tipo de bloque (lo que hace /with-block/{tipo})
+y la extracción de las propiedades de un bloque (/{id}/blocks/{block_id}),
+e imprime el tamaño de cada tabla. No toca las tablas de la aplicación.
+"""
+from sqlalchemy import text
+import argparse
+import json
+import random
+import statistics
+import time
+
+from app.database import engine
+
+BLOCK_TYPES = ("hero", "about", "projects", "contact")
+
+def synthetic_content(rng: random.Random) -> dict:
+    blocks = [f"{rng.choice(BLOCK_TYPES)}-{i}-{rng.randrange(10**12)}" for i in range(rng.randint(1, 8))]
+    properties = {
+        block_id: {"title": f"Bloque {block_id}", "description": "x" * rng.randint(20, 400)}
+        for block_id in blocks
+    }
+    return {
+        "blocks": blocks,
+        "blockProperties": properties,
+        "blockTypes": sorted({block_id.split("-", 1)[0] for block_id in blocks}),
+    }
+
+def median_ms(connection, statement, params: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        connection.execute(statement, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = [{"id": i, "content": json.dumps(synthetic_content(rng))} for i in range(1, args.rows + 1)]
+    sample_id = rows[len(rows) // 2]["id"]
+    sample_block = json.loads(rows[len(rows) // 2]["content"])["blocks"][0]
+
+    with engine.connect() as connection:
+        connection.execute(text("CREATE TEMP TABLE bench_json (id INTEGER PRIMARY KEY, content JSON)"))
+        connection.execute(text("CREATE TEMP TABLE bench_jsonb (id INTEGER PRIMARY KEY, content JSONB)"))
+        connection.execute(text("INSERT INTO bench_json VALUES (:id, CAST(:content AS JSON))"), rows)
+        connection.execute(text("INSERT INTO bench_jsonb VALUES (:id, CAST(:content AS JSONB))"), rows)
+        connection.execute(text("CREATE INDEX ON bench_jsonb USING GIN (content jsonb_path_ops)"))
+        connection.execute(text("ANALYZE bench_json"))
+        connection.execute(text("ANALYZE bench_jsonb"))
+
+        # JSON no tiene operador de contención: hay que convertir fila a fila
+        filters = {
+            "JSON  (content::jsonb @>)": "SELECT id FROM bench_json WHERE content::jsonb @> CAST(:filter AS JSONB) LIMIT 50",
+            "JSONB (@> + GIN)": "SELECT id FROM bench_jsonb WHERE content @> CAST(:filter AS JSONB) LIMIT 50",
+        }
+        extracts = {
+            "JSON  (->)": "SELECT content -> 'blockProperties' -> :block FROM bench_json WHERE id = :id",
+            "JSONB (->)": "SELECT content -> 'blockProperties' -> :block FROM bench_jsonb WHERE id = :id",
+        }
+        # Un tipo que no aparece obliga a recorrer todas las filas sin índice
+        for block_type in ("projects", "missing"):
+            params = {"filter": json.dumps({"blockTypes": [block_type]})}
+            for name, sql in filters.items():
+                print(f"Filtro {block_type:<8} {name:<26} {median_ms(connection, text(sql), params, args.repeat):8.2f} ms")
+        params = {"id": sample_id, "block": sample_block}
+        for name, sql in extracts.items():
+            print(f"Bloque           {name:<26} {median_ms(connection, text(sql), params, args.repeat):8.2f} ms")
+        for table in ("bench_json", "bench_jsonb"):
+            size = connection.execute(text(f"SELECT pg_total_relation_size('{table}')")).scalar()
+            print(f"Tamaño {table:<12} {size / 1024 / 1024:8.1f} MiB (con índices)")
+        connection.rollback()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Generador de carga HTTP: peticiones concurrentes contra una API en marcha.
+
+Uso (desde backend/):
+    python -m bench.load --concurrency 50 --duration 30 /api/portfolios/user/1 /portfolio/mi-portfolio
+
+Cada trabajador recorre las rutas en orden circular durante --duration
+segundos; al final se imprime el total, peticiones/s, los códigos de estado
+y los percentiles de latencia. Sirve para comparar el throughput del pool
+asíncrono (DB_POOL_SIZE, DB_MAX_OVERFLOW) o de cualquier ruta de lectura.
+"""
+from collections import Counter
+from typing import List, Sequence
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+
+import httpx
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+async def worker(client: httpx.AsyncClient, paths: List[str], offset: int, deadline: float,
+                 latencies: List[float], statuses: Counter) -> None:
+    for path in itertools.islice(itertools.cycle(paths), offset, None):
+        if time.perf_counter() >= deadline:
+            return
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+async def run(args: argparse.Namespace) -> None:
+    headers = dict((name.strip(), value.strip()) for name, _, value in (h.partition(":") for h in args.header))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=30) as client:
+        # Calentamiento: conexiones abiertas y cachés en su estado normal
+        for path in args.paths:
+            await client.get(path)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, args.paths, i, deadline, latencies, statuses) for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"{sum(statuses.values())} peticiones en {elapsed:.1f} s: {len(latencies) / elapsed:.0f} req/s")
+    print("Estados:", dict(statuses))
+    if latencies:
+        print(
+            f"Latencia (ms): p50 {statistics.median(latencies):.1f}  p95 {percentile(latencies, 0.95):.1f}  "
+            f"p99 {percentile(latencies, 0.99):.1f}  máx {max(latencies):.1f}"
+        )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Rutas GET a recorrer (relativas a --base-url)")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de carga")
+    parser.add_argument("--header", action="append", default=[], help="Cabecera extra 'Nombre: valor'")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Bucle de logins contra el stub de Google: logins/s y latencia del callback.
+
+Uso (desde backend/):
+    uvicorn app.google_stub:app --port 8001
+    GOOGLE_DISCOVERY_URL=http://localhost:8001/.well-known/openid-configuration \\
+        GOOGLE_CLIENT_ID=bench GOOGLE_CLIENT_SECRET=bench JWT_SECRET=... SECRET_KEY=... \\
+        uvicorn app.main:app --port 8000
+    python -m bench.login --logins 500 --concurrency 10 --users 50
+
+Cada login llama a /auth/callback con el código que emitiría el stub para
+uno de --users emails (el intercambio del código, la verificación del
+id_token y el upsert del usuario son los del login real). Un login cuenta
+como correcto si el callback redirige con #access_token. Al final se piden
+al stub sus contadores (/stats) para comprobar cuántas veces se descargaron
+discovery y JWKS y si se llegó a llamar a userinfo.
+
+Con emails ya registrados se mide el login habitual (el upsert no escribe);
+con --new-users cada login es el primero de un email nuevo (INSERT). Para el
+coste del upsert, comparar ambos contra el mismo Postgres.
+"""
+from collections import Counter
+from typing import List
+import argparse
+import asyncio
+import base64
+import os
+import statistics
+import time
+
+import httpx
+
+def stub_code(email: str) -> str:
+    """Código de autorización del stub: el email en base64url"""
+    return base64.urlsafe_b64encode(email.encode()).decode().rstrip("=")
+
+async def run(args: argparse.Namespace) -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+    run_id = os.urandom(4).hex()
+    for i in range(args.logins):
+        queue.put_nowait(f"bench-{run_id}-{i}@example.com" if args.new_users else f"bench-{i % args.users}@example.com")
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not queue.empty():
+            email = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.get("/auth/callback", params={"code": stub_code(email)})
+            except httpx.HTTPError as e:
+                outcomes[type(e).__name__] += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            outcomes["ok" if "#access_token=" in response.headers.get("location", "") else response.status_code] += 1
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    async with httpx.AsyncClient(base_url=args.stub_url, timeout=30) as stub:
+        stub_hits = (await stub.get("/stats")).json()
+
+    print(f"{args.logins} logins en {elapsed:.1f} s: {args.logins / elapsed:.0f} logins/s")
+    print("Resultados:", dict(outcomes))
+    if latencies:
+        ordered = sorted(latencies)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        print(f"Latencia (ms): p50 {statistics.median(ordered):.1f}  p95 {p95:.1f}")
+    print("Llamadas al stub:", stub_hits)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--stub-url", default="http://localhost:8001")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=20, help="Emails distintos entre los que se reparten los logins")
+    parser.add_argument("--new-users", action="store_true", help="Un email nuevo en cada login (primer login)")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
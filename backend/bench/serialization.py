@@ -0,0 +1,101 @@
+"""Coste de serializar y comprimir un portfolio grande, en proceso (sin BD).
+
+Uso (desde backend/):
+    python -m bench.serialization --blocks 400 --repeat 30
+
+Genera un portfolio sintético (con 400 bloques, unos 1,8 MiB de JSON) y mide
+con TestClient la mediana de:
+  - response_model + JSONResponse (revalidar content y json.dumps)
+  - ORJSONResponse con serialize_portfolio (lo que hace el router)
+  - lo anterior con CompressionMiddleware, gzip y br
+junto con los bytes que viajan en cada caso.
+"""
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+import argparse
+import datetime
+import random
+import statistics
+import time
+import types
+
+from app import schemas
+from app.middleware import CompressionMiddleware
+from app.services.portfolio import serialize_portfolio
+
+WORDS = ("react", "python", "portfolio", "desarrollador", "proyecto", "plataforma", "api", "datos", "diseño", "web")
+
+def synthetic_portfolio(blocks: int, rng: random.Random) -> types.SimpleNamespace:
+    def sentence(n: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    block_ids = [f"projects-0-{i}" for i in range(blocks)]
+    properties = {
+        block_id: {
+            "title": sentence(4),
+            "description": sentence(40),
+            "textColor": "#333",
+            "projects": [
+                {
+                    "title": sentence(3),
+                    "description": sentence(60),
+                    "image": "http://localhost:8000/media/" + "a" * 64 + ".png",
+                    "technologies": ["React", "Node.js", "MongoDB"],
+                    "demoLink": "https://demo.com",
+                }
+                for _ in range(6)
+            ],
+        }
+        for block_id in block_ids
+    }
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return types.SimpleNamespace(
+        id=1, name="Big", slug="big", version=3, user_id=1, created_at=now, updated_at=now,
+        content={"blocks": block_ids, "blockProperties": properties, "blockTypes": ["projects"]},
+    )
+
+def build_clients(portfolio) -> tuple:
+    plain = FastAPI()
+    compressed = FastAPI()
+    compressed.add_middleware(CompressionMiddleware)
+
+    def revalidated():
+        return portfolio
+
+    def orjson_response():
+        return ORJSONResponse(serialize_portfolio(portfolio))
+
+    plain.add_api_route("/response-model", revalidated, response_model=schemas.Portfolio)
+    plain.add_api_route("/orjson", orjson_response, response_model=schemas.Portfolio)
+    compressed.add_api_route("/orjson", orjson_response, response_model=schemas.Portfolio)
+    return TestClient(plain), TestClient(compressed)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    plain, compressed = build_clients(synthetic_portfolio(args.blocks, random.Random(args.seed)))
+    cases = [
+        ("response_model + JSONResponse", plain, "/response-model", "identity"),
+        ("orjson", plain, "/orjson", "identity"),
+        ("orjson + gzip", compressed, "/orjson", "gzip"),
+        ("orjson + br", compressed, "/orjson", "br"),
+    ]
+    for name, client, path, encoding in cases:
+        headers = {"accept-encoding": encoding}
+        client.get(path, headers=headers)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            timings.append((time.perf_counter() - started) * 1000)
+        wire_bytes = int(response.headers.get("content-length", len(response.content)))
+        print(f"{name:<32} {statistics.median(timings):7.1f} ms  {wire_bytes / 1024:7.0f} KiB "
+              f"({response.headers.get('content-encoding', 'identity')})")
+
+if __name__ == "__main__":
+    main()
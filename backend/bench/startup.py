@@ -0,0 +1,70 @@
+"""Tiempo de arranque de la API: import, lifespan y primera petición.
+
+Uso (desde backend/, con DATABASE_URL apuntando a una BD ya migrada y los
+mismos JWT_SECRET y SECRET_KEY que el despliegue):
+    python -m bench.startup --runs 5
+
+Cada ronda es un proceso nuevo (import en frío, como un worker de uvicorn o
+un --reload) que mide por separado:
+  - import app.main
+  - el arranque del lifespan (check_schema, cliente de Google, réplicas...)
+  - la primera GET /health (ping real a la BD)
+Imprime cada ronda y la mediana de cada fase.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ("import", "lifespan", "first_request")
+
+def measure_once() -> None:
+    """Una ronda en este proceso; imprime los tiempos (ms) como JSON"""
+    started = time.perf_counter()
+    import app.main
+    imported = time.perf_counter()
+
+    from fastapi.testclient import TestClient
+    from app.logging_config import shutdown_logging
+    client = TestClient(app.main.app)
+    lifespan_started = time.perf_counter()
+    try:
+        with client:
+            ready = time.perf_counter()
+            response = client.get("/health")
+            answered = time.perf_counter()
+    finally:
+        # Si el lifespan falla no llega a pararlo: el hilo del logging dejaría el proceso colgado
+        shutdown_logging()
+    print(json.dumps({
+        "import": (imported - started) * 1000,
+        "lifespan": (ready - lifespan_started) * 1000,
+        "first_request": (answered - ready) * 1000,
+        "status": response.status_code,
+    }))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--once", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.once:
+        measure_once()
+        return
+
+    rounds = []
+    for run in range(1, args.runs + 1):
+        child = subprocess.run([sys.executable, "-m", "bench.startup", "--once"], capture_output=True, text=True)
+        if child.returncode != 0:
+            sys.exit(f"La ronda {run} falló:\n{child.stderr}")
+        # El logging de la app también escribe en stdout: los tiempos son la última línea
+        timings = json.loads(child.stdout.strip().splitlines()[-1])
+        rounds.append(timings)
+        print(f"Ronda {run}: " + "  ".join(f"{phase} {timings[phase]:7.1f} ms" for phase in PHASES)
+              + f"  (/health {timings['status']})")
+    print("Mediana: " + "  ".join(f"{phase} {statistics.median(r[phase] for r in rounds):7.1f} ms" for phase in PHASES))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Coste de validar content por KB, en proceso (sin BD ni HTTP).
+
+Uso (desde backend/):
+    python -m bench.validation
+
+Para portfolios de editor de distintos tamaños mide, como lo hace FastAPI
+(json.loads del cuerpo y model_validate), la validación con un content sin
+tipar (Dict[str, Any], el esquema anterior) frente a PortfolioUpdate con los
+modelos por bloque y los límites, y aparte el recorrido de
+check_content_limits. Imprime microsegundos por petición y el extra por KB.
+"""
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+import argparse
+import json
+import time
+
+import orjson
+
+from app import schemas
+
+class UntypedUpdate(BaseModel):
+    """PortfolioUpdate sin validar content (como antes de los esquemas por bloque)"""
+    name: Optional[str] = None
+    content: Optional[Dict[str, Any]] = None
+
+def editor_content(projects: int) -> dict:
+    return {
+        "blocks": ["hero-0-1", "about-1-2", "projects-2-3", "contact-3-4"],
+        "lastUpdated": "2024-01-01T00:00:00Z",
+        "blockProperties": {
+            "hero-0-1": {"title": "Hola, soy Ana", "subtitle": "Full stack", "backgroundColor": "#fff", "showButton": True},
+            "about-1-2": {
+                "description": "d" * 400,
+                "skills": ["React", "Python", "SQL"] * 5,
+                "timeline": [{"year": "2020", "title": "Dev", "company": "ACME"}] * 6,
+            },
+            "projects-2-3": {
+                "title": "Proyectos",
+                "columns": 3,
+                "projects": [
+                    {
+                        "title": f"P{i}",
+                        "description": "x" * 200,
+                        "image": "https://img/x.png",
+                        "technologies": ["React", "Node"],
+                        "demoLink": "https://d",
+                    }
+                    for i in range(projects)
+                ],
+            },
+            "contact-3-4": {"email": "a@b.c", "phone": "123", "availability": "sí"},
+        },
+    }
+
+def mean_us(function, repeat: int) -> float:
+    function()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, nargs="+", default=[2, 20, 200], help="Proyectos por portfolio")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for projects in args.projects:
+        content = editor_content(projects)
+        raw = orjson.dumps({"name": "P", "content": content})
+        kb = len(raw) / 1024
+        untyped = mean_us(lambda: UntypedUpdate.model_validate(json.loads(raw)), args.repeat)
+        typed = mean_us(lambda: schemas.PortfolioUpdate.model_validate(json.loads(raw)), args.repeat)
+        limits = mean_us(lambda: schemas.check_content_limits(content), args.repeat)
+        print(f"{kb:7.1f} KB  sin tipar {untyped:7.0f} us  tipado {typed:7.0f} us  "
+              f"(límites {limits:5.0f} us)  extra/KB {(typed - untyped) / kb:5.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,14 @@ export default function AuthSuccessPage() {
       
       // Guardar en localStorage
       localStorage.setItem('user', JSON.stringify(user));
+
+      // Token de acceso (JWT de vida corta) en el fragmento de la URL; se quita del historial
+      const fragment = new URLSearchParams(window.location.hash.slice(1));
+      const accessToken = fragment.get('access_token');
+      if (accessToken) {
+        localStorage.setItem('access_token', accessToken);
+        window.history.replaceState(null, '', window.location.pathname + window.location.search);
+      }
       
       // Actualizar el contexto
       setUser(user);
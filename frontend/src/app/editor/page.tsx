@@ -983,7 +983,8 @@ export default function VisualWebEditor() {
   };
 
   // Función para guardar el estado del proyecto
-  const saveProjectState = async () => {
+  // (autosave: el backend puede agrupar autoguardados seguidos antes de escribirlos)
+  const saveProjectState = async (autosave = false) => {
     if (!currentPortfolio || !user || isSaving) {
       console.log('Skipping save: missing data or already saving');
       return;
@@ -1010,10 +1011,14 @@ export default function VisualWebEditor() {
     try {
       console.log('Guardando portfolio:', projectState);
       
+      // Con token, el límite de peticiones del backend se aplica por usuario y no por IP
+      const accessToken = localStorage.getItem('access_token');
       const response = await fetch(`http://localhost:8000/api/portfolios/${currentPortfolio.id}`, {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
+          ...(autosave ? { 'X-Autosave': '1' } : {}),
+          ...(accessToken ? { Authorization: `Bearer ${accessToken}` } : {}),
         },
         body: JSON.stringify(projectState),
       });
@@ -1121,7 +1126,7 @@ export default function VisualWebEditor() {
       console.log('🔄 Cambios detectados, programando guardado...');
       
       const timeoutId = setTimeout(() => {
-        saveProjectState();
+        saveProjectState(true);
       }, 1500); // Reducido a 1.5 segundos
 
       return () => {
@@ -1148,14 +1153,8 @@ export default function VisualWebEditor() {
       await forceSave();
     }
     
-    // Usar el nombre del portfolio para la URL pública
-    const portfolioSlug = projectName.toLowerCase()
-      .replace(/[^a-z0-9\s-]/g, '') // remover caracteres especiales
-      .replace(/\s+/g, '-') // espacios a guiones
-      .replace(/-+/g, '-') // múltiples guiones a uno
-      .trim();
-    
-    const previewUrl = `/p/${portfolioSlug}`;
+    // Previsualización en vivo: recibe los guardados del editor por SSE, también en otro dispositivo
+    const previewUrl = `/preview?portfolio=${currentPortfolio.id}`;
     window.open(previewUrl, '_blank');
   };
 
@@ -1310,7 +1309,7 @@ export default function VisualWebEditor() {
   const generatePublicUrl = () => {
     if (typeof window === 'undefined') return '';
     
-    const portfolioSlug = projectName.toLowerCase()
+    const portfolioSlug = currentPortfolio?.slug || projectName.toLowerCase()
       .replace(/[^a-z0-9\s-]/g, '') // remover caracteres especiales
       .replace(/\s+/g, '-') // espacios a guiones
       .replace(/-+/g, '-') // múltiples guiones a uno
@@ -21,6 +21,7 @@ import { useAlert } from '@/contexts/AlertContext';
 interface Portfolio {
   id: number;
   name: string;
+  slug?: string;
   content: {
     blocks: string[];
     blockProperties: { [key: string]: any };
@@ -37,7 +38,7 @@ const PortfolioPreview = ({ portfolio }: { portfolio: Portfolio }) => {
   const [previewError, setPreviewError] = useState(false);
   const iframeRef = useRef<HTMLIFrameElement>(null);
   
-  const portfolioSlug = portfolio.name.toLowerCase()
+  const portfolioSlug = portfolio.slug || portfolio.name.toLowerCase()
     .replace(/[^a-z0-9\s-]/g, '')
     .replace(/\s+/g, '-')
     .replace(/-+/g, '-')
@@ -477,7 +478,7 @@ export default function PortfoliosPage() {
                     </Link>
                     
                     <Link
-                      href={`/p/${generatePortfolioSlug(portfolio.name)}`}
+                      href={`/p/${portfolio.slug || generatePortfolioSlug(portfolio.name)}`}
                       target="_blank"
                       rel="noopener noreferrer"
                       className="flex items-center justify-center gap-2 px-4 py-2 border border-gray-300 dark:border-gray-600 text-gray-700 dark:text-gray-300 hover:bg-gray-100 dark:hover:bg-gray-600 rounded-lg font-medium transition-colors"
@@ -1,6 +1,6 @@
 "use client"
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Code, 
   ArrowLeft, 
@@ -25,6 +25,19 @@ interface ProjectState {
   lastUpdated: string;
 }
 
+// Diff por bloques de un guardado (evento SSE "patch")
+interface PortfolioPatch {
+  version: number;
+  base_version: number;
+  name: string;
+  set: { [key: string]: any };
+  removed: string[];
+  blocks?: string[];
+  meta?: { [key: string]: any };
+}
+
+const API_URL = 'http://localhost:8000';
+
 // Componente para renderizar un bloque en la previsualización
 const PreviewBlock: React.FC<{
   id: string;
@@ -48,6 +61,87 @@ export default function PreviewPage() {
   const [isLoading, setIsLoading] = useState(true);
   const [viewMode, setViewMode] = useState<'desktop' | 'tablet' | 'mobile'>('desktop');
   const [lastRefresh, setLastRefresh] = useState<Date>(new Date());
+  // ?portfolio=<id>: cambios en vivo desde el backend; sin él, localStorage (undefined: aún sin leer la URL)
+  const [portfolioId, setPortfolioId] = useState<string | null | undefined>(undefined);
+  // Versión mostrada: los diffs solo se aplican sobre la versión de la que parten
+  const versionRef = useRef(0);
+
+  useEffect(() => {
+    setPortfolioId(new URLSearchParams(window.location.search).get('portfolio'));
+  }, []);
+
+  const applyPortfolio = (portfolio: any) => {
+    const content = portfolio.content || {};
+    versionRef.current = portfolio.version;
+    setProjectState({
+      projectName: portfolio.name,
+      blocks: content.blocks || [],
+      blockProperties: content.blockProperties || {},
+      lastUpdated: content.lastUpdated || portfolio.updated_at,
+    });
+    setLastRefresh(new Date());
+    setIsLoading(false);
+  };
+
+  // Cargar el portfolio completo desde el backend
+  const fetchPortfolio = async (id: string) => {
+    try {
+      const response = await fetch(`${API_URL}/api/portfolios/${id}`);
+      if (response.ok) {
+        applyPortfolio(await response.json());
+      } else {
+        setProjectState(null);
+        setIsLoading(false);
+      }
+    } catch (error) {
+      console.error('Error loading portfolio:', error);
+      setIsLoading(false);
+    }
+  };
+
+  // Suscripción SSE: snapshot al conectar y un diff por cada guardado
+  useEffect(() => {
+    if (!portfolioId) return;
+
+    const source = new EventSource(`${API_URL}/api/portfolios/${portfolioId}/events`);
+    const parse = (e: Event) => JSON.parse((e as MessageEvent).data);
+
+    source.addEventListener('snapshot', (e) => applyPortfolio(parse(e)));
+    source.addEventListener('content', (e) => {
+      const data = parse(e);
+      applyPortfolio({ version: data.version, name: data.name, content: data.content });
+    });
+    source.addEventListener('patch', (e) => {
+      const patch: PortfolioPatch = parse(e);
+      if (patch.version <= versionRef.current) return;
+      if (patch.base_version !== versionRef.current) {
+        // Falta algún cambio intermedio: recargar entero
+        fetchPortfolio(portfolioId);
+        return;
+      }
+      versionRef.current = patch.version;
+      setProjectState((previous) => {
+        if (!previous) return previous;
+        const blockProperties = { ...previous.blockProperties, ...patch.set };
+        patch.removed.forEach((blockId) => delete blockProperties[blockId]);
+        return {
+          projectName: patch.name,
+          blocks: patch.blocks ?? previous.blocks,
+          blockProperties,
+          lastUpdated: patch.meta?.lastUpdated ?? previous.lastUpdated,
+        };
+      });
+      setLastRefresh(new Date());
+    });
+    // El servidor descartó eventos porque esta pestaña iba retrasada
+    source.addEventListener('resync', () => fetchPortfolio(portfolioId));
+    source.addEventListener('deleted', () => {
+      source.close();
+      setProjectState(null);
+    });
+
+    return () => source.close();
+  }, [portfolioId]);
 
   // Cargar datos del proyecto desde localStorage
   const loadProjectData = () => {
@@ -69,8 +163,10 @@ export default function PreviewPage() {
     }
   };
 
-  // Cargar datos al montar el componente
+  // Sin portfolio en la URL: datos del editor en este mismo navegador
   useEffect(() => {
+    if (portfolioId !== null) return;
+
     loadProjectData();
     
     // Escuchar cambios en localStorage (para actualizaciones en tiempo real)
@@ -97,7 +193,7 @@ export default function PreviewPage() {
       window.removeEventListener('storage', handleStorageChange);
       clearInterval(interval);
     };
-  }, [projectState?.lastUpdated]);
+  }, [projectState?.lastUpdated, portfolioId]);
 
   // Función para obtener el ancho según el modo de vista
   const getViewportWidth = () => {
@@ -234,7 +330,7 @@ export default function PreviewPage() {
 
             {/* Botones de acción */}
             <button
-              onClick={loadProjectData}
+              onClick={() => (portfolioId ? fetchPortfolio(portfolioId) : loadProjectData())}
               className="flex items-center gap-2 px-3 py-2 text-gray-600 dark:text-gray-300 hover:bg-gray-100 dark:hover:bg-gray-700 rounded-lg transition-colors"
               title="Actualizar"
             >
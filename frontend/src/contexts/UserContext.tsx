@@ -48,6 +48,7 @@ export const UserProvider = ({ children }: { children: ReactNode }) => {
   const logout = () => {
     console.log('UserContext: Logging out');
     localStorage.removeItem('user');
+    localStorage.removeItem('access_token');
     setUser(null);
     window.location.href = '/';
   };